@@ -1,21 +1,49 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask_migrate import Migrate, upgrade as upgrade_database
 from dotenv import load_dotenv
+import hmac
 import os
-from sqlalchemy import text
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
 from models import db
 from supabase import create_client, Client
-from models import Audit, AuditStep, AuditMedia, AuditFinding
+from models import Audit, AuditStep, AuditMedia, AuditFinding, ArchivedAuditStep, MediaBlob, Organization, UtilityBill
 from datetime import datetime
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
+import click
+from idempotency import init_app as init_idempotency
+from ratelimit import init_app as init_rate_limits
+from encoding import init_app as init_encoding, rows
+from archive import (ARCHIVE_AFTER_MONTHS, ARCHIVE_BATCH_SIZE, PARTITION_MONTHS_AHEAD, archive_completed_audits,
+                     archive_models, compact_all_changes, drop_empty_partitions, ensure_partitions, is_archived,
+                     refresh_completion, restore_audit)
+from local_storage import LocalStorageClient, register_signed_upload_route
+from replicas import init_app as init_replicas
+from sharding import (current_organization_id, init_app as init_sharding, router, shard_names, tenant_engine,
+                      use_organization, use_shard)
+from instrumentation import init_app as init_instrumentation, observe_storage
+from findings_engine import evaluate_audit, run_rules
+from savings import audit_savings, portfolio_savings
+from sync import sync_audit
+from media_metadata import enqueue_extract, extract_pending_media, read_media_headers, search_media
+from direct_uploads import (EXPIRE_AFTER_HOURS, complete_upload, expire_pending_uploads, object_path,
+                            organization_for_path, upload_path)
+from media_archive import SIGNED_URL_TTL, archive_entries, open_url, stream_archive
+from utility_bills import content_hash, enqueue_parse, parse_pending_bills, register_bill
 
 # Load environment variables first
 load_dotenv()
 
 # Create Flask app
 app = Flask(__name__)
+# Behind a load balancer remote_addr is the proxy. Deployments behind one set
+# TRUSTED_PROXIES to the number of hops in front of the app, and the client is taken from
+# X-Forwarded-For. Off by default: without a proxy, any client could forge the header.
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '0'))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
 # Configure DB from environment
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
@@ -25,6 +53,12 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 migrate = Migrate(app, db)
 CORS(app)
+init_instrumentation(app)
+init_sharding(app)
+init_replicas(app, db)
+init_encoding(app)  # between instrumentation and idempotency, see encoding.py
+init_rate_limits(app)  # before idempotency reads the body
+init_idempotency(app)
 
 from models import Property
 
@@ -32,29 +66,51 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 SUPABASE_BUCKET_NAME = os.getenv("SUPABASE_BUCKET_NAME")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# LOCAL_STORAGE_DIR swaps Supabase Storage for a filesystem stand-in (dev and benchmarks)
+if os.getenv("LOCAL_STORAGE_DIR"):
+    supabase = LocalStorageClient(os.getenv("LOCAL_STORAGE_DIR"), base_url=os.getenv("LOCAL_STORAGE_URL", ""),
+                                  secret=os.getenv("LOCAL_STORAGE_SECRET"))
+    register_signed_upload_route(app, supabase)
+else:
+    supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+
+def public_url(path):
+    return f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET_NAME}/{path}"
+
+# ---------------------- ORGANIZATIONS ----------------------
+@app.route('/api/organizations', methods=['GET', 'POST'])
+def handle_organizations():
+    if request.method == 'GET':
+        organizations = Organization.query.order_by(Organization.id).all()
+        return jsonify([
+            {"id": o.id, "name": o.name, "shard": o.shard or "default"}
+            for o in organizations
+        ])
+
+    data = request.get_json()
+    if not data.get('name'):
+        return jsonify({"error": "Missing name"}), 400
+    shard = data.get('shard')
+    if shard is not None and shard not in shard_names():
+        return jsonify({"error": f"Unknown shard '{shard}'"}), 400
+
+    organization = Organization(name=data['name'], shard=None if shard == 'default' else shard)
+    db.session.add(organization)
+    db.session.commit()
+    router.invalidate()
+    return jsonify({"id": organization.id, "name": organization.name, "shard": organization.shard or "default"}), 201
 
 # Properties Endpoints
 @app.route('/api/properties', methods=['GET', 'POST'])
 def handle_properties():
     if request.method == 'GET':
-        with db.engine.connect() as conn:
+        with tenant_engine().connect() as conn:
             result = conn.execute(text("""
-                SELECT id, street, city, state, zip_code, year_built, sqft FROM properties
-            """))
-            properties = [
-                {
-                    "id": row.id,
-                    "street": row.street,
-                    "city": row.city,
-                    "state": row.state,
-                    "zip_code": row.zip_code,
-                    "year_built": row.year_built,
-                    "sqft": row.sqft
-                }
-                for row in result
-            ]
-            return jsonify(properties)
+                SELECT id, street, city, state, zip_code, year_built, sqft, latitude, longitude FROM properties
+                WHERE organization_id = :org
+            """), {"org": current_organization_id()})
+            return jsonify(rows(result))
     elif request.method == 'POST':
         data = request.get_json()
         new_property = Property(
@@ -63,7 +119,9 @@ def handle_properties():
             state=data.get('state'),
             zip_code=data.get('zip_code'),
             year_built=data.get('year_built'),
-            sqft=data.get('sqft')
+            sqft=data.get('sqft'),
+            latitude=data.get('latitude'),
+            longitude=data.get('longitude')
         )
         db.session.add(new_property)
         db.session.commit()
@@ -71,12 +129,12 @@ def handle_properties():
 
 @app.route('/api/properties/<int:property_id>', methods=['GET'])
 def get_property(property_id):
-    with db.engine.connect() as conn:
+    with tenant_engine().connect() as conn:
         result = conn.execute(text("""
-            SELECT id, street, city, state, zip_code, year_built, sqft, utility_bill_name
+            SELECT id, street, city, state, zip_code, year_built, sqft, latitude, longitude, utility_bill_name
             FROM properties
-            WHERE id = :id
-        """), {"id": property_id}).fetchone()
+            WHERE id = :id AND organization_id = :org
+        """), {"id": property_id, "org": current_organization_id()}).fetchone()
 
         if result:
             return jsonify({
@@ -87,6 +145,8 @@ def get_property(property_id):
                 "zip_code": result.zip_code,
                 "year_built": result.year_built,
                 "sqft": result.sqft,
+                "latitude": result.latitude,
+                "longitude": result.longitude,
                 "utility_bill_name": result.utility_bill_name  # ✅ NEW 
             })
         else:
@@ -97,20 +157,22 @@ def update_property(id):
     data = request.get_json()
     stmt = text("""
         UPDATE properties
-        SET street=:street, city=:city, state=:state, zip_code=:zip_code, year_built=:year_built, sqft=:sqft
-        WHERE id=:id
+        SET street=:street, city=:city, state=:state, zip_code=:zip_code, year_built=:year_built, sqft=:sqft,
+            latitude=COALESCE(:latitude, latitude), longitude=COALESCE(:longitude, longitude),
+            updated_at=:updated_at
+        WHERE id=:id AND organization_id=:org
     """)
-    with db.engine.connect() as conn:
-        conn.execute(stmt, {**data, "id": id})
+    with tenant_engine().connect() as conn:
+        conn.execute(stmt, {"latitude": None, "longitude": None, **data, "id": id, "updated_at": datetime.utcnow(), "org": current_organization_id()})
         conn.commit()
     return jsonify({"message": "Property updated"})
 
 @app.route('/api/properties/<int:property_id>', methods=['DELETE'])
 def delete_property(property_id):
-    with db.engine.begin() as conn:
+    with tenant_engine().begin() as conn:
         result = conn.execute(
-            text("DELETE FROM properties WHERE id = :id RETURNING id"),
-            {"id": property_id}
+            text("DELETE FROM properties WHERE id = :id AND organization_id = :org RETURNING id"),
+            {"id": property_id, "org": current_organization_id()}
         )
         deleted = result.fetchone()
         if deleted:
@@ -129,34 +191,84 @@ def upload_utility_bill(property_id):
     file_content = file.read()
 
     try:
-        # Upload to Supabase Storage
-        supabase.storage.from_(SUPABASE_BUCKET_NAME).upload(
-            path=filename,
-            file=file_content,
-            file_options={"content-type": file.mimetype}
-        )
-
-        public_url = f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET_NAME}/{filename}"
-
-        # Save URL + file name in DB
         property_obj = Property.query.get(property_id)
         if not property_obj:
             return jsonify({"error": "Property not found"}), 404
 
+        # Re-uploads of an identical file skip both the storage write and the parse
+        existing = UtilityBill.query.filter_by(
+            property_id=property_id, content_hash=content_hash(file_content)
+        ).first()
+        if existing:
+            filename = existing.storage_path
+        else:
+            # Upload to Supabase Storage
+            with observe_storage('upload'):
+                supabase.storage.from_(SUPABASE_BUCKET_NAME).upload(
+                    path=filename,
+                    file=file_content,
+                    file_options={"content-type": file.mimetype}
+                )
+
+        public_url = f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET_NAME}/{filename}"
+        bill, needs_parse = register_bill(property_id, original_filename, filename, file_content)
+
+        # Save URL + file name in DB
         property_obj.utility_bill_url = public_url
         property_obj.utility_bill_name = original_filename  # ✅ NEW
         db.session.commit()
 
+        if needs_parse:
+            enqueue_parse(app, bill.id, original_filename, file_content)
+
         return jsonify({
             'message': 'Uploaded and saved successfully',
             'url': public_url,
-            'fileName': original_filename
+            'fileName': original_filename,
+            'billId': bill.id,
+            'parseStatus': bill.status
         }), 200
 
     except Exception as e:
         print(e)
         return jsonify({'error': 'Upload failed'}), 500
 
+@app.route('/api/properties/<int:property_id>/usage', methods=['GET'])
+def get_property_usage(property_id):
+    with tenant_engine().connect() as conn:
+        result = conn.execute(text("""
+            SELECT u.fuel, u.unit, u.period_start, u.period_end, u.usage, u.cost, u.bill_id
+            FROM utility_usage u
+            JOIN properties p ON p.id = u.property_id
+            WHERE u.property_id = :id AND p.organization_id = :org
+            ORDER BY u.period_start, u.fuel
+        """), {"id": property_id, "org": current_organization_id()})
+        return jsonify([
+            {
+                "fuel": row.fuel,
+                "unit": row.unit,
+                "period_start": str(row.period_start),
+                "period_end": str(row.period_end),
+                "usage": row.usage,
+                "cost": row.cost,
+                "bill_id": row.bill_id
+            }
+            for row in result
+        ])
+
+@app.cli.command('parse-bills')
+@click.option('--workers', type=int, default=None, help='Parser processes (defaults to CPU count).')
+def parse_bills_command(workers):
+    def fetch(path):
+        with observe_storage('download'):
+            return supabase.storage.from_(SUPABASE_BUCKET_NAME).download(path)
+
+    for shard in shard_names():
+        with use_shard(shard):
+            parsed, failed = parse_pending_bills(fetch, workers=workers)
+        db.session.remove()
+        click.echo(f"[{shard}] Parsed {parsed} bills, {failed} failed")
+
 # ---------------------- AUDITS ----------------------
 @app.route('/api/properties/<int:property_id>/audits', methods=['POST'])
 @app.route('/api/audits', methods=['POST'])
@@ -166,6 +278,8 @@ def create_audit():
 
     if not property_id:
         return jsonify({"error": "Missing property_id"}), 400
+    if not Property.query.get(property_id):
+        return jsonify({"error": "Property not found"}), 404
 
     try:
         new_audit = Audit(property_id=property_id)
@@ -186,6 +300,7 @@ def get_audit(audit_id):
     audit = Audit.query.get(audit_id)
     if not audit:
         return jsonify({"error": "Audit not found"}), 404
+    step_model, _ = archive_models(audit.archived_at is not None)
 
     return jsonify({
         "id": audit.id,
@@ -200,7 +315,7 @@ def get_audit(audit_id):
                 "label": step.label,
                 "is_completed": step.is_completed
             }
-            for step in audit.steps
+            for step in step_model.query.filter_by(audit_id=audit.id)
         ]
     })
 
@@ -219,29 +334,27 @@ def get_audit_by_property(property_id):
 # ---------------------- AUDIT STEPS ----------------------
 @app.route('/api/audits/<int:audit_id>/steps', methods=['GET'])
 def get_audit_steps(audit_id):
-    steps = AuditStep.query.filter_by(audit_id=audit_id).all()
-    result = []
-
-    for step in steps:
-        media_items = AuditMedia.query.filter_by(step_id=step.id).all()
-        media = [{
-            "id": m.id,
-            "media_url": m.media_url,
-            "file_name": m.file_name,
-            "media_type": m.media_type,
-            "created_at": m.created_at.isoformat()
-        } for m in media_items]
-
-        result.append({
-            "id": step.id,
-            "label": step.label,
-            "step_type": step.step_type,
-            "is_completed": step.is_completed,
-            "not_accessible": step.not_accessible,
-            "media": media  # ✅ Add this
-        })
+    step_model, media_model = archive_models(is_archived(audit_id))
+    # Two column queries instead of ORM objects and a media query per step
+    steps = rows(db.session.execute(
+        select(step_model.id, step_model.label, step_model.step_type, step_model.is_completed,
+               step_model.not_accessible)
+        .where(step_model.audit_id == audit_id)
+        .order_by(step_model.id)
+    ))
+    media_by_step = {step["id"]: step.setdefault("media", []) for step in steps}
+    media = db.session.execute(
+        select(media_model.step_id, media_model.id, media_model.media_url, media_model.file_name,
+               media_model.media_type, media_model.created_at)
+        .where(media_model.audit_id == audit_id, media_model.status == 'ready')
+        .order_by(media_model.id)
+    )
+    keys = tuple(media.keys())[1:]
+    for step_id, *values in media:
+        if step_id in media_by_step:
+            media_by_step[step_id].append(dict(zip(keys, values)))
 
-    return jsonify(result)
+    return jsonify(steps)
 
 @app.route('/api/audits/<int:audit_id>/steps', methods=['POST'])
 def create_or_update_audit_step(audit_id):
@@ -254,6 +367,10 @@ def create_or_update_audit_step(audit_id):
 
     if not step_type or not label:
         return jsonify({'error': 'Missing step_type or label'}), 400
+    audit = Audit.query.get(audit_id)
+    if not audit:
+        return jsonify({"error": "Audit not found"}), 404
+    restore_audit(audit)
 
     # Check if the step already exists
     existing_step = AuditStep.query.filter_by(
@@ -271,6 +388,8 @@ def create_or_update_audit_step(audit_id):
         if notes is not None:
             existing_step.notes = notes
 
+        db.session.flush()
+        refresh_completion(audit)
         db.session.commit()
         return jsonify({"message": "Step updated", "id": existing_step.id}), 200
 
@@ -285,16 +404,19 @@ def create_or_update_audit_step(audit_id):
             notes=notes
         )
         db.session.add(new_step)
+        db.session.flush()
+        refresh_completion(audit)
         db.session.commit()
         return jsonify({"message": "Step created", "id": new_step.id}), 201
 
 @app.route('/api/audits/<int:audit_id>/steps/<string:step_label>/media', methods=['GET'])
 def get_media_by_step_label(audit_id, step_label):
-    step = AuditStep.query.filter_by(audit_id=audit_id, label=step_label).first()
+    step_model, media_model = archive_models(is_archived(audit_id))
+    step = step_model.query.filter_by(audit_id=audit_id, label=step_label).first()
     if not step:
         return jsonify([])
 
-    media_items = AuditMedia.query.filter_by(step_id=step.id).all()
+    media_items = media_model.query.filter_by(step_id=step.id, status='ready').all()
     return jsonify([
         {
             "id": m.id,
@@ -316,11 +438,12 @@ def upload_step_media(step_id):
     file_content = file.read()
 
     try:
-        supabase.storage.from_(SUPABASE_BUCKET_NAME).update(
-            path=filename,
-            file=file_content,
-            file_options={"content-type": file.mimetype}
-        )
+        with observe_storage('update'):
+            supabase.storage.from_(SUPABASE_BUCKET_NAME).update(
+                path=filename,
+                file=file_content,
+                file_options={"content-type": file.mimetype}
+            )
         public_url = f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET_NAME}/{filename}"
 
         media = AuditMedia(
@@ -343,15 +466,70 @@ def upload_step_media(step_id):
 
 @app.route('/api/audits/<int:audit_id>/media', methods=['GET'])
 def get_audit_media(audit_id):
-    media = AuditMedia.query.filter_by(audit_id=audit_id).all()
-    return jsonify([{
-        "id": m.id,
-        "audit_id": m.audit_id,
-        "step_type": m.step_type,
-        "side": m.side,
-        "media_url": m.media_url,
-        "created_at": m.created_at.isoformat()
-    } for m in media])
+    _, media_model = archive_models(is_archived(audit_id))
+    return jsonify(rows(db.session.execute(
+        select(media_model.id, media_model.audit_id, media_model.step_type, media_model.side,
+               media_model.media_url, media_model.created_at)
+        .where(media_model.audit_id == audit_id, media_model.status == 'ready')
+    )))
+
+@app.route('/api/audits/<int:audit_id>/media/archive', methods=['GET'])
+def download_audit_media_archive(audit_id):
+    audit = Audit.query.get(audit_id)
+    if not audit:
+        return jsonify({"error": "Audit not found"}), 404
+    _, media_model = archive_models(audit.archived_at is not None)
+    media = (media_model.query.filter_by(audit_id=audit_id, status='ready')
+             .order_by(media_model.step_type, media_model.side, media_model.id).all())
+    # Resolved now: the archive is streamed after the request context is gone
+    prefix = public_url('')
+    entries = archive_entries(media, lambda m: object_path(m, prefix))
+    bucket = supabase.storage.from_(SUPABASE_BUCKET_NAME)
+
+    def open_object(path):
+        # Streamed from a signed URL in chunks; download() would hold the whole object
+        with observe_storage('sign'):
+            url = bucket.create_signed_url(path, SIGNED_URL_TTL)['signedURL']
+        with observe_storage('download'):
+            return open_url(url)
+
+    stream = stream_archive(entries, open_object, observe_read=lambda: observe_storage('read'))
+    return Response(stream, mimetype='application/zip', headers={
+        "Content-Disposition": f'attachment; filename="audit_{audit_id}_media.zip"'
+    })
+
+@app.route('/api/audits/<int:audit_id>/media/search', methods=['GET'])
+def search_audit_media(audit_id):
+    if not Audit.query.get(audit_id):
+        return jsonify({"error": "Audit not found"}), 404
+    try:
+        return jsonify(search_media(request.args, audit_id=audit_id, archived=is_archived(audit_id)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/media/search', methods=['GET'])
+def search_portfolio_media():
+    try:
+        return jsonify(search_media(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.cli.command('extract-media')
+@click.option('--workers', type=int, default=None, help='Extractor processes (defaults to CPU count).')
+def extract_media_command(workers):
+    bucket = supabase.storage.from_(SUPABASE_BUCKET_NAME)
+
+    def fetch(path):
+        # Only the headers, through range requests on a signed URL
+        with observe_storage('download'):
+            url = bucket.create_signed_url(path, SIGNED_URL_TTL)['signedURL']
+            return read_media_headers(lambda byte_range: open_url(url, headers={'Range': byte_range}))
+
+    for shard in shard_names():
+        with use_shard(shard):
+            extracted, failed = extract_pending_media(fetch, url_prefix=public_url(''), workers=workers)
+        db.session.remove()
+        click.echo(f"[{shard}] Extracted metadata for {extracted} media, {failed} failed")
 
 @app.route('/api/audits/<int:audit_id>/steps/<string:step_label>/upload', methods=['POST'])
 def upload_media_by_step_label(audit_id, step_label):
@@ -368,6 +546,10 @@ def upload_media_by_step_label(audit_id, step_label):
 
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
+    audit = Audit.query.get(audit_id)
+    if not audit:
+        return jsonify({"error": "Audit not found"}), 404
+    restore_audit(audit)
 
     file = request.files['file']
     filename = secure_filename(f"{audit_id}_{step_label}_{file.filename}")
@@ -384,6 +566,8 @@ def upload_media_by_step_label(audit_id, step_label):
         # Create new step with correct step_type
         step = AuditStep(audit_id=audit_id, label=step_label, step_type=step_type)
         db.session.add(step)
+        db.session.flush()
+        refresh_completion(audit)
         db.session.commit()
     if not step:
         step = AuditStep(audit_id=audit_id, label=step_label, step_type=step_type)
@@ -392,11 +576,12 @@ def upload_media_by_step_label(audit_id, step_label):
 
     # Upload to Supabase
     try:
-        supabase.storage.from_(SUPABASE_BUCKET_NAME).update(
-            path=filename,
-            file=file_content,
-            file_options={"content-type": file.mimetype}
-        )
+        with observe_storage('update'):
+            supabase.storage.from_(SUPABASE_BUCKET_NAME).update(
+                path=filename,
+                file=file_content,
+                file_options={"content-type": file.mimetype}
+            )
         public_url = f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET_NAME}/{filename}"
 
         media = AuditMedia(
@@ -410,6 +595,7 @@ def upload_media_by_step_label(audit_id, step_label):
         )
         db.session.add(media)
         db.session.commit()
+        enqueue_extract(app, media.id, file.filename, file_content)
 
         return jsonify({
             "message": "Uploaded",
@@ -440,10 +626,160 @@ def agent_chat():
 
     return jsonify({"reply": reply})
 
+# ---------------------- DIRECT UPLOADS ----------------------
+@app.route('/api/audits/<int:audit_id>/steps/<string:step_label>/upload-url', methods=['POST'])
+def create_upload_url(audit_id, step_label):
+    data = request.get_json(silent=True) or {}
+    file_name = data.get('file_name')
+    step_type = data.get('step_type') or 'exterior'
+    media_type = data.get('media_type', 'photo')
+    if not file_name:
+        return jsonify({'error': 'Missing file_name'}), 400
+    audit = Audit.query.get(audit_id)
+    if not audit:
+        return jsonify({"error": "Audit not found"}), 404
+    restore_audit(audit)
+
+    step = AuditStep.query.filter_by(audit_id=audit_id, label=step_label).first()
+    if not step:
+        step = AuditStep(audit_id=audit_id, label=step_label, step_type=step_type)
+        db.session.add(step)
+        db.session.flush()
+        refresh_completion(audit)
+
+    path = upload_path(audit_id, file_name)
+    try:
+        with observe_storage('sign'):
+            signed = supabase.storage.from_(SUPABASE_BUCKET_NAME).create_signed_upload_url(path)
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Could not sign upload: {e}")
+        return jsonify({'error': 'Could not create upload URL'}), 500
+
+    media = AuditMedia(
+        audit_id=audit_id,
+        step_id=step.id,
+        step_type=step.step_type,
+        side=step.label.replace(" Side", ""),
+        media_url=public_url(path),
+        file_name=file_name,
+        media_type=media_type,
+        status='pending',
+        storage_path=path
+    )
+    db.session.add(media)
+    db.session.commit()
+    return jsonify({
+        "media_id": media.id,
+        "step_id": step.id,
+        "upload_url": signed.get('signed_url') or signed.get('signedUrl'),
+        "token": signed.get('token'),
+        "storage_path": path,
+        "media_url": media.media_url
+    }), 201
+
+@app.route('/api/media/<int:media_id>/complete', methods=['POST'])
+def complete_media_upload(media_id):
+    media = AuditMedia.query.get(media_id)
+    if not media:
+        return jsonify({"error": "Media not found"}), 404
+    with observe_storage('list'):
+        uploaded = complete_upload(media, supabase.storage.from_(SUPABASE_BUCKET_NAME))
+    if not uploaded:
+        return jsonify({"error": "Upload not found in storage"}), 409
+    db.session.commit()
+    return jsonify({"id": media.id, "status": media.status, "media_url": media.media_url}), 200
+
+@app.route('/api/storage/webhook', methods=['POST'])
+def storage_webhook():
+    # Supabase database webhook on storage.objects INSERT
+    secret = os.getenv("STORAGE_WEBHOOK_SECRET")
+    if not secret or not hmac.compare_digest(request.headers.get('X-Webhook-Secret', ''), secret):
+        return jsonify({"error": "Forbidden"}), 403
+    record = (request.get_json(silent=True) or {}).get('record') or {}
+    path = record.get('name')
+    organization_id = organization_for_path(path)
+    if record.get('bucket_id') != SUPABASE_BUCKET_NAME or organization_id is None \
+            or router.shard_for(organization_id) is None:
+        return jsonify({"completed": False}), 200
+
+    with use_organization(organization_id):
+        media = AuditMedia.query.filter_by(storage_path=path, status='pending').first()
+        if media:
+            media.status = 'ready'
+            db.session.commit()
+    return jsonify({"completed": media is not None}), 200
+
+@app.cli.command('expire-uploads')
+@click.option('--hours', type=int, default=EXPIRE_AFTER_HOURS, help='Delete direct uploads still pending after this many hours.')
+def expire_uploads_command(hours):
+    bucket = supabase.storage.from_(SUPABASE_BUCKET_NAME)
+    for shard in shard_names():
+        with use_shard(shard):
+            expired = expire_pending_uploads(bucket, hours=hours)
+        db.session.remove()
+        click.echo(f"[{shard}] Expired {expired} pending uploads")
+
+# ---------------------- SYNC ----------------------
+@app.route('/api/audits/<int:audit_id>/sync', methods=['POST'])
+def sync_audit_route(audit_id):
+    payload = request.get_json(silent=True) or {}
+    # Holding the audit row serializes syncs (and change logging) of one audit
+    audit = Audit.query.filter_by(id=audit_id).with_for_update().first()
+    if not audit:
+        return jsonify({"error": "Audit not found"}), 404
+    try:
+        result = sync_audit(audit, payload, public_url=public_url)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    db.session.commit()
+    return jsonify(result), 200
+
+@app.route('/api/media/<string:sha256>', methods=['PUT'])
+def upload_media_blob(sha256):
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+    sha256 = sha256.lower()
+    existing = MediaBlob.query.filter_by(content_hash=sha256).first()
+    if existing:
+        return jsonify({"content_hash": sha256, "storage_path": existing.storage_path}), 200
+
+    file = request.files['file']
+    file_content = file.read()
+    if content_hash(file_content) != sha256:
+        return jsonify({'error': 'File content does not match its hash'}), 400
+
+    storage_path = f"blobs/{current_organization_id()}/{sha256}"
+    try:
+        with observe_storage('update'):
+            supabase.storage.from_(SUPABASE_BUCKET_NAME).update(
+                path=storage_path,
+                file=file_content,
+                file_options={"content-type": file.mimetype}
+            )
+    except Exception as e:
+        print(f"❌ Blob upload failed: {e}")
+        return jsonify({'error': 'Upload failed'}), 500
+
+    db.session.add(MediaBlob(content_hash=sha256, storage_path=storage_path,
+                             size=len(file_content), content_type=file.mimetype))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # uploaded concurrently; same bytes, same path
+        return jsonify({"content_hash": sha256, "storage_path": storage_path}), 200
+    return jsonify({"content_hash": sha256, "storage_path": storage_path}), 201
+
 # ---------------------- AUDIT FINDINGS ----------------------
 @app.route('/api/steps/<int:step_id>/findings', methods=['POST'])
 def add_finding(step_id):
     data = request.get_json()
+    if not AuditStep.query.get(step_id):
+        archived_step = ArchivedAuditStep.query.get(step_id)
+        if not archived_step:
+            return jsonify({"error": "Step not found"}), 404
+        restore_audit(Audit.query.get(archived_step.audit_id))
     finding = AuditFinding(
         step_id=step_id,
         title=data.get('title'),
@@ -455,6 +791,72 @@ def add_finding(step_id):
     db.session.add(finding)
     db.session.commit()
     return jsonify({"id": finding.id}), 201
+
+@app.route('/api/audits/<int:audit_id>/findings/evaluate', methods=['POST'])
+def evaluate_audit_findings(audit_id):
+    if not Audit.query.get(audit_id):
+        return jsonify({"error": "Audit not found"}), 404
+    written = evaluate_audit(audit_id)
+    return jsonify({"audit_id": audit_id, "findings_written": written}), 200
+
+# ---------------------- SAVINGS ----------------------
+@app.route('/api/audits/<int:audit_id>/savings', methods=['GET'])
+def get_audit_savings(audit_id):
+    if not Audit.query.get(audit_id):
+        return jsonify({"error": "Audit not found"}), 404
+    return jsonify({"audit_id": audit_id, **audit_savings(audit_id)})
+
+@app.route('/api/portfolio/savings', methods=['GET'])
+def get_portfolio_savings():
+    return jsonify(portfolio_savings())
+
+@app.cli.command('run-rules')
+@click.option('--full', is_flag=True, help='Re-evaluate every audit instead of only those touched since the last run.')
+def run_rules_command(full):
+    for shard in shard_names():
+        with use_shard(shard):
+            run = run_rules(full=full)
+            click.echo(f"[{shard}] Rule run {run.id}: {run.audits_evaluated} audits evaluated, "
+                       f"{run.findings_written} findings written")
+        db.session.remove()
+
+@app.cli.command('archive-audits')
+@click.option('--months', type=int, default=ARCHIVE_AFTER_MONTHS, help='Archive audits completed more than this many months ago.')
+@click.option('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='Audits moved per transaction.')
+def archive_audits_command(months, batch_size):
+    for shard in shard_names():
+        with use_shard(shard):
+            archived = archive_completed_audits(months=months, batch_size=batch_size)
+            click.echo(f"[{shard}] Archived {archived} audits")
+        db.session.remove()
+
+@app.cli.command('db-upgrade-shards')
+@click.option('--revision', default='head', help='Revision to upgrade every shard to.')
+def upgrade_shards_command(revision):
+    # The primary is `flask db upgrade`; this migrates the databases and schemas in SHARDS
+    for shard in router.specs():
+        click.echo(f"[{shard}] Upgrading to {revision}")
+        upgrade_database(revision=revision, x_arg=[f'shard={shard}'])
+
+@app.cli.command('compact-sync-changes')
+@click.option('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='Audits compacted per transaction.')
+def compact_sync_changes_command(batch_size):
+    for shard in shard_names():
+        with use_shard(shard):
+            deleted = compact_all_changes(batch_size=batch_size)
+            click.echo(f"[{shard}] Deleted {deleted} superseded sync changes")
+        db.session.remove()
+
+@app.cli.command('maintain-partitions')
+@click.option('--months-ahead', type=int, default=PARTITION_MONTHS_AHEAD, help='Monthly audit_media partitions to create ahead.')
+def maintain_partitions_command(months_ahead):
+    for shard in shard_names():
+        with use_shard(shard), tenant_engine().begin() as conn:
+            created = ensure_partitions(conn, months_ahead=months_ahead)
+            dropped = drop_empty_partitions(conn)
+        for name, moved in created:
+            click.echo(f"[{shard}] Created {name} ({moved} rows moved from the default partition)")
+        click.echo(f"[{shard}] Dropped {len(dropped)} empty partitions" + (f": {', '.join(dropped)}" if dropped else ""))
     
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8080))
@@ -0,0 +1,248 @@
+# archive.py
+# Keeps the hot audit tables small.
+#
+# An audit is completed when every step is completed or marked not accessible. Once it
+# has been completed for ARCHIVE_AFTER_MONTHS, `flask archive-audits` moves its steps,
+# media and findings into the *_archive tables in one transaction and stamps
+# audits.archived_at. The audit row itself stays hot. Read endpoints pick the tables
+# with archive_models(). Writing to an archived audit moves its rows back first.
+#
+# The sync change log (audit_changes) is compacted in the same transaction: superseded
+# changes of an entity are deleted and its latest one kept, so sync tokens and conflict
+# versions are unaffected. `flask compact-sync-changes` compacts audits still in use.
+#
+# On Postgres, audit_media is also range-partitioned by month on created_at (see the
+# b9e4c7a1f352 migration). `flask maintain-partitions` creates the coming months'
+# partitions ahead of time and drops past partitions that archiving has emptied.
+# Rows that land outside every monthly partition go to audit_media_default. The
+# catalog queries and DDL are raw SQL, which schema_translate_map does not rewrite, so
+# they name the shard's schema explicitly.
+# audit_steps is not partitioned: media and findings reference audit_steps.id, and a
+# partitioned table cannot have a unique key that leaves out the partition column.
+import re
+from calendar import monthrange
+from datetime import date, datetime
+
+from sqlalchemy import func, select, text
+
+from models import (db, Audit, AuditChange, AuditStep, AuditMedia, AuditFinding,
+                    ArchivedAuditStep, ArchivedAuditMedia, ArchivedAuditFinding)
+
+ARCHIVE_AFTER_MONTHS = 12
+ARCHIVE_BATCH_SIZE = 500
+PARTITION_MONTHS_AHEAD = 3
+
+PARTITIONED_TABLE = 'audit_media'
+_PARTITION_RE = re.compile(r'^audit_media_(\d{4})_(\d{2})$')
+
+PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    JOIN pg_namespace n ON n.oid = p.relnamespace
+    WHERE p.relname = :table AND n.nspname = :schema
+"""
+
+IS_PARTITIONED_SQL = """
+    SELECT 1
+    FROM pg_partitioned_table pt
+    JOIN pg_class c ON c.oid = pt.partrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relname = :table AND n.nspname = :schema
+"""
+
+# (hot table, archive table); parents before children, so inserts go in this order and
+# deletes in reverse
+_TABLES = [
+    (AuditStep.__table__, ArchivedAuditStep.__table__),
+    (AuditFinding.__table__, ArchivedAuditFinding.__table__),
+    (AuditMedia.__table__, ArchivedAuditMedia.__table__),
+]
+
+
+def _add_months(day, months):
+    """First day of the month `months` away from `day`'s month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def is_archived(audit_id):
+    return db.session.query(Audit.archived_at).filter(Audit.id == audit_id).scalar() is not None
+
+
+def archive_models(archived):
+    """(step model, media model) to read an audit from."""
+    if archived:
+        return ArchivedAuditStep, ArchivedAuditMedia
+    return AuditStep, AuditMedia
+
+
+# ---------------------- COMPLETION ----------------------
+def refresh_completion(audit):
+    """Stamp or clear audit.completed_at after its steps change. Does not commit."""
+    steps = AuditStep.query.filter(AuditStep.audit_id == audit.id)
+    has_steps = db.session.query(steps.exists()).scalar()
+    has_open = db.session.query(steps.filter(
+        ~(AuditStep.is_completed.is_(True) | AuditStep.not_accessible.is_(True))).exists()).scalar()
+    if has_steps and not has_open:
+        if audit.completed_at is None:
+            audit.completed_at = datetime.utcnow()
+    else:
+        audit.completed_at = None
+
+
+# ---------------------- MOVING ROWS ----------------------
+def _scope(table, audit_ids):
+    if 'audit_id' in table.c:
+        return table.c.audit_id.in_(audit_ids)
+    steps = AuditStep.__table__ if table.name == 'audit_findings' else ArchivedAuditStep.__table__
+    return table.c.step_id.in_(select(steps.c.id).where(steps.c.audit_id.in_(audit_ids)))
+
+
+def _move(pairs, audit_ids):
+    for source, target in pairs:
+        names = [c.name for c in target.columns]
+        db.session.execute(target.insert().from_select(
+            names, select(*[source.c[n] for n in names]).where(_scope(source, audit_ids))))
+    for source, _ in reversed(pairs):
+        db.session.execute(source.delete().where(_scope(source, audit_ids)))
+
+
+def archive_completed_audits(months=ARCHIVE_AFTER_MONTHS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive audits completed more than `months` ago. Returns the number archived."""
+    now = datetime.utcnow()
+    month = _add_months(now.date(), -months)
+    cutoff = now.replace(year=month.year, month=month.month, day=min(now.day, monthrange(month.year, month.month)[1]))
+    archived = 0
+    while True:
+        # SKIP LOCKED lets several archivers (or a concurrent edit) share the backlog
+        audit_ids = db.session.execute(
+            select(Audit.id)
+            .where(Audit.completed_at < cutoff, Audit.archived_at.is_(None))
+            .order_by(Audit.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not audit_ids:
+            break
+        _move(_TABLES, audit_ids)
+        compact_changes(audit_ids)
+        db.session.execute(Audit.__table__.update()
+                           .where(Audit.__table__.c.id.in_(audit_ids))
+                           .values(archived_at=now))
+        db.session.commit()
+        archived += len(audit_ids)
+    return archived
+
+
+def compact_changes(audit_ids):
+    """Keep only the latest AuditChange of each entity of `audit_ids`. Does not commit. Returns rows deleted."""
+    changes = AuditChange.__table__
+    # Versions of one audit are written in order under its row lock, so the highest id is the latest
+    latest = (select(func.max(changes.c.id))
+              .where(changes.c.audit_id.in_(audit_ids))
+              .group_by(changes.c.audit_id, changes.c.entity, changes.c.entity_id))
+    return db.session.execute(
+        changes.delete().where(changes.c.audit_id.in_(audit_ids), changes.c.id.not_in(latest))).rowcount
+
+
+def compact_all_changes(batch_size=ARCHIVE_BATCH_SIZE):
+    """compact_changes() over every audit, one batch per transaction. Returns rows deleted."""
+    deleted, last_id = 0, 0
+    while True:
+        audit_ids = db.session.execute(
+            select(Audit.id).where(Audit.id > last_id).order_by(Audit.id).limit(batch_size)).scalars().all()
+        if not audit_ids:
+            return deleted
+        deleted += compact_changes(audit_ids)
+        db.session.commit()
+        last_id = audit_ids[-1]
+
+
+def restore_audit(audit):
+    """Move an archived audit's rows back into the hot tables. Does not commit."""
+    if audit.archived_at is None:
+        return
+    _move([(target, source) for source, target in _TABLES], [audit.id])
+    audit.archived_at = None
+    db.session.flush()
+
+
+# ---------------------- PARTITIONS ----------------------
+def _schema(conn):
+    """The schema `conn` works in: its shard's (see sharding.py), else the search_path's."""
+    schema = (conn.get_execution_options().get('schema_translate_map') or {}).get(None)
+    return schema or conn.execute(text("SELECT current_schema()")).scalar()
+
+
+def _qualified(conn, schema, name):
+    quote = conn.dialect.identifier_preparer.quote_identifier
+    return f'{quote(schema)}.{quote(name)}'
+
+
+def partitioned(conn, schema=None):
+    if conn.dialect.name != 'postgresql':
+        return False
+    params = {'table': PARTITIONED_TABLE, 'schema': schema or _schema(conn)}
+    return conn.execute(text(IS_PARTITIONED_SQL), params).scalar() is not None
+
+
+def _monthly_partitions(conn, schema):
+    partitions = {}
+    for (name,) in conn.execute(text(PARTITIONS_SQL), {'table': PARTITIONED_TABLE, 'schema': schema}):
+        match = _PARTITION_RE.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_partition(conn, month, schema=None):
+    """Attach the partition for `month`, moving any of its rows out of the default partition."""
+    schema = schema or _schema(conn)
+    name = f'{PARTITIONED_TABLE}_{month:%Y_%m}'
+    table, partition = _qualified(conn, schema, PARTITIONED_TABLE), _qualified(conn, schema, name)
+    default = _qualified(conn, schema, f'{PARTITIONED_TABLE}_default')
+    bounds = {'lo': month, 'hi': _add_months(month, 1)}
+    conn.execute(text(f'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    moved = conn.execute(text(
+        f'WITH moved AS (DELETE FROM {default} '
+        f'WHERE created_at >= :lo AND created_at < :hi RETURNING *) '
+        f'INSERT INTO {partition} SELECT * FROM moved'), bounds).rowcount
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {partition} "
+                      f"FOR VALUES FROM ('{bounds['lo']}') TO ('{bounds['hi']}')"))
+    return name, moved
+
+
+def ensure_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create partitions from this month through `months_ahead` months ahead. Returns (name, rows moved) pairs."""
+    schema = _schema(conn) if conn.dialect.name == 'postgresql' else None
+    if not partitioned(conn, schema):
+        return []
+    existing = _monthly_partitions(conn, schema)
+    this_month = date.today().replace(day=1)
+    return [create_partition(conn, month, schema)
+            for month in (_add_months(this_month, i) for i in range(months_ahead + 1))
+            if month not in existing]
+
+
+def drop_empty_partitions(conn):
+    """Drop past monthly partitions that archiving has emptied. Returns their names."""
+    schema = _schema(conn) if conn.dialect.name == 'postgresql' else None
+    if not partitioned(conn, schema):
+        return []
+    table = _qualified(conn, schema, PARTITIONED_TABLE)
+    this_month = date.today().replace(day=1)
+    dropped = []
+    for month, name in sorted(_monthly_partitions(conn, schema).items()):
+        if month >= this_month:
+            continue
+        partition = _qualified(conn, schema, name)
+        # Until commit, no restore or backdated insert can land in it between the check and the drop
+        conn.execute(text(f'LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE'))
+        if conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM {partition})')).scalar():
+            continue
+        conn.execute(text(f'ALTER TABLE {table} DETACH PARTITION {partition}'))
+        conn.execute(text(f'DROP TABLE {partition}'))
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,351 @@
+# bench/run.py
+# Reproducible load test for every route in app.py.
+#
+#   python -m bench.run --properties 500 --requests 5000 --concurrency 16 --output bench.json
+#
+# By default the app runs in-process (threaded werkzeug server) against a fresh SQLite file
+# and the local_storage stand-in, both under a temp directory. Pass --database-url to use a
+# local Postgres instead, and --target to drive an already running server that was started
+# with the same DATABASE_URL / LOCAL_STORAGE_DIR. The request stream is generated up front
+# from --seed, so two runs with the same arguments issue identical requests and their JSON
+# reports can be diffed across commits.
+#
+# Multi-tenant runs: --shards N creates N extra SQLite shard databases (or pass
+# --shard-url name=url for Postgres databases/schemas), and --tenants M spreads M
+# organizations round-robin over the primary and the shards, each seeded with its own
+# portfolio of --properties.
+#
+# Response encoding: --accept application/msgpack and --accept-encoding 'zstd, br, gzip' are sent
+# with every request. The report records bytes on the wire and server CPU per response
+# (from the Server-Timing header), so runs with different encodings can be compared.
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+BUCKET = 'bench'
+PUBLIC_URL = 'http://bench.local'
+WEBHOOK_SECRET = 'bench-webhook-secret'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a SQLite file in a temp directory')
+    parser.add_argument('--storage-dir', help='Local storage root; defaults to a temp directory')
+    parser.add_argument('--target', help='Base URL of a running server; defaults to an in-process server')
+    parser.add_argument('--shards', type=int, default=0, help='Extra SQLite shard databases to create')
+    parser.add_argument('--shard-url', action='append', default=[], metavar='NAME=URL',
+                        help='Use an existing database as a shard (repeatable)')
+    parser.add_argument('--tenants', type=int, default=1, help='Organizations to seed and spread over the shards')
+    parser.add_argument('--replicas', type=int, default=0,
+                        help='Register the primary database N times as a read replica (measures routing overhead)')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--properties', type=int, default=200)
+    parser.add_argument('--audits-per-property', type=int, default=1)
+    parser.add_argument('--steps-per-audit', type=int, default=8)
+    parser.add_argument('--media-per-step', type=int, default=3)
+    parser.add_argument('--findings-per-step', type=int, default=1)
+    parser.add_argument('--usage-months', type=int, default=12)
+    parser.add_argument('--media-bytes', type=int, default=2048)
+    parser.add_argument('--upload-bytes', type=int, default=8192)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=50,
+                        help='Devices the requests are spread over (rate limits are per client)')
+    parser.add_argument('--accept', help='Accept header for every request, e.g. application/msgpack')
+    parser.add_argument('--accept-encoding', help="Accept-Encoding header for every request, e.g. 'zstd, br, gzip'")
+    parser.add_argument('--only', action='append', default=[],
+                        help='Restrict the mix to routes containing this substring (repeatable)')
+    parser.add_argument('--strict', action='store_true', help='Fail if any app route has no workload operation')
+    parser.add_argument('--output', default='bench_results.json')
+    return parser.parse_args(argv)
+
+
+SERVER_CPU = re.compile(r'cpu;dur=([0-9.]+)')
+
+
+def server_cpu_ms(response):
+    match = SERVER_CPU.search(response.getheader('Server-Timing') or '')
+    return float(match.group(1)) if match else None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def route_keys(flask_app):
+    keys = set()
+    for rule in flask_app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        for method in rule.methods - {'HEAD', 'OPTIONS'}:
+            keys.add(f'{method} {rule.rule}')
+    return keys
+
+
+def build_requests(workload, operations, count, rng):
+    keys = list(operations)
+    weights = [operations[k][1] for k in keys]
+    chosen = rng.choices(keys, weights=weights, k=count)
+    return [(key, workload.build(operations[key][0])) for key in chosen]
+
+
+def shard_config(args, workdir):
+    shards = {f'shard{i + 1}': f"sqlite:///{os.path.join(workdir, f'shard{i + 1}.db')}" for i in range(args.shards)}
+    for spec in args.shard_url:
+        name, _, url = spec.partition('=')
+        shards[name] = url
+    return shards
+
+
+def setup_tenants(args, db, router):
+    """Create the schema on every shard and register --tenants organizations. Returns their ids."""
+    from models import Organization
+
+    db.create_all()
+    for name in router.names()[1:]:
+        db.metadata.create_all(router.engine(name))
+    if not Organization.query.get(1):
+        db.session.add(Organization(id=1, name='Default'))
+        db.session.commit()
+
+    organization_ids = [1]
+    names = router.names()
+    for i in range(1, args.tenants):
+        shard = names[i % len(names)]
+        organization = Organization(name=f'Bench Tenant {i + 1}', shard=None if shard == 'default' else shard)
+        db.session.add(organization)
+        db.session.commit()
+        organization_ids.append(organization.id)
+    router.invalidate()
+    return organization_ids
+
+
+def drive(base_url, requests, concurrency):
+    """Replay `requests` with `concurrency` keep-alive connections. Returns samples and wall time."""
+    target = urlparse(base_url)
+    cursor = itertools.count()
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=120)
+        local = []
+        while True:
+            i = next(cursor)
+            if i >= len(requests):
+                break
+            key, (method, path, body, headers) = requests[i]
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                size = len(response.read())  # still encoded: bytes on the wire
+                status = response.status
+                cpu = server_cpu_ms(response)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(target.hostname, target.port, timeout=120)
+                size, status, cpu = 0, 0, None
+            local.append((key, status, time.perf_counter() - start, size, cpu))
+        conn.close()
+        with samples_lock:
+            samples.extend(local)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, wall_time):
+    by_key = defaultdict(list)
+    for sample in samples:
+        by_key[sample[0]].append(sample)
+
+    endpoints = {}
+    for key in sorted(by_key):
+        rows = by_key[key]
+        latencies = sorted(r[2] * 1000 for r in rows)
+        statuses = defaultdict(int)
+        for r in rows:
+            statuses[str(r[1])] += 1
+        cpu = [r[4] for r in rows if r[4] is not None]
+        endpoints[key] = {
+            'count': len(rows),
+            'errors': sum(1 for r in rows if r[1] == 0 or r[1] >= 500),
+            'status': dict(sorted(statuses.items())),
+            'throughput_rps': round(len(rows) / wall_time, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+            'mean_response_bytes': round(sum(r[3] for r in rows) / len(rows), 1),
+            'mean_server_cpu_ms': round(sum(cpu) / len(cpu), 3) if cpu else None,
+        }
+
+    all_latencies = sorted(s[2] * 1000 for s in samples)
+    all_cpu = [s[4] for s in samples if s[4] is not None]
+    totals = {
+        'requests': len(samples),
+        'errors': sum(e['errors'] for e in endpoints.values()),
+        'wall_time_s': round(wall_time, 3),
+        'throughput_rps': round(len(samples) / wall_time, 2) if wall_time else None,
+        'p50_ms': round(percentile(all_latencies, 50), 3) if samples else None,
+        'p95_ms': round(percentile(all_latencies, 95), 3) if samples else None,
+        'p99_ms': round(percentile(all_latencies, 99), 3) if samples else None,
+        'response_bytes': sum(s[3] for s in samples),
+        'mean_server_cpu_ms': round(sum(all_cpu) / len(all_cpu), 3) if all_cpu else None,
+    }
+    return totals, endpoints
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='audit-bench-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['LOCAL_STORAGE_DIR'] = args.storage_dir or os.path.join(workdir, 'storage')
+    os.environ['SUPABASE_URL'] = PUBLIC_URL
+    os.environ['SUPABASE_BUCKET_NAME'] = BUCKET
+    os.environ.setdefault('STORAGE_WEBHOOK_SECRET', WEBHOOK_SECRET)
+    if args.replicas:
+        os.environ['READ_REPLICAS'] = json.dumps([os.environ['DATABASE_URL']] * args.replicas)
+    shards = shard_config(args, workdir)
+    if shards:
+        os.environ['SHARDS'] = json.dumps(shards)
+
+    from app import app as flask_app, supabase  # reads the environment above at import time
+    from models import db
+    from bench.seed import seed
+    from sharding import router, use_organization
+    from bench.workload import OPERATIONS, Workload
+
+    uncovered = sorted(route_keys(flask_app) - set(OPERATIONS))
+    if uncovered:
+        print(f"⚠️ Routes without a workload operation: {', '.join(uncovered)}")
+        if args.strict:
+            return 1
+
+    operations = {k: v for k, v in OPERATIONS.items() if k in route_keys(flask_app)}
+    if args.only:
+        operations = {k: v for k, v in operations.items() if any(o in k for o in args.only)}
+
+    rng = random.Random(args.seed)
+    total_weight = max(sum(w for _, w in operations.values()), 1)
+
+    def expected(key):
+        return int((args.requests + args.warmup) * operations.get(key, (None, 0))[1] / total_weight)
+
+    expected_deletes = expected('DELETE /api/properties/<int:property_id>')
+    expected_completions = expected('POST /api/media/<int:media_id>/complete') + expected('POST /api/storage/webhook')
+
+    seed_start = time.perf_counter()
+    tenants = []
+    with flask_app.app_context():
+        for organization_id in setup_tenants(args, db, router):
+            with use_organization(organization_id):
+                state = seed(
+                    supabase.storage, BUCKET, f'{PUBLIC_URL}/storage/v1/object/public/{BUCKET}', rng,
+                    properties=args.properties, audits_per_property=args.audits_per_property,
+                    steps_per_audit=args.steps_per_audit, media_per_step=args.media_per_step,
+                    findings_per_step=args.findings_per_step, usage_months=args.usage_months,
+                    media_bytes=args.media_bytes, disposable_properties=expected_deletes * 2 + 10,
+                    pending_uploads=expected_completions * 2 + 10,
+                )
+            db.session.remove()
+            tenants.append((organization_id, state))
+    seed_time = time.perf_counter() - seed_start
+    print(f"Seeded {len(tenants)} tenant(s) over {len(router.names())} shard(s): "
+          f"{sum(len(s['property_ids']) for _, s in tenants)} properties, "
+          f"{sum(len(s['audit_ids']) for _, s in tenants)} audits, "
+          f"{sum(len(s['steps']) for _, s in tenants)} steps in {seed_time:.1f}s")
+
+    def sign_upload(path):
+        return supabase.storage.from_(BUCKET).create_signed_upload_url(path)['signed_url']
+
+    encoding_headers = {name: value for name, value in (('Accept', args.accept),
+                                                       ('Accept-Encoding', args.accept_encoding)) if value}
+    workload = Workload(tenants, random.Random(args.seed + 1), upload_bytes=args.upload_bytes,
+                        sign_upload=sign_upload, webhook_secret=os.environ['STORAGE_WEBHOOK_SECRET'],
+                        headers=encoding_headers, clients=args.clients)
+    warmup = build_requests(workload, operations, args.warmup, rng)
+    measured = build_requests(workload, operations, args.requests, rng)
+
+    server = None
+    base_url = args.target
+    if not base_url:
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        drive(base_url, warmup, args.concurrency)
+        samples, wall_time = drive(base_url, measured, args.concurrency)
+    finally:
+        if server:
+            server.shutdown()
+
+    totals, endpoints = summarize(samples, wall_time)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'database': os.environ['DATABASE_URL'].split('://', 1)[0],
+            'shards': router.names(),
+            'replicas': args.replicas,
+            'target': args.target or 'in-process',
+            'seed_time_s': round(seed_time, 3),
+            'config': {k: v for k, v in vars(args).items() if k not in ('output', 'database_url')},
+        },
+        'totals': totals,
+        'endpoints': endpoints,
+        'uncovered_routes': uncovered,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print(f"{totals['requests']} requests in {totals['wall_time_s']}s "
+          f"({totals['throughput_rps']} req/s, p50 {totals['p50_ms']}ms, p99 {totals['p99_ms']}ms, "
+          f"{totals['errors']} errors, {totals['response_bytes']} response bytes, "
+          f"{totals['mean_server_cpu_ms']}ms server CPU/request)")
+    for key, stats in endpoints.items():
+        print(f"  {key:<70} n={stats['count']:<5} p50={stats['p50_ms']:>8}ms p95={stats['p95_ms']:>8}ms "
+              f"p99={stats['p99_ms']:>8}ms bytes={stats['mean_response_bytes']:>9} "
+              f"cpu={stats['mean_server_cpu_ms']}ms err={stats['errors']}")
+    print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# bench/seed.py
+# Bulk-loads a synthetic portfolio (properties -> audits -> steps -> media -> findings,
+# plus parsed utility usage) with explicit ids so the workload knows every key up front.
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, insert, text
+from werkzeug.utils import secure_filename
+
+from direct_uploads import upload_path
+from models import db, Property, Audit, AuditStep, AuditMedia, AuditFinding, UtilityBill, UtilityUsage
+
+STEP_TEMPLATES = [
+    ('exterior', 'North Side'),
+    ('exterior', 'South Side'),
+    ('exterior', 'East Side'),
+    ('exterior', 'West Side'),
+    ('attic', 'Attic Access Hatch'),
+    ('crawlspace', 'Crawlspace'),
+    ('hvac', 'Furnace'),
+    ('water_heater', 'Water Heater'),
+    ('interior', 'Windows'),
+    ('interior', 'Lighting'),
+]
+CITIES = [('Portland', 'OR', '97201', 45.52, -122.68), ('Denver', 'CO', '80202', 39.74, -104.99),
+          ('Boston', 'MA', '02108', 42.36, -71.06), ('Austin', 'TX', '78701', 30.27, -97.74)]
+SEVERITIES = ['low', 'medium', 'high']
+FINDING_TITLES = ['Missing attic insulation', 'Leaky ducts', 'Single-pane windows', 'Air leaks at rim joist',
+                  'Incandescent lighting', 'Old water heater']
+CHUNK = 5000
+
+
+def _next_id(model):
+    # Ids are per shard, so look past the current organization's own rows
+    return (db.session.query(func.max(model.id)).execution_options(all_tenants=True).scalar() or 0) + 1
+
+
+def _bulk(model, rows):
+    for i in range(0, len(rows), CHUNK):
+        db.session.execute(insert(model), rows[i:i + CHUNK])
+
+
+def _reset_sequences():
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in (Property, Audit, AuditStep, AuditMedia, AuditFinding, UtilityBill, UtilityUsage):
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"))
+
+
+def seed(storage, bucket, url_prefix, rng, properties=200, audits_per_property=1, steps_per_audit=8, media_per_step=3,
+         findings_per_step=1, usage_months=12, media_bytes=2048, disposable_properties=0, pending_uploads=0):
+    """Insert the portfolio and write media objects to `storage`. Returns the ids the workload samples.
+
+    `pending_uploads` direct uploads are left pending with their object already in storage, for the
+    completion call and the storage webhook to finalize.
+    """
+    now = datetime.utcnow()
+    ids = {name: _next_id(model) for name, model in (
+        ('property', Property), ('audit', Audit), ('step', AuditStep), ('media', AuditMedia),
+        ('finding', AuditFinding), ('bill', UtilityBill), ('usage', UtilityUsage))}
+    rows = {name: [] for name in ids}
+    state = {'property_ids': [], 'audit_ids': [], 'steps': [], 'disposable_property_ids': [],
+             'pending_media_ids': [], 'pending_media_paths': []}
+    payload = bytes(rng.getrandbits(8) for _ in range(media_bytes))
+    bucket_client = storage.from_(bucket)
+
+    def take(name):
+        value = ids[name]
+        ids[name] += 1
+        return value
+
+    for p in range(properties + disposable_properties):
+        property_id = take('property')
+        city, st, zip_code, lat, lon = rng.choice(CITIES)
+        lat, lon = lat + rng.uniform(-0.1, 0.1), lon + rng.uniform(-0.1, 0.1)
+        rows['property'].append({
+            'id': property_id, 'street': f'{rng.randint(1, 9999)} Main St', 'city': city, 'state': st,
+            'zip_code': zip_code, 'year_built': rng.randint(1900, 2020), 'sqft': rng.randint(700, 4500),
+            'latitude': lat, 'longitude': lon, 'updated_at': now,
+        })
+        if p >= properties:
+            state['disposable_property_ids'].append(property_id)
+            continue
+        state['property_ids'].append(property_id)
+
+        if usage_months:
+            bill_id = take('bill')
+            rows['bill'].append({'id': bill_id, 'property_id': property_id, 'file_name': 'seed.csv',
+                                 'content_hash': f'seed-{property_id}', 'status': 'parsed', 'uploaded_at': now})
+            start = date(now.year - 1, now.month, 1)
+            for m in range(usage_months):
+                first = (start + timedelta(days=31 * m)).replace(day=1)
+                last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+                for fuel, unit, usage, price in (('electric', 'kWh', rng.uniform(300, 1200), 0.16),
+                                                 ('gas', 'therm', rng.uniform(10, 120), 1.4)):
+                    rows['usage'].append({'id': take('usage'), 'bill_id': bill_id, 'property_id': property_id,
+                                          'fuel': fuel, 'unit': unit, 'period_start': first, 'period_end': last,
+                                          'usage': round(usage, 1), 'cost': round(usage * price, 2)})
+
+        for _ in range(audits_per_property):
+            audit_id = take('audit')
+            state['audit_ids'].append(audit_id)
+            rows['audit'].append({'id': audit_id, 'property_id': property_id, 'date': now.date(),
+                                  'auditor_name': 'Bench Auditor', 'created_at': now})
+            for s in range(steps_per_audit):
+                step_type, label = STEP_TEMPLATES[s % len(STEP_TEMPLATES)]
+                if s >= len(STEP_TEMPLATES):
+                    label = f'{label} {s // len(STEP_TEMPLATES) + 1}'
+                step_id = take('step')
+                state['steps'].append((step_id, audit_id, label))
+                rows['step'].append({'id': step_id, 'audit_id': audit_id, 'step_type': step_type, 'label': label,
+                                     'is_completed': rng.random() < 0.8, 'not_accessible': rng.random() < 0.1,
+                                     'updated_at': now})
+                for m in range(media_per_step):
+                    file_name = f'photo_{m}.jpg'
+                    path = secure_filename(f'{audit_id}_{label}_{file_name}')
+                    bucket_client.update(path=path, file=payload, file_options={'content-type': 'image/jpeg'})
+                    rows['media'].append({'id': take('media'), 'audit_id': audit_id, 'step_id': step_id,
+                                          'step_type': step_type, 'side': label.replace(' Side', ''),
+                                          'media_url': f'{url_prefix}/{path}', 'file_name': file_name, 'media_type': 'photo',
+                                          'created_at': now, 'metadata_status': 'extracted',
+                                          'captured_at': now - timedelta(minutes=rng.randint(0, 600)),
+                                          # Mostly on site; some taken elsewhere
+                                          'latitude': lat + rng.gauss(0, 0.0003 if rng.random() < 0.9 else 0.05),
+                                          'longitude': lon + rng.gauss(0, 0.0003), 'width': 4032, 'height': 3024,
+                                          'orientation': 1})
+                for _ in range(findings_per_step):
+                    rows['finding'].append({'id': take('finding'), 'step_id': step_id,
+                                            'title': rng.choice(FINDING_TITLES), 'severity': rng.choice(SEVERITIES),
+                                            'recommendation': 'Seeded recommendation', 'source': 'Inspector'})
+
+    for i in range(pending_uploads if state['steps'] else 0):
+        step_id, audit_id, label = state['steps'][i % len(state['steps'])]
+        path = upload_path(audit_id, f'direct_{i}.jpg')
+        bucket_client.update(path=path, file=payload, file_options={'content-type': 'image/jpeg'})
+        media_id = take('media')
+        rows['media'].append({'id': media_id, 'audit_id': audit_id, 'step_id': step_id, 'step_type': 'exterior',
+                              'side': label.replace(' Side', ''), 'media_url': f'{url_prefix}/{path}',
+                              'file_name': f'direct_{i}.jpg', 'media_type': 'photo', 'created_at': now,
+                              'status': 'pending', 'storage_path': path})
+        # Alternate between the two ways a direct upload gets finalized
+        state['pending_media_ids' if i % 2 == 0 else 'pending_media_paths'].append(media_id if i % 2 == 0 else path)
+
+    for name, model in (('property', Property), ('bill', UtilityBill), ('usage', UtilityUsage), ('audit', Audit),
+                        ('step', AuditStep), ('media', AuditMedia), ('finding', AuditFinding)):
+        _bulk(model, rows[name])
+    _reset_sequences()
+    db.session.commit()
+    return state
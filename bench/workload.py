@@ -0,0 +1,257 @@
+# bench/workload.py
+# One request builder per route, keyed "<METHOD> <rule>" exactly as Flask registers it, so
+# the runner can check the workload against app.url_map and flag uncovered routes.
+import hashlib
+import json
+import uuid
+from urllib.parse import quote
+
+CSV_BILL = (
+    "TYPE,DATE,START TIME,END TIME,USAGE,UNITS,COST,NOTES\n"
+    "Electric usage,2024-01-01,00:00,23:59,31.2,kWh,$4.99,\n"
+    "Electric usage,2024-01-02,00:00,23:59,28.7,kWh,$4.59,\n"
+)
+
+
+def _json(method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else None
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    return method, path, body, headers
+
+
+def _multipart(path, fields, file_name, content, content_type, method='POST'):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return method, path, b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+class Workload:
+    """Samples seeded ids with a dedicated RNG so a given seed replays the same request stream.
+
+    `tenants` is a list of (organization_id, seed state). With more than one tenant every
+    request picks a tenant first and is sent with its X-Organization-Id header.
+    `sign_upload(path)` returns a presigned upload URL from the local storage stand-in.
+    `headers` (e.g. Accept / Accept-Encoding) are added to every request, and each request
+    comes from one of `clients` devices (X-Client-Id), as the rate limits are per client.
+    """
+
+    def __init__(self, tenants, rng, upload_bytes=8192, sign_upload=None, webhook_secret=None, headers=None,
+                 clients=50):
+        self.tenants = tenants
+        self.rng = rng
+        self.upload = bytes(rng.getrandbits(8) for _ in range(upload_bytes))
+        self.disposable = {org: list(state['disposable_property_ids']) for org, state in tenants}
+        self.pending_ids = {org: list(state['pending_media_ids']) for org, state in tenants}
+        self.pending_paths = {org: list(state['pending_media_paths']) for org, state in tenants}
+        self.sign_upload = sign_upload
+        self.webhook_secret = webhook_secret
+        self.headers = headers or {}
+        self.clients = clients
+        self.organization_id, self.state = tenants[0]
+
+    def build(self, name):
+        self.organization_id, self.state = self.rng.choice(self.tenants)
+        method, path, body, headers = getattr(self, name)()
+        headers = {**self.headers, 'X-Client-Id': f'tablet-{self.rng.randrange(self.clients)}', **headers}
+        if len(self.tenants) > 1:
+            headers = {**headers, 'X-Organization-Id': str(self.organization_id)}
+        return method, path, body, headers
+
+    def property_id(self):
+        return self.rng.choice(self.state['property_ids'])
+
+    def audit_id(self):
+        return self.rng.choice(self.state['audit_ids'])
+
+    def step(self):
+        return self.rng.choice(self.state['steps'])
+
+    def property_payload(self):
+        return {'street': f'{self.rng.randint(1, 9999)} Oak Ave', 'city': 'Denver', 'state': 'CO',
+                'zip_code': '80202', 'year_built': self.rng.randint(1900, 2020), 'sqft': self.rng.randint(700, 4500)}
+
+    # ---------------------- ORGANIZATIONS ----------------------
+    def list_organizations(self):
+        return _json('GET', '/api/organizations')
+
+    def create_organization(self):
+        return _json('POST', '/api/organizations', {'name': f'Bench Org {self.rng.getrandbits(32)}'})
+
+    # ---------------------- PROPERTIES ----------------------
+    def list_properties(self):
+        return _json('GET', '/api/properties')
+
+    def create_property(self):
+        return _json('POST', '/api/properties', self.property_payload())
+
+    def get_property(self):
+        return _json('GET', f'/api/properties/{self.property_id()}')
+
+    def update_property(self):
+        return _json('PUT', f'/api/properties/{self.property_id()}', self.property_payload())
+
+    def delete_property(self):
+        # Seeded throwaway properties; once they run out the route is exercised on a missing id
+        disposable = self.disposable[self.organization_id]
+        property_id = disposable.pop() if disposable else 10 ** 9
+        return _json('DELETE', f'/api/properties/{property_id}')
+
+    def upload_utility_bill(self):
+        content = CSV_BILL.encode() + f'# {self.rng.getrandbits(32)}\n'.encode()
+        return _multipart(f'/api/properties/{self.property_id()}/upload-utility-bill', {},
+                          f'bill_{self.rng.getrandbits(32)}.csv', content, 'text/csv')
+
+    def get_usage(self):
+        return _json('GET', f'/api/properties/{self.property_id()}/usage')
+
+    # ---------------------- AUDITS ----------------------
+    def create_audit_for_property(self):
+        property_id = self.property_id()
+        return _json('POST', f'/api/properties/{property_id}/audits', {'property_id': property_id})
+
+    def create_audit(self):
+        return _json('POST', '/api/audits', {'property_id': self.property_id()})
+
+    def get_audit(self):
+        return _json('GET', f'/api/audits/{self.audit_id()}')
+
+    def get_audit_by_property(self):
+        return _json('GET', f'/api/properties/{self.property_id()}/audit')
+
+    # ---------------------- STEPS / MEDIA ----------------------
+    def get_steps(self):
+        return _json('GET', f'/api/audits/{self.audit_id()}/steps')
+
+    def upsert_step(self):
+        _, audit_id, label = self.step()
+        return _json('POST', f'/api/audits/{audit_id}/steps',
+                     {'step_type': 'exterior', 'label': label, 'is_completed': self.rng.random() < 0.5})
+
+    def get_step_media(self):
+        _, audit_id, label = self.step()
+        return _json('GET', f'/api/audits/{audit_id}/steps/{quote(label)}/media')
+
+    def upload_step_media(self):
+        step_id, _, _ = self.step()
+        return _multipart(f'/api/steps/{step_id}/upload', {}, f'img_{self.rng.getrandbits(32)}.jpg',
+                          self.upload, 'image/jpeg')
+
+    def get_audit_media(self):
+        return _json('GET', f'/api/audits/{self.audit_id()}/media')
+
+    def upload_by_label(self):
+        _, audit_id, label = self.step()
+        return _multipart(f'/api/audits/{audit_id}/steps/{quote(label)}/upload',
+                          {'step_type': 'exterior', 'media_type': 'photo'},
+                          f'img_{self.rng.getrandbits(32)}.jpg', self.upload, 'image/jpeg')
+
+    def download_media_archive(self):
+        return _json('GET', f'/api/audits/{self.audit_id()}/media/archive')
+
+    def search_audit_media(self):
+        return _json('GET', f'/api/audits/{self.audit_id()}/media/search?has_gps=true&max_distance_m=100')
+
+    def search_media(self):
+        return _json('GET', '/api/media/search?min_distance_m=500&limit=50')
+
+    # ---------------------- DIRECT UPLOADS ----------------------
+    def request_upload_url(self):
+        _, audit_id, label = self.step()
+        return _json('POST', f'/api/audits/{audit_id}/steps/{quote(label)}/upload-url',
+                     {'file_name': f'img_{self.rng.getrandbits(32)}.jpg', 'step_type': 'exterior'})
+
+    def signed_upload(self):
+        path = f'uploads/{self.organization_id}/bench/{uuid.UUID(int=self.rng.getrandbits(128)).hex}.jpg'
+        return 'PUT', self.sign_upload(path), self.upload, {'Content-Type': 'image/jpeg'}
+
+    def complete_upload(self):
+        # Seeded pending uploads; once they run out the route is exercised on a missing id
+        pending = self.pending_ids[self.organization_id]
+        return _json('POST', f'/api/media/{pending.pop() if pending else 10 ** 9}/complete')
+
+    def storage_webhook(self):
+        pending = self.pending_paths[self.organization_id]
+        path = pending.pop() if pending else f'uploads/{self.organization_id}/0/missing.jpg'
+        method, path_, body, headers = _json('POST', '/api/storage/webhook',
+                                             {'type': 'INSERT', 'table': 'objects', 'schema': 'storage',
+                                              'record': {'bucket_id': 'bench', 'name': path}})
+        return method, path_, body, {**headers, 'X-Webhook-Secret': self.webhook_secret or ''}
+
+    # ---------------------- SYNC ----------------------
+    def sync_audit(self):
+        # A tablet's first sync of an audit: one step edit, full snapshot back
+        _, audit_id, label = self.step()
+        operation = {'op_id': uuid.UUID(int=self.rng.getrandbits(128)).hex, 'entity': 'step',
+                     'data': {'step_type': 'exterior', 'label': label, 'is_completed': self.rng.random() < 0.5}}
+        return _json('POST', f'/api/audits/{audit_id}/sync', {'sync_token': 0, 'operations': [operation]})
+
+    def upload_media_blob(self):
+        content = self.upload + self.rng.getrandbits(32).to_bytes(4, 'big')
+        return _multipart(f'/api/media/{hashlib.sha256(content).hexdigest()}', {}, 'blob.jpg', content,
+                          'image/jpeg', method='PUT')
+
+    # ---------------------- CHAT / FINDINGS / SAVINGS ----------------------
+    def agent_chat(self):
+        return _json('POST', '/api/agent-chat', {'messages': [{'text': 'Tell me about insulation'}]})
+
+    def add_finding(self):
+        step_id, _, _ = self.step()
+        return _json('POST', f'/api/steps/{step_id}/findings',
+                     {'title': 'Leaky ducts', 'severity': 'medium', 'source': 'Inspector'})
+
+    def evaluate_findings(self):
+        return _json('POST', f'/api/audits/{self.audit_id()}/findings/evaluate')
+
+    def audit_savings(self):
+        return _json('GET', f'/api/audits/{self.audit_id()}/savings')
+
+    def portfolio_savings(self):
+        return _json('GET', '/api/portfolio/savings')
+
+    def metrics(self):
+        return _json('GET', '/metrics')
+
+
+# route key -> (Workload method, relative weight)
+OPERATIONS = {
+    'GET /api/organizations': ('list_organizations', 1),
+    'POST /api/organizations': ('create_organization', 1),
+    'GET /api/properties': ('list_properties', 4),
+    'POST /api/properties': ('create_property', 3),
+    'GET /api/properties/<int:property_id>': ('get_property', 10),
+    'PUT /api/properties/<int:id>': ('update_property', 2),
+    'DELETE /api/properties/<int:property_id>': ('delete_property', 1),
+    'POST /api/properties/<int:property_id>/upload-utility-bill': ('upload_utility_bill', 1),
+    'GET /api/properties/<int:property_id>/usage': ('get_usage', 3),
+    'POST /api/properties/<int:property_id>/audits': ('create_audit_for_property', 1),
+    'POST /api/audits': ('create_audit', 2),
+    'GET /api/audits/<int:audit_id>': ('get_audit', 10),
+    'GET /api/properties/<int:property_id>/audit': ('get_audit_by_property', 4),
+    'GET /api/audits/<int:audit_id>/steps': ('get_steps', 12),
+    'POST /api/audits/<int:audit_id>/steps': ('upsert_step', 8),
+    'GET /api/audits/<int:audit_id>/steps/<string:step_label>/media': ('get_step_media', 8),
+    'POST /api/steps/<int:step_id>/upload': ('upload_step_media', 1),
+    'GET /api/audits/<int:audit_id>/media': ('get_audit_media', 8),
+    'POST /api/audits/<int:audit_id>/steps/<string:step_label>/upload': ('upload_by_label', 5),
+    'GET /api/audits/<int:audit_id>/media/archive': ('download_media_archive', 1),
+    'GET /api/audits/<int:audit_id>/media/search': ('search_audit_media', 3),
+    'GET /api/media/search': ('search_media', 1),
+    'POST /api/audits/<int:audit_id>/steps/<string:step_label>/upload-url': ('request_upload_url', 4),
+    'PUT /storage/v1/object/upload/sign/<string:bucket>/<path:object_path>': ('signed_upload', 4),
+    'POST /api/media/<int:media_id>/complete': ('complete_upload', 2),
+    'POST /api/storage/webhook': ('storage_webhook', 2),
+    'POST /api/audits/<int:audit_id>/sync': ('sync_audit', 3),
+    'PUT /api/media/<string:sha256>': ('upload_media_blob', 1),
+    'POST /api/agent-chat': ('agent_chat', 2),
+    'POST /api/steps/<int:step_id>/findings': ('add_finding', 3),
+    'POST /api/audits/<int:audit_id>/findings/evaluate': ('evaluate_findings', 1),
+    'GET /api/audits/<int:audit_id>/savings': ('audit_savings', 2),
+    'GET /api/portfolio/savings': ('portfolio_savings', 1),
+    'GET /metrics': ('metrics', 1),
+}
@@ -0,0 +1,75 @@
+# direct_uploads.py
+# Two-phase media uploads that never pass the bytes through the API:
+#
+#   1. POST /api/audits/<id>/steps/<label>/upload-url creates a pending AuditMedia and
+#      returns a presigned storage URL.
+#   2. The client PUTs the file straight to storage.
+#   3. POST /api/media/<id>/complete (or the storage webhook for the object) checks that
+#      the object exists and marks the media ready.
+#
+# Pending media are hidden from every listing. `flask expire-uploads` deletes the ones
+# that were never completed. Object keys start with the organization id, so the
+# webhook, which has no tenant header, can find the organization.
+import uuid
+from datetime import datetime, timedelta
+
+from werkzeug.utils import secure_filename
+
+from models import db, AuditMedia
+from sharding import current_organization_id
+
+UPLOAD_PREFIX = 'uploads'
+EXPIRE_AFTER_HOURS = 24
+
+
+def upload_path(audit_id, file_name):
+    name = secure_filename(file_name) or 'upload'
+    return f"{UPLOAD_PREFIX}/{current_organization_id()}/{audit_id}/{uuid.uuid4().hex[:12]}_{name}"
+
+
+def object_path(media, url_prefix):
+    """Storage key of `media`. Media uploaded through the API only record their public URL."""
+    return media.storage_path or (media.media_url or '').removeprefix(url_prefix)
+
+
+def organization_for_path(path):
+    """Organization id encoded in a direct-upload object key, or None for other objects."""
+    parts = (path or '').split('/')
+    if len(parts) < 4 or parts[0] != UPLOAD_PREFIX or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
+
+def stored_object(bucket, path):
+    """Storage listing entry for `path`, or None if the object does not exist."""
+    folder, _, name = path.rpartition('/')
+    for entry in bucket.list(folder, {"search": name}) or []:
+        if entry.get('name') == name:
+            return entry
+    return None
+
+
+def complete_upload(media, bucket):
+    """Mark `media` ready if its object is in storage. Returns False if the upload is missing."""
+    if media.status == 'ready':
+        return True
+    if not media.storage_path or stored_object(bucket, media.storage_path) is None:
+        return False
+    media.status = 'ready'
+    return True
+
+
+def expire_pending_uploads(bucket, hours=EXPIRE_AFTER_HOURS):
+    """Delete pending media older than `hours` and any object that did arrive. Returns the count."""
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    stale = AuditMedia.query.filter(AuditMedia.status == 'pending', AuditMedia.created_at < cutoff).all()
+    paths = [m.storage_path for m in stale if m.storage_path]
+    if paths:
+        try:
+            bucket.remove(paths)
+        except Exception as e:
+            print(f"❌ Could not remove expired uploads: {e}")
+    for media in stale:
+        db.session.delete(media)
+    db.session.commit()
+    return len(stale)
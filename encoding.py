@@ -0,0 +1,141 @@
+# encoding.py
+# Response encoding negotiated per request.
+#
+#   Accept: application/msgpack        -> MessagePack body with the same structure as the JSON
+#   Accept-Encoding: zstd / br / gzip  -> compressed body (server preference in that order)
+#
+# JSON is the default. It is produced by orjson when installed, which also serializes
+# datetimes, numpy scalars and non-string keys natively. Without orjson it falls back to
+# Flask's encoder. Every codec is optional: a format is offered only if its module is
+# installed, so a bare deployment keeps serving plain JSON.
+#
+# Compression runs in after_request. init_app must run after instrumentation and before
+# idempotency: instrumentation then records the compressed size, and idempotency stores
+# the uncompressed body, which is re-encoded for each replay.
+import datetime
+import gzip
+import threading
+
+import numpy as np
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_ALIASES = ('application/x-msgpack', 'application/vnd.msgpack')
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_MIMETYPES = {JSON_MIMETYPE, MSGPACK_MIMETYPE, 'text/csv', 'text/plain', 'text/html'}
+# Fast levels: responses are small and latency-bound, the ratio gain of higher levels is marginal
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(o):
+    # Dates go out as ISO 8601 in every format, as the endpoints already format them by hand
+    if isinstance(o, (datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, np.generic):
+        return o.item()
+    return DefaultJSONProvider.default(o)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that negotiates MessagePack and uses orjson for JSON."""
+
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if negotiated_mimetype() == MSGPACK_MIMETYPE:
+            body = msgpack.packb(obj, default=_default, use_bin_type=True)
+            return self._app.response_class(body, mimetype=MSGPACK_MIMETYPE)
+        if orjson is None:
+            return super().response(obj)
+        body = orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def negotiated_mimetype():
+    if msgpack is None or not has_request_context():
+        return JSON_MIMETYPE
+    # JSON first, so `*/*` and missing Accept headers keep getting JSON
+    best = request.accept_mimetypes.best_match((JSON_MIMETYPE, MSGPACK_MIMETYPE) + MSGPACK_ALIASES)
+    return MSGPACK_MIMETYPE if best in (MSGPACK_MIMETYPE,) + MSGPACK_ALIASES else JSON_MIMETYPE
+
+
+def rows(result):
+    """List of {column: value} for a Core result, without loading ORM objects."""
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+# ---------------------- COMPRESSION ----------------------
+_local = threading.local()
+
+
+def _zstd(body):
+    # ZstdCompressor instances must not be shared between threads
+    compressor = getattr(_local, 'zstd', None)
+    if compressor is None:
+        compressor = _local.zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor.compress(body)
+
+
+CODECS = {}
+if zstandard is not None:
+    CODECS['zstd'] = _zstd
+if brotli is not None:
+    CODECS['br'] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+CODECS['gzip'] = lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    return response.mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def init_app(app):
+    app.json = JSONProvider(app)
+
+    @app.after_request
+    def _encode_response(response):
+        if response.mimetype in (JSON_MIMETYPE, MSGPACK_MIMETYPE) and msgpack is not None:
+            response.vary.add('Accept')
+        if not _compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        coding = request.accept_encodings.best_match(tuple(CODECS))
+        if coding is None or response.calculate_content_length() < MIN_COMPRESS_BYTES:
+            return response
+        response.set_data(CODECS[coding](response.get_data()))
+        response.headers['Content-Encoding'] = coding
+        return response
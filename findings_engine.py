@@ -0,0 +1,214 @@
+# findings_engine.py
+# Declarative rules evaluated set-wise inside the database. Each rule compiles to a
+# WHERE clause over audit_steps/audits/properties, and a batch of audits is evaluated
+# with a single INSERT ... SELECT, so no step rows ever travel through Python.
+#
+# A batch first locks its audit rows (as sync does), so an API evaluation and a rule run
+# on the same audit take turns instead of both inserting. The findings the rules would
+# produce are compared with the stored ones in SQL, and only audits whose rule findings
+# differ are rewritten and logged as changed. An unchanged audit keeps its sync_version,
+# so a nightly full run does not reset every tablet or savings cache.
+import operator
+from datetime import datetime
+
+from sqlalchemy import delete, except_, func, insert, literal, select, union, union_all
+
+from models import db, Property, Audit, AuditStep, AuditFinding, RuleRun
+from sharding import tenant_engine
+from sync import record_collection_change
+
+RULE_SOURCE = 'rules'
+BATCH_SIZE = 5000  # audits per transaction
+
+# Each rule fires once per matching step. `when` keys are "<field>" or "<field>__<op>";
+# `measure` names the savings.MEASURES entry used to price the finding.
+RULES = [
+    {
+        "id": "attic_inaccessible_pre_1980",
+        "when": {"step_type": "attic", "not_accessible": True, "year_built__lt": 1980},
+        "title": "Attic not accessible in pre-1980 home",
+        "description": "The attic could not be inspected and the home was built before 1980, "
+                       "when insulation and air sealing were commonly absent.",
+        "recommendation": "Schedule a follow-up visit with attic access to assess insulation "
+                          "levels and check for vermiculite.",
+        "severity": "high",
+        "measure": "attic_insulation",
+    },
+    {
+        "id": "attic_inaccessible",
+        "when": {"step_type": "attic", "not_accessible": True, "year_built__gte": 1980},
+        "title": "Attic not accessible",
+        "description": "The attic could not be inspected during the audit.",
+        "recommendation": "Confirm insulation depth with the homeowner or on a follow-up visit.",
+        "severity": "medium",
+        "measure": "attic_insulation",
+    },
+    {
+        "id": "crawlspace_inaccessible_pre_1950",
+        "when": {"step_type": "crawlspace", "not_accessible": True, "year_built__lt": 1950},
+        "title": "Crawlspace not accessible in pre-1950 home",
+        "description": "The crawlspace could not be inspected in a home likely to have "
+                       "uninsulated floors and ducts.",
+        "recommendation": "Inspect the crawlspace for moisture, duct leakage and floor insulation.",
+        "severity": "medium",
+        "measure": "crawlspace",
+    },
+]
+
+FIELDS = {
+    "step_type": AuditStep.step_type,
+    "label": AuditStep.label,
+    "is_completed": AuditStep.is_completed,
+    "not_accessible": AuditStep.not_accessible,
+    "year_built": Property.year_built,
+    "sqft": Property.sqft,
+}
+
+OPS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "in": lambda col, value: col.in_(value),
+    "is_null": lambda col, value: col.is_(None) if value else col.isnot(None),
+}
+
+FINDING_COLUMNS = ['step_id', 'title', 'description', 'recommendation', 'severity', 'source', 'rule_id']
+
+
+def compile_rule(rule):
+    clauses = []
+    for key, value in rule["when"].items():
+        field, _, op = key.partition("__")
+        if field not in FIELDS:
+            raise ValueError(f"Rule {rule['id']}: unknown field '{field}'")
+        if (op or "eq") not in OPS:
+            raise ValueError(f"Rule {rule['id']}: unknown operator '{op}'")
+        clauses.append(OPS[op or "eq"](FIELDS[field], value))
+    return clauses
+
+
+def _rule_select(rule, audit_filter):
+    columns = AuditFinding.__table__.c
+    return (
+        select(
+            AuditStep.audit_id,
+            AuditStep.id.label('step_id'),
+            literal(rule["title"], columns.title.type).label('title'),
+            literal(rule.get("description"), columns.description.type).label('description'),
+            literal(rule.get("recommendation"), columns.recommendation.type).label('recommendation'),
+            literal(rule.get("severity"), columns.severity.type).label('severity'),
+            literal(RULE_SOURCE, columns.source.type).label('source'),
+            literal(rule["id"], columns.rule_id.type).label('rule_id'),
+        )
+        .select_from(AuditStep.__table__.join(Audit.__table__).join(Property.__table__))
+        .where(audit_filter, *compile_rule(rule))
+    )
+
+
+def _desired(rules, audit_filter):
+    selects = [_rule_select(rule, audit_filter) for rule in rules]
+    return selects[0] if len(selects) == 1 else union_all(*selects)
+
+
+def _stored(audit_filter):
+    return (
+        select(AuditStep.audit_id, *[AuditFinding.__table__.c[name] for name in FINDING_COLUMNS])
+        .select_from(AuditFinding.__table__.join(AuditStep.__table__))
+        .where(AuditFinding.source == RULE_SOURCE, audit_filter)
+    )
+
+
+def _changed_audit_ids(conn, rules, audit_filter):
+    """Audits matched by `audit_filter` whose stored rule findings differ from what `rules` produce."""
+    stored = _stored(audit_filter)
+    if not rules:
+        return conn.execute(select(stored.subquery().c.audit_id).distinct()).scalars().all()
+    # As a plain SELECT over a subquery: SQLite cannot nest the UNION ALL inside EXCEPT
+    desired = select(*_desired(rules, audit_filter).subquery().c)
+    added = except_(desired, stored).subquery()
+    removed = except_(stored, desired).subquery()
+    return conn.execute(union(select(added.c.audit_id), select(removed.c.audit_id))).scalars().all()
+
+
+def evaluate_batch(conn, audit_filter, rules=None):
+    """Bring the rule findings of every audit matched by `audit_filter` up to date. Returns rows written."""
+    rules = RULES if rules is None else rules
+    # Ordered, so two batches over overlapping audits cannot deadlock
+    conn.execute(select(Audit.id)
+                 .where(Audit.id.in_(select(AuditStep.audit_id).where(audit_filter)))
+                 .order_by(Audit.id).with_for_update())
+    audit_ids = _changed_audit_ids(conn, rules, audit_filter)
+    if not audit_ids:
+        return 0
+
+    changed = AuditStep.audit_id.in_(audit_ids)
+    conn.execute(
+        delete(AuditFinding)
+        .where(AuditFinding.source == RULE_SOURCE, AuditFinding.step_id.in_(select(AuditStep.id).where(changed)))
+        .execution_options(synchronize_session=False)
+    )
+    record_collection_change(conn, audit_ids, 'finding')
+    if not rules:
+        return 0
+    source = _desired(rules, changed).subquery()
+    result = conn.execute(insert(AuditFinding).from_select(
+        FINDING_COLUMNS, select(*[source.c[name] for name in FINDING_COLUMNS])))
+    return max(result.rowcount or 0, 0)
+
+
+def evaluate_audit(audit_id):
+    with tenant_engine().begin() as conn:
+        return evaluate_batch(conn, AuditStep.audit_id == audit_id)
+
+
+def _touched_audit_ids(since):
+    touched = union(
+        select(AuditStep.audit_id).where(AuditStep.updated_at >= since),
+        select(Audit.id).join(Property).where(Property.updated_at >= since),
+    )
+    with tenant_engine().connect() as conn:
+        return sorted(conn.execute(touched).scalars())
+
+
+def _last_run_start():
+    last = (
+        RuleRun.query.filter(RuleRun.finished_at.isnot(None))
+        .order_by(RuleRun.started_at.desc())
+        .first()
+    )
+    return last.started_at if last else None
+
+
+def run_rules(full=False):
+    """Evaluate RULES over the whole portfolio, or only over audits touched since the last run."""
+    since = None if full else _last_run_start()
+    run = RuleRun(full=since is None, started_at=datetime.utcnow())
+    db.session.add(run)
+    db.session.commit()
+
+    audits = written = 0
+    if since is None:
+        with tenant_engine().connect() as conn:
+            lo, hi = conn.execute(select(func.min(Audit.id), func.max(Audit.id))).one()
+        if lo is not None:
+            for start in range(lo, hi + 1, BATCH_SIZE):
+                end = start + BATCH_SIZE - 1
+                with tenant_engine().begin() as conn:
+                    written += evaluate_batch(conn, AuditStep.audit_id.between(start, end))
+            with tenant_engine().connect() as conn:
+                audits = conn.execute(select(func.count(Audit.id))).scalar()
+    else:
+        audit_ids = _touched_audit_ids(since)
+        for i in range(0, len(audit_ids), BATCH_SIZE):
+            with tenant_engine().begin() as conn:
+                written += evaluate_batch(conn, AuditStep.audit_id.in_(audit_ids[i:i + BATCH_SIZE]))
+        audits = len(audit_ids)
+
+    run.audits_evaluated = audits
+    run.findings_written = written
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return run
@@ -0,0 +1,292 @@
+# idempotency.py
+# Idempotency-Key support for write requests.
+#
+# A client that may retry a POST/PUT/PATCH/DELETE sends a unique `Idempotency-Key`
+# header and reuses the same key for every retry. The first request runs the handler,
+# and its response is kept for IDEMPOTENCY_TTL_SECONDS. Repeats get that response back
+# with `Idempotent-Replayed: true` and never re-run the handler, so no second row or
+# storage write happens. A repeat that arrives while the first request is still running
+# waits for it (up to IDEMPOTENCY_WAIT_SECONDS), so only one of them executes.
+#
+# A key belongs to one organization, method and path. Reusing it with a different payload
+# is rejected with 422. 5xx responses are not kept, so the client can retry those.
+# By default entries live in process memory, bounded by IDEMPOTENCY_MAX_BYTES of kept
+# bodies; only completed entries are evicted, so a retry never re-runs a request that is
+# still in flight. That only holds within one process: with several workers or hosts, set
+# IDEMPOTENCY_REDIS_URL so they share one store. There the first request claims the key
+# with SET NX (a pending marker that expires after IDEMPOTENCY_PENDING_TTL_SECONDS if its
+# worker dies) and replaces it with the response; repeats on any worker poll for it.
+#
+# The kept body is the uncompressed one (compression runs later, see encoding.py). A
+# replay whose Accept negotiates another format than the first request got (JSON vs
+# MessagePack) is decoded and rendered again, so each replay is encoded for its caller.
+import base64
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, current_app, g, json, jsonify, request
+
+from encoding import JSON_MIMETYPE, MSGPACK_MIMETYPE, msgpack, negotiated_mimetype
+from sharding import current_organization_id
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+MAX_KEY_LENGTH = 255
+REPLAYED_RESPONSE_HEADERS = ('Content-Type', 'Location')
+ENTRY_OVERHEAD_BYTES = 512  # key, fingerprint and headers, so empty bodies still count
+POLL_SECONDS = 0.05
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'expires_at', 'done', 'response', 'size')
+
+    def __init__(self, fingerprint, expires_at):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.done = threading.Event()
+        self.response = None  # (status, headers, body) once completed
+        self.size = 0
+
+
+class IdempotencyStore:
+    def __init__(self, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0  # bytes held by completed entries
+        self._entries = OrderedDict()  # insertion order == expiry order
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Oldest first, skipping entries whose request is still running
+        for key, entry in list(self._entries.items()):
+            if entry.expires_at > now and self.size <= self.max_bytes:
+                break
+            if entry.done.is_set():
+                del self._entries[key]
+                self.size -= entry.size
+
+    def begin(self, key, fingerprint):
+        """Returns (entry, owner); the owner runs the request and must complete() or abandon() it."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = self._entries[key] = _Entry(fingerprint, now + self.ttl)
+            return entry, True
+
+    def complete(self, key, entry, status, headers, body):
+        with self._lock:
+            entry.response = (status, headers, body)
+            entry.done.set()
+            if self._entries.get(key) is entry:
+                entry.size = len(body) + ENTRY_OVERHEAD_BYTES
+                self.size += entry.size
+                self._evict(time.monotonic())
+
+    def abandon(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def wait(self, entry, timeout):
+        """Wait for another request's entry; False if it is still running after `timeout`."""
+        return entry.done.wait(timeout)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+# Deletes the pending marker only if this request still holds it
+_ABANDON_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  redis.call('DEL', KEYS[1])
+end
+"""
+
+
+class _RedisEntry:
+    __slots__ = ('key', 'fingerprint', 'response', 'marker')
+
+    def __init__(self, key, fingerprint, response=None, marker=None):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.response = response  # (status, headers, body) once completed
+        self.marker = marker  # the pending value this request set, if it owns the key
+
+
+class RedisStore:
+    """Entries shared by every worker through Redis; same interface as IdempotencyStore.
+
+    Fails open: if Redis is unreachable the request runs without idempotency protection.
+    """
+
+    def __init__(self, url, ttl, pending_ttl, prefix='idempotency:'):
+        import redis
+
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.25)
+        self._abandon = self._redis.register_script(_ABANDON_SCRIPT)
+        self._errors = (redis.RedisError, OSError)
+
+    def _key(self, key):
+        return self.prefix + ':'.join(str(part) for part in key)
+
+    def _load(self, key, value):
+        data = json.loads(value)
+        response = None
+        if 'status' in data:
+            response = (data['status'], data['headers'], base64.b64decode(data['body']))
+        return _RedisEntry(key, data['fingerprint'], response)
+
+    def begin(self, key, fingerprint):
+        redis_key = self._key(key)
+        marker = json.dumps({'fingerprint': fingerprint, 'pending': secrets.token_hex(8)})
+        try:
+            while True:
+                if self._redis.set(redis_key, marker, nx=True, ex=max(1, round(self.pending_ttl))):
+                    return _RedisEntry(redis_key, fingerprint, marker=marker), True
+                value = self._redis.get(redis_key)
+                if value is not None:
+                    return self._load(redis_key, value), False
+                # Released between SET and GET; claim it again
+        except self._errors as e:
+            print(f"⚠️ Idempotency store unavailable: {e}")
+            return _RedisEntry(redis_key, fingerprint), True
+
+    def complete(self, key, entry, status, headers, body):
+        value = json.dumps({'fingerprint': entry.fingerprint, 'status': status, 'headers': headers,
+                            'body': base64.b64encode(body).decode('ascii')})
+        try:
+            self._redis.set(entry.key, value, ex=max(1, round(self.ttl)))
+        except self._errors as e:
+            print(f"⚠️ Idempotency store unavailable: {e}")
+
+    def abandon(self, key, entry):
+        if entry.marker is None:
+            return
+        try:
+            self._abandon(keys=[entry.key], args=[entry.marker])
+        except self._errors as e:
+            print(f"⚠️ Idempotency store unavailable: {e}")
+
+    def wait(self, entry, timeout):
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                value = self._redis.get(entry.key)
+                if value is None:
+                    return True  # abandoned; the caller claims the key again
+                loaded = self._load(entry.key, value)
+                if loaded.response is not None:
+                    entry.response = loaded.response
+                    return True
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(POLL_SECONDS)
+        except self._errors as e:
+            print(f"⚠️ Idempotency store unavailable: {e}")
+            return True
+
+    def clear(self):
+        for redis_key in self._redis.scan_iter(match=self.prefix + '*'):
+            self._redis.delete(redis_key)
+
+
+TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+_redis_url = os.getenv('IDEMPOTENCY_REDIS_URL')
+if _redis_url:
+    store = RedisStore(_redis_url, TTL_SECONDS, float(os.getenv('IDEMPOTENCY_PENDING_TTL_SECONDS', '300')))
+else:
+    store = IdempotencyStore(TTL_SECONDS, int(os.getenv('IDEMPOTENCY_MAX_BYTES', str(64 * 1024 * 1024))))
+WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+
+
+def _fingerprint():
+    digest = hashlib.sha256()
+    if request.mimetype == 'multipart/form-data':
+        # Retries re-encode multipart bodies with a fresh boundary; hash the parts instead
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f'{name}={value}\0'.encode())
+        for name, file in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+            digest.update(f'{name}:{file.filename}\0'.encode())
+            for chunk in iter(lambda: file.stream.read(65536), b''):
+                digest.update(chunk)
+            file.stream.seek(0)
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _decode(mimetype, body):
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def _replay(entry):
+    status, headers, body = entry.response
+    response = Response(body, status=status, headers=headers)
+    wanted = negotiated_mimetype()
+    if response.mimetype in (JSON_MIMETYPE, MSGPACK_MIMETYPE) and response.mimetype != wanted:
+        response = current_app.json.response(_decode(response.mimetype, body))
+        response.status_code = status
+        if 'Location' in headers:
+            response.headers['Location'] = headers['Location']
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def init_app(app):
+    @app.before_request
+    def _check_idempotency_key():
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None or request.method not in WRITE_METHODS:
+            return None
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"Invalid {IDEMPOTENCY_HEADER}"}), 400
+
+        scoped_key = (current_organization_id(), request.method, request.path, key)
+        fingerprint = _fingerprint()
+        while True:
+            entry, owner = store.begin(scoped_key, fingerprint)
+            if owner:
+                g._idempotency = (scoped_key, entry)
+                return None
+            if entry.fingerprint != fingerprint:
+                return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used with a different request"}), 422
+            if not store.wait(entry, WAIT_SECONDS):
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            if entry.response is not None:
+                return _replay(entry)
+            # The first attempt failed; take over and run the request ourselves
+
+    @app.after_request
+    def _store_response(response):
+        pending = g.pop('_idempotency', None)
+        if pending is None:
+            return response
+        scoped_key, entry = pending
+        if response.status_code >= 500 or response.is_streamed:
+            store.abandon(scoped_key, entry)
+            return response
+        headers = {name: response.headers[name] for name in REPLAYED_RESPONSE_HEADERS if name in response.headers}
+        store.complete(scoped_key, entry, response.status_code, headers, response.get_data())
+        return response
+
+    @app.teardown_request
+    def _release_key(exc):
+        pending = g.pop('_idempotency', None)
+        if pending is not None:
+            store.abandon(*pending)
@@ -0,0 +1,191 @@
+# instrumentation.py
+# Per-request metrics (latency, CPU time, SQL statement count/time, storage latency,
+# response size) rendered in Prometheus text format on /metrics, plus opt-in cProfile dumps.
+#
+# Profiling a request:  send `X-Profile: <PROFILE_TOKEN>`; the .prof file is written to
+# PROFILE_DIR and named in the `X-Profile-File` response header. Open it with snakeviz or
+# convert it to a flamegraph with flameprof. PROFILE_SAMPLE_RATE (0..1) profiles a random
+# share of requests as well; it defaults to 0, in which case the only cost per request is
+# a header lookup.
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(snapshot.items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", LATENCY_BUCKETS, ("route", "method", "status"))
+REQUEST_CPU = Histogram(
+    "http_request_cpu_seconds", "CPU time of the request thread by route.", LATENCY_BUCKETS, ("route", "method"))
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size by route.", SIZE_BUCKETS, ("route", "method"))
+SQL_STATEMENTS = Histogram(
+    "db_statements_per_request", "SQL statements executed per request.", COUNT_BUCKETS, ("route", "method"))
+SQL_TIME = Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS, ("route", "method"))
+STORAGE_LATENCY = Histogram(
+    "storage_call_duration_seconds", "Object storage call latency.", LATENCY_BUCKETS, ("operation", "outcome"))
+
+METRICS = [REQUEST_LATENCY, REQUEST_CPU, RESPONSE_SIZE, SQL_STATEMENTS, SQL_TIME, STORAGE_LATENCY]
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_time")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_time = 0.0
+
+
+_request_stats = ContextVar("request_stats", default=None)
+
+
+# ---------------------- SQL ----------------------
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats.get()
+    starts = conn.info.get("query_start")
+    if stats is None or not starts:
+        return
+    stats.statements += 1
+    stats.sql_time += time.perf_counter() - starts.pop()
+
+
+# ---------------------- STORAGE ----------------------
+@contextmanager
+def observe_storage(operation):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        STORAGE_LATENCY.observe(time.perf_counter() - start, operation, outcome)
+
+
+# ---------------------- FLASK ----------------------
+def _should_profile():
+    token = os.getenv("PROFILE_TOKEN")
+    if token and request.headers.get("X-Profile") == token:
+        return True
+    rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0)
+    return rate > 0 and random.random() < rate
+
+
+def init_app(app):
+    profile_dir = os.getenv("PROFILE_DIR", "profiles")
+
+    @app.before_request
+    def _start_request():
+        g._metrics_start = time.perf_counter()
+        g._metrics_cpu_start = time.thread_time()
+        g._metrics_token = _request_stats.set(RequestStats())
+        if _should_profile():
+            g._profiler = cProfile.Profile()
+            g._profiler.enable()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("_metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        cpu = time.thread_time() - g.pop("_metrics_cpu_start")
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        method = request.method
+
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_")
+            path = os.path.join(profile_dir, f"{int(time.time() * 1000)}_{method}_{slug}.prof")
+            profiler.dump_stats(path)
+            response.headers["X-Profile-File"] = path
+
+        stats = _request_stats.get()
+        REQUEST_LATENCY.observe(elapsed, route, method, response.status_code)
+        REQUEST_CPU.observe(cpu, route, method)
+        if stats is not None:
+            SQL_STATEMENTS.observe(stats.statements, route, method)
+            SQL_TIME.observe(stats.sql_time, route, method)
+            response.headers["Server-Timing"] = (
+                f"app;dur={elapsed * 1000:.1f}, cpu;dur={cpu * 1000:.2f}, db;dur={stats.sql_time * 1000:.1f};desc=\"{stats.statements} queries\"")
+        if not response.is_streamed:
+            size = response.calculate_content_length()
+            if size is not None:
+                RESPONSE_SIZE.observe(size, route, method)
+        return response
+
+    @app.teardown_request
+    def _reset_request(exc):
+        token = g.pop("_metrics_token", None)
+        if token is not None:
+            _request_stats.reset(token)
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        body = "\n".join(metric.render() for metric in METRICS) + "\n"
+        return Response(body, mimetype="text/plain; version=0.0.4")
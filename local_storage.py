@@ -0,0 +1,161 @@
+# local_storage.py
+# Filesystem stand-in for the subset of the Supabase storage client the app uses
+# (`client.storage.from_(bucket).upload/update/download/remove/list`,
+# `create_signed_upload_url` and `create_signed_url`). Enabled by setting
+# LOCAL_STORAGE_DIR, for local development and the benchmark suite.
+#
+# Signed download URLs are file:// URLs of the object itself; there is nothing to sign
+# for a local file, and urllib opens them the way it opens Supabase's https ones.
+#
+# Signed upload URLs are emulated with HMAC tokens (LOCAL_STORAGE_SECRET) and served by the
+# route register_signed_upload_route() adds to the app, at the same path Supabase uses:
+# PUT {base_url}/storage/v1/object/upload/sign/<bucket>/<path>?token=...
+import base64
+import hashlib
+import hmac
+import json
+import os
+import pathlib
+import threading
+import time
+
+SIGNED_UPLOAD_TTL = 7200  # seconds, as Supabase
+SIGNED_UPLOAD_PATH = '/storage/v1/object/upload/sign'
+
+
+class StorageError(Exception):
+    pass
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class LocalBucket:
+    def __init__(self, root, name, client):
+        self.root = os.path.join(root, name)
+        self.name = name
+        self.client = client
+
+    def _path(self, path):
+        full = os.path.abspath(os.path.join(self.root, path))
+        if not full.startswith(os.path.abspath(self.root) + os.sep):
+            raise StorageError(f"Invalid object path: {path}")
+        return full
+
+    def _write(self, path, file, overwrite):
+        full = self._path(path)
+        if not overwrite and os.path.exists(full):
+            raise StorageError(f"The resource already exists: {path}")
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        data = file if isinstance(file, (bytes, bytearray)) else file.read()
+        tmp = f"{full}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, full)
+        return {"Key": f"{self.name}/{path}"}
+
+    def upload(self, path, file, file_options=None):
+        return self._write(path, file, overwrite=False)
+
+    def update(self, path, file, file_options=None):
+        # Supabase's update() replaces an existing object; the app also relies on it for new ones
+        return self._write(path, file, overwrite=True)
+
+    def download(self, path):
+        try:
+            with open(self._path(path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise StorageError(f"Object not found: {path}")
+
+    def list(self, path=None, options=None):
+        search = (options or {}).get('search', '')
+        folder = self._path(path) if path else os.path.abspath(self.root)
+        try:
+            names = sorted(os.listdir(folder))
+        except FileNotFoundError:
+            return []
+        return [
+            {"name": name, "metadata": {"size": os.path.getsize(os.path.join(folder, name))}}
+            for name in names
+            if search in name and not name.endswith('.tmp') and os.path.isfile(os.path.join(folder, name))
+        ]
+
+    def create_signed_upload_url(self, path):
+        self._path(path)  # validate
+        claims = {"b": self.name, "p": path, "exp": int(time.time()) + SIGNED_UPLOAD_TTL}
+        body = _b64(json.dumps(claims, separators=(',', ':')).encode())
+        token = f"{body}.{_b64(self.client.sign(body))}"
+        url = f"{self.client.base_url}{SIGNED_UPLOAD_PATH}/{self.name}/{path}?token={token}"
+        return {"signed_url": url, "signedUrl": url, "token": token, "path": path}
+
+    def create_signed_url(self, path, expires_in, options=None):
+        full = self._path(path)
+        if not os.path.isfile(full):
+            raise StorageError(f"Object not found: {path}")
+        url = pathlib.Path(full).as_uri()
+        return {"signedURL": url, "signedUrl": url}
+
+    def upload_to_signed_url(self, path, token, file, file_options=None):
+        if not self.client.verify(self.name, path, token):
+            raise StorageError("Invalid or expired upload token")
+        return self._write(path, file, overwrite=False)
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(self._path(path))
+            except FileNotFoundError:
+                pass
+        return [{"name": p} for p in paths]
+
+
+class LocalStorage:
+    def __init__(self, root, client):
+        self.root = root
+        self.client = client
+
+    def from_(self, bucket):
+        return LocalBucket(self.root, bucket, self.client)
+
+
+class LocalStorageClient:
+    def __init__(self, root, base_url='', secret=None):
+        os.makedirs(root, exist_ok=True)
+        self.base_url = base_url.rstrip('/')
+        self.secret = (secret or 'local-storage-dev-secret').encode()
+        self.storage = LocalStorage(root, self)
+
+    def sign(self, body):
+        return hmac.new(self.secret, body.encode(), hashlib.sha256).digest()
+
+    def verify(self, bucket, path, token):
+        body, _, signature = (token or '').partition('.')
+        try:
+            if not hmac.compare_digest(_unb64(signature), self.sign(body)):
+                return False
+            claims = json.loads(_unb64(body))
+        except (ValueError, TypeError):
+            return False
+        return claims.get('b') == bucket and claims.get('p') == path and claims.get('exp', 0) >= time.time()
+
+
+def register_signed_upload_route(app, client):
+    """Serve the stand-in's signed upload URLs, the way Supabase Storage does."""
+    from flask import jsonify, request
+
+    @app.route(f'{SIGNED_UPLOAD_PATH}/<string:bucket>/<path:object_path>', methods=['PUT'])
+    def local_signed_upload(bucket, object_path):
+        token = request.args.get('token')
+        if not client.verify(bucket, object_path, token):
+            return jsonify({"error": "Invalid or expired upload token"}), 403
+        try:
+            result = client.storage.from_(bucket).upload_to_signed_url(object_path, token, request.get_data())
+        except StorageError as e:
+            return jsonify({"error": str(e)}), 409
+        return jsonify(result), 200
@@ -0,0 +1,480 @@
+# media_metadata.py
+# Reads capture time, GPS position, orientation, dimensions and video duration out of
+# uploaded media into indexed AuditMedia columns, and searches media by them.
+#
+# Only file headers are needed: EXIF in JPEG/TIFF, IHDR in PNG, mvhd/tkhd in MP4/MOV.
+# They are read directly instead of decoding the image. Extraction is a pure function
+# of the bytes, so the backfill runs it in a process pool, like utility bill parsing.
+# Media uploaded through the API are extracted right after upload. Direct uploads, sync
+# blobs and existing rows go through `flask extract-media`, which claims rows by setting
+# them 'processing' with metadata_claimed_at. Claims older than CLAIM_TIMEOUT_MINUTES
+# (an extractor that died mid-batch) are taken again.
+#
+# Neither path holds whole files. The backfill reads the first HEADER_BYTES of each
+# object with a range request, plus the last TAIL_BYTES for MP4s that keep moov at the
+# end (see read_media_headers), and handles a claimed batch HEADER_WINDOW objects at a
+# time. Uploads queue only those header bytes, and at most MAX_QUEUED_EXTRACTS of them;
+# past that the media stays 'pending' for `flask extract-media`.
+import math
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import and_, func, or_, update
+
+from archive import archive_models
+from direct_uploads import object_path
+from models import db, Audit, AuditMedia, Property
+from sharding import current_organization_id, use_organization
+
+CLAIM_BATCH_SIZE = 200
+CLAIM_TIMEOUT_MINUTES = 30
+DOWNLOAD_THREADS = 16
+HEADER_WINDOW = 4 * DOWNLOAD_THREADS
+HEADER_BYTES = 256 * 1024
+TAIL_BYTES = 1024 * 1024
+MAX_QUEUED_EXTRACTS = 8
+SEARCH_LIMIT = 500
+MAX_SEARCH_LIMIT = 5000
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180  # along a meridian
+
+METADATA_FIELDS = ('captured_at', 'latitude', 'longitude', 'orientation', 'width', 'height', 'duration_seconds')
+
+# Single uploads are extracted right away; the backlog goes through extract_pending_media
+_executor = ThreadPoolExecutor(max_workers=2)
+_queued = threading.BoundedSemaphore(MAX_QUEUED_EXTRACTS)
+
+
+# ---------------------- EXIF ----------------------
+_TIFF_TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 7: ('B', 1), 9: ('i', 4), 10: ('ii', 8)}
+
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_PIXEL_X = 0xA002
+TAG_PIXEL_Y = 0xA003
+GPS_LAT_REF, GPS_LAT, GPS_LON_REF, GPS_LON = 1, 2, 3, 4
+
+
+def _read_ifd(tiff, offset, order):
+    """Tags of one IFD as {tag: value}; values are tuples, bytes or str."""
+    tags = {}
+    if offset + 2 > len(tiff):
+        return tags
+    (count,) = struct.unpack_from(order + 'H', tiff, offset)
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, kind, n = struct.unpack_from(order + 'HHI', tiff, entry)
+        if kind not in _TIFF_TYPES:
+            continue
+        fmt, size = _TIFF_TYPES[kind]
+        length = size * n
+        at = entry + 8 if length <= 4 else struct.unpack_from(order + 'I', tiff, entry + 8)[0]
+        raw = tiff[at:at + length]
+        if len(raw) < length:
+            continue
+        if kind == 2:
+            tags[tag] = raw.split(b'\0', 1)[0].decode('ascii', errors='replace').strip()
+        elif kind == 7:
+            tags[tag] = raw
+        else:
+            values = struct.unpack(order + fmt * n, raw)
+            if kind in (5, 10):
+                values = tuple(values[j] / values[j + 1] if values[j + 1] else 0.0 for j in range(0, len(values), 2))
+            tags[tag] = values
+    return tags
+
+
+def _exif_datetime(value):
+    try:
+        return datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def _gps_degrees(values, ref):
+    if not values or len(values) < 3:
+        return None
+    degrees = values[0] + values[1] / 60.0 + values[2] / 3600.0
+    return -degrees if ref in ('S', 'W') else degrees
+
+
+def parse_exif(tiff):
+    """Metadata fields from a TIFF-structured EXIF block."""
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None or len(tiff) < 8:
+        return {}
+    ifd0 = _read_ifd(tiff, struct.unpack_from(order + 'I', tiff, 4)[0], order)
+    exif = _read_ifd(tiff, ifd0[TAG_EXIF_IFD][0], order) if TAG_EXIF_IFD in ifd0 else {}
+    gps = _read_ifd(tiff, ifd0[TAG_GPS_IFD][0], order) if TAG_GPS_IFD in ifd0 else {}
+
+    fields = {
+        'captured_at': _exif_datetime(exif.get(TAG_DATETIME_ORIGINAL)) or _exif_datetime(ifd0.get(TAG_DATETIME)),
+        'orientation': ifd0.get(TAG_ORIENTATION, (None,))[0],
+        'width': exif.get(TAG_PIXEL_X, (None,))[0],
+        'height': exif.get(TAG_PIXEL_Y, (None,))[0],
+    }
+    latitude = _gps_degrees(gps.get(GPS_LAT), gps.get(GPS_LAT_REF))
+    longitude = _gps_degrees(gps.get(GPS_LON), gps.get(GPS_LON_REF))
+    if latitude is not None and longitude is not None and (latitude, longitude) != (0.0, 0.0):
+        fields['latitude'], fields['longitude'] = latitude, longitude
+    return fields
+
+
+# ---------------------- CONTAINERS ----------------------
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_metadata(content):
+    fields = {}
+    i = 2
+    while i + 4 <= len(content):
+        if content[i] != 0xFF:
+            break
+        marker = content[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD9, 0xDA):  # end of image / start of scan: headers are done
+            break
+        (length,) = struct.unpack_from('>H', content, i + 2)
+        segment = content[i + 4:i + 2 + length]
+        if marker == 0xE1 and segment[:6] == b'Exif\0\0':
+            fields = {**parse_exif(segment[6:]), **{k: v for k, v in fields.items() if v is not None}}
+        elif marker in _SOF_MARKERS and len(segment) >= 5:
+            height, width = struct.unpack_from('>HH', segment, 1)
+            fields['width'], fields['height'] = width, height
+        i += 2 + length
+    return fields
+
+
+def _png_metadata(content):
+    if len(content) < 24 or content[12:16] != b'IHDR':
+        return {}
+    width, height = struct.unpack_from('>II', content, 16)
+    return {'width': width, 'height': height}
+
+
+_MP4_CONTAINERS = {b'moov', b'trak', b'mdia'}
+MP4_EPOCH = datetime(1904, 1, 1)
+
+
+def _mp4_boxes(content, start, end):
+    i = start
+    while i + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', content, i)
+        header = 8
+        if size == 1 and i + 16 <= end:
+            (size,) = struct.unpack_from('>Q', content, i + 8)
+            header = 16
+        elif size == 0:
+            size = end - i
+        if size < header:
+            break
+        yield kind, i + header, min(i + size, end)
+        i += size
+
+
+def _mp4_metadata(content):
+    fields = {}
+
+    def walk(start, end):
+        for kind, body, box_end in _mp4_boxes(content, start, end):
+            if kind in _MP4_CONTAINERS:
+                walk(body, box_end)
+            elif kind == b'mvhd' and box_end - body >= 20:
+                if content[body] == 1:
+                    created, _, timescale, duration = struct.unpack_from('>QQIQ', content, body + 4)
+                else:
+                    created, _, timescale, duration = struct.unpack_from('>IIII', content, body + 4)
+                if timescale:
+                    fields['duration_seconds'] = round(duration / timescale, 3)
+                if created:
+                    fields['captured_at'] = MP4_EPOCH + timedelta(seconds=created)
+            elif kind == b'tkhd' and box_end - body >= 84 and not fields.get('width'):
+                width, height = struct.unpack_from('>II', content, box_end - 8)
+                if width and height:
+                    fields['width'], fields['height'] = width >> 16, height >> 16
+
+    walk(0, len(content))
+    return fields
+
+
+def _trailing_moov(tail):
+    """The last complete moov box in `tail`, or None."""
+    at = tail.rfind(b'moov')
+    while at >= 4:
+        (size,) = struct.unpack_from('>I', tail, at - 4)
+        if 8 <= size <= len(tail) - (at - 4):
+            return tail[at - 4:at - 4 + size]
+        at = tail.rfind(b'moov', 0, at)
+    return None
+
+
+def _headers(head, read_tail):
+    """The bytes extraction needs, given the start of a file. `read_tail()` returns its end."""
+    if len(head) < HEADER_BYTES or head[4:8] != b'ftyp':
+        return head
+    if any(kind == b'moov' for kind, _, _ in _mp4_boxes(head, 0, len(head))):
+        return head
+    # moov after the media data: ftyp followed by the moov from the end of the file
+    moov = _trailing_moov(read_tail())
+    (ftyp_size,) = struct.unpack_from('>I', head)
+    return head[:ftyp_size] + moov if moov else head
+
+
+def media_headers(content):
+    """Trim in-memory media to the bytes extract_metadata() reads."""
+    return _headers(content[:HEADER_BYTES], lambda: content[-TAIL_BYTES:])
+
+
+def _read_tail(source, size):
+    if getattr(source, 'status', None) == 206:
+        return source.read(size)
+    tail = b''  # the server sent the whole object; keep only its end
+    for chunk in iter(lambda: source.read(HEADER_BYTES), b''):
+        tail = (tail + chunk)[-size:]
+    return tail
+
+
+def read_media_headers(open_range):
+    """Read the bytes extract_metadata() needs from stored media.
+
+    `open_range(byte_range)` opens the object with an HTTP Range header value such as
+    'bytes=0-1023'; a source that ignores the range is read only as far as needed.
+    """
+    with open_range(f'bytes=0-{HEADER_BYTES - 1}') as source:
+        head = source.read(HEADER_BYTES)
+
+    def read_tail():
+        with open_range(f'bytes=-{TAIL_BYTES}') as source:
+            return _read_tail(source, TAIL_BYTES)
+
+    return _headers(head, read_tail)
+
+
+def extract_metadata(file_name, content):
+    """Metadata fields for raw media bytes. Returns (fields, error); safe to run in a worker process."""
+    try:
+        if content[:3] == b'\xff\xd8\xff':
+            fields = _jpeg_metadata(content)
+        elif content[:8] == b'\x89PNG\r\n\x1a\n':
+            fields = _png_metadata(content)
+        elif content[:4] in (b'II*\0', b'MM\0*'):
+            fields = parse_exif(content)
+        elif content[4:8] == b'ftyp':
+            fields = _mp4_metadata(content)
+        else:
+            return {}, f'Unsupported media format: {file_name}'
+        return {k: v for k, v in fields.items() if v is not None}, None
+    except (struct.error, IndexError, ValueError, OverflowError) as e:
+        return {}, f'{type(e).__name__}: {e}'
+
+
+# ---------------------- STORE ----------------------
+def _store_result(media, fields, error):
+    for field in METADATA_FIELDS:
+        setattr(media, field, fields.get(field))
+    media.metadata_status = 'failed' if error else 'extracted'
+
+
+def enqueue_extract(app, media_id, file_name, content):
+    """Extract in the background. Returns None, leaving the media to `flask extract-media`, if the queue is full."""
+    if not _queued.acquire(blocking=False):
+        return None
+    organization_id = current_organization_id()
+    headers = media_headers(content)
+
+    def work():
+        try:
+            fields, error = extract_metadata(file_name, headers)
+            with app.app_context(), use_organization(organization_id):
+                media = AuditMedia.query.get(media_id)
+                if media and media.metadata_status in ('pending', 'failed'):
+                    _store_result(media, fields, error)
+                    db.session.commit()
+        finally:
+            _queued.release()
+
+    return _executor.submit(work)
+
+
+def _claim_pending(limit):
+    # SKIP LOCKED lets several `flask extract-media` processes share the backfill
+    now = datetime.utcnow()
+    stale = now - timedelta(minutes=CLAIM_TIMEOUT_MINUTES)
+    media = (
+        AuditMedia.query.filter(
+            AuditMedia.status == 'ready',
+            or_(AuditMedia.metadata_status == 'pending',
+                and_(AuditMedia.metadata_status == 'processing',
+                     or_(AuditMedia.metadata_claimed_at.is_(None), AuditMedia.metadata_claimed_at < stale))))
+        .order_by(AuditMedia.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if media:
+        # Core update: claiming is not a change sync clients need to see
+        db.session.execute(update(AuditMedia.__table__)
+                           .where(AuditMedia.__table__.c.id.in_([m.id for m in media]))
+                           .values(metadata_status='processing', metadata_claimed_at=now))
+    db.session.commit()
+    return media
+
+
+def extract_pending_media(fetch, url_prefix='', workers=None, batch_size=CLAIM_BATCH_SIZE):
+    """Backfill metadata for media not yet extracted. `fetch(path)` returns the object's headers
+    (see read_media_headers); `url_prefix` is stripped from media_url for media without a storage_path."""
+    extracted = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as downloads:
+        while True:
+            batch = _claim_pending(batch_size)
+            if not batch:
+                break
+
+            def download(job):
+                media_id, path = job
+                try:
+                    return fetch(path)
+                except Exception as e:
+                    print(f"❌ Could not download media {media_id}: {e}")
+                    return None
+
+            # A window at a time, so at most HEADER_WINDOW objects' headers are held
+            for start in range(0, len(batch), HEADER_WINDOW):
+                window = batch[start:start + HEADER_WINDOW]
+                contents = list(downloads.map(download, [(m.id, object_path(m, url_prefix)) for m in window]))
+                fetched = [(m, c) for m, c in zip(window, contents) if c is not None]
+                results = pool.map(extract_metadata, [m.file_name for m, _ in fetched], [c for _, c in fetched],
+                                   chunksize=8)
+                for (media, _), (fields, error) in zip(fetched, results):
+                    _store_result(media, fields, error)
+                for media, content in zip(window, contents):
+                    if content is None:
+                        _store_result(media, {}, 'Download failed')
+            db.session.commit()
+
+            extracted += sum(1 for m in batch if m.metadata_status == 'extracted')
+            failed += sum(1 for m in batch if m.metadata_status == 'failed')
+    return extracted, failed
+
+
+# ---------------------- SEARCH ----------------------
+def _parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Invalid boolean: {value}")
+
+
+def _distances(lat1, lon1, lat2, lon2):
+    """Haversine distance in meters between arrays of coordinates."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _media_json(media, distance):
+    return {
+        "id": media.id,
+        "audit_id": media.audit_id,
+        "step_id": media.step_id,
+        "step_type": media.step_type,
+        "side": media.side,
+        "media_url": media.media_url,
+        "media_type": media.media_type,
+        "captured_at": media.captured_at.isoformat() if media.captured_at else None,
+        "latitude": media.latitude,
+        "longitude": media.longitude,
+        "orientation": media.orientation,
+        "width": media.width,
+        "height": media.height,
+        "duration_seconds": media.duration_seconds,
+        "distance_m": None if distance is None or math.isnan(distance) else round(float(distance), 1),
+    }
+
+
+def search_media(args, audit_id=None, archived=False):
+    """Media matching the filters in `args` (request query args), for one audit or the portfolio.
+
+    Filters: step_type, side, media_type, has_gps, captured_after, captured_before (ISO 8601),
+    min_distance_m / max_distance_m from the property, after_id and limit for paging.
+    Raises ValueError for malformed filters.
+    """
+    _, media_model = archive_models(archived)
+    limit = min(int(args.get('limit', SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+    query = (
+        db.session.query(media_model, Property.latitude, Property.longitude)
+        .join(Audit, Audit.id == media_model.audit_id)
+        .join(Property, Property.id == Audit.property_id)
+        .filter(media_model.status == 'ready')
+    )
+    if audit_id is not None:
+        query = query.filter(media_model.audit_id == audit_id)
+    for field in ('step_type', 'side', 'media_type'):
+        if args.get(field):
+            query = query.filter(getattr(media_model, field) == args[field])
+    if args.get('has_gps'):
+        has_gps = _parse_bool(args['has_gps'])
+        query = query.filter(media_model.metadata_status == 'extracted',
+                             media_model.latitude.isnot(None) if has_gps else media_model.latitude.is_(None))
+    if args.get('captured_after'):
+        query = query.filter(media_model.captured_at >= datetime.fromisoformat(args['captured_after']))
+    if args.get('captured_before'):
+        query = query.filter(media_model.captured_at < datetime.fromisoformat(args['captured_before']))
+    if args.get('after_id'):
+        query = query.filter(media_model.id > int(args['after_id']))
+
+    min_distance = float(args['min_distance_m']) if args.get('min_distance_m') else None
+    max_distance = float(args['max_distance_m']) if args.get('max_distance_m') else None
+    by_distance = min_distance is not None or max_distance is not None
+    if by_distance:
+        query = query.filter(media_model.latitude.isnot(None), Property.latitude.isnot(None))
+        if max_distance is not None:
+            # Bounding box in SQL, exact distance below. Haversine gives
+            # sin(d / 2R) >= cos(lat) * sin(dlon / 2) for the highest latitude in the box,
+            # which also holds across the antimeridian (dlon near 360).
+            span = max_distance / METERS_PER_DEGREE
+            query = query.filter(media_model.latitude.between(Property.latitude - span, Property.latitude + span))
+            if max_distance < math.pi * EARTH_RADIUS_M:
+                dlon = func.abs(media_model.longitude - Property.longitude)
+                widest = func.cos(func.radians(func.abs(Property.latitude) + span))
+                query = query.filter(widest * func.sin(func.radians(dlon) / 2)
+                                     <= math.sin(max_distance / (2 * EARTH_RADIUS_M)))
+
+    results, scanned_id, next_after_id = [], None, None
+    query = query.order_by(media_model.id)
+    chunk_size = max(limit, 1000) if by_distance else limit
+    while len(results) < limit:
+        # Chunks resume after the last row scanned, kept or not
+        chunk = query.filter(media_model.id > scanned_id) if scanned_id else query
+        rows = chunk.limit(chunk_size).all()
+        if not rows:
+            break
+        scanned_id = rows[-1][0].id
+        columns = list(zip(*[(m.latitude, m.longitude, lat, lon) for m, lat, lon in rows]))
+        distance = _distances(*[[np.nan if v is None else v for v in c] for c in columns])
+        keep = np.ones(len(rows), dtype=bool)
+        if min_distance is not None:
+            keep &= distance > min_distance
+        if max_distance is not None:
+            keep &= distance <= max_distance
+        for (media, _, _), d, k in zip(rows, distance, keep):
+            if k:
+                results.append(_media_json(media, d))
+                if len(results) == limit:
+                    next_after_id = media.id  # the next page starts right after the last row returned
+                    break
+        if len(rows) < chunk_size:
+            break
+    return {"media": results, "next_after_id": next_after_id}
@@ -2,6 +2,7 @@ import logging
 from logging.config import fileConfig
 
 from flask import current_app
+from sqlalchemy import create_engine, text
 
 from alembic import context
 
@@ -24,6 +25,18 @@ def get_engine():
         return current_app.extensions['migrate'].db.engine
 
 
+def get_shard_spec():
+    """SHARDS entry named by `-x shard=<name>` (see `flask db-upgrade-shards`), or None for the primary."""
+    from sharding import router
+    name = context.get_x_argument(as_dictionary=True).get('shard')
+    if name is None:
+        return None
+    spec = router.specs().get(name)
+    if spec is None:
+        raise KeyError(f"Unknown shard '{name}'")
+    return spec
+
+
 def get_engine_url():
     try:
         return get_engine().url.render_as_string(hide_password=False).replace(
@@ -36,7 +49,9 @@ def get_engine_url():
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-config.set_main_option('sqlalchemy.url', get_engine_url())
+shard_spec = get_shard_spec()
+config.set_main_option('sqlalchemy.url',
+                       shard_spec['url'].replace('%', '%%') if shard_spec else get_engine_url())
 target_db = current_app.extensions['migrate'].db
 
 # other values from the config, defined by the needs of env.py,
@@ -94,9 +109,18 @@ def run_migrations_online():
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
 
-    connectable = get_engine()
+    connectable = create_engine(shard_spec['url']) if shard_spec else get_engine()
+    schema = shard_spec.get('schema') if shard_spec else None
 
     with connectable.connect() as connection:
+        if schema:
+            # Schema shards: every unqualified name, the raw SQL in migrations included,
+            # and the alembic_version table resolve inside the shard's schema
+            connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+            connection.execute(text(f'SET search_path TO "{schema}"'))
+            connection.commit()
+            connection.dialect.default_schema_name = schema
+            conf_args['version_table_schema'] = schema
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
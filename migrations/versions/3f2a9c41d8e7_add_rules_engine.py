@@ -0,0 +1,57 @@
+"""add rules engine tables and change tracking
+
+Revision ID: 3f2a9c41d8e7
+Revises: 7b17312d1312
+Create Date: 2026-10-19 09:12:44.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c41d8e7'
+down_revision = '7b17312d1312'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rule_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('full', sa.Boolean(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('audits_evaluated', sa.Integer(), nullable=True),
+    sa.Column('findings_written', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('properties', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_properties_updated_at'), ['updated_at'], unique=False)
+
+    with op.batch_alter_table('audit_steps', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_audit_steps_updated_at'), ['updated_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_steps_audit_id'), ['audit_id'], unique=False)
+
+    with op.batch_alter_table('audit_findings', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rule_id', sa.String(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_audit_findings_step_id'), ['step_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_findings', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_audit_findings_step_id'))
+        batch_op.drop_column('rule_id')
+
+    with op.batch_alter_table('audit_steps', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_audit_steps_audit_id'))
+        batch_op.drop_index(batch_op.f('ix_audit_steps_updated_at'))
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('properties', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_properties_updated_at'))
+        batch_op.drop_column('updated_at')
+
+    op.drop_table('rule_runs')
@@ -0,0 +1,66 @@
+"""add utility_bills and utility_usage
+
+Revision ID: 8c51e0b7a2d4
+Revises: 3f2a9c41d8e7
+Create Date: 2026-10-19 11:40:03.552817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c51e0b7a2d4'
+down_revision = '3f2a9c41d8e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('utility_bills',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('property_id', sa.Integer(), nullable=False),
+    sa.Column('file_name', sa.String(), nullable=True),
+    sa.Column('storage_path', sa.String(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+    sa.Column('parsed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['property_id'], ['properties.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('utility_bills', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_utility_bills_content_hash'), ['content_hash'], unique=False)
+        batch_op.create_index(batch_op.f('ix_utility_bills_property_id'), ['property_id'], unique=False)
+
+    op.create_table('utility_usage',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('bill_id', sa.Integer(), nullable=False),
+    sa.Column('property_id', sa.Integer(), nullable=False),
+    sa.Column('fuel', sa.String(), nullable=False),
+    sa.Column('unit', sa.String(), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('period_end', sa.Date(), nullable=False),
+    sa.Column('usage', sa.Float(), nullable=True),
+    sa.Column('cost', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['bill_id'], ['utility_bills.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['property_id'], ['properties.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('utility_usage', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_utility_usage_bill_id'), ['bill_id'], unique=False)
+        batch_op.create_index('ix_utility_usage_property_period', ['property_id', 'period_start'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('utility_usage', schema=None) as batch_op:
+        batch_op.drop_index('ix_utility_usage_property_period')
+        batch_op.drop_index(batch_op.f('ix_utility_usage_bill_id'))
+
+    op.drop_table('utility_usage')
+    with op.batch_alter_table('utility_bills', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_utility_bills_property_id'))
+        batch_op.drop_index(batch_op.f('ix_utility_bills_content_hash'))
+
+    op.drop_table('utility_bills')
@@ -0,0 +1,46 @@
+"""scope utility bills and usage to organizations, add bill claim timestamps
+
+Revision ID: a4d9e2b7c813
+Revises: f3c7a2e8d514
+Create Date: 2026-10-20 09:12:37.554019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d9e2b7c813'
+down_revision = 'f3c7a2e8d514'
+branch_labels = None
+depends_on = None
+
+TENANT_TABLES = ['utility_bills', 'utility_usage']
+
+
+def upgrade():
+    for table in TENANT_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('organization_id', sa.Integer(), nullable=False, server_default='1'))
+        # Bills and usage belong to the organization of their property
+        op.execute(f"""
+            UPDATE {table} SET organization_id = (
+                SELECT p.organization_id FROM properties p WHERE p.id = {table}.property_id
+            )
+        """)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('organization_id', server_default=None)
+            batch_op.create_index(batch_op.f(f'ix_{table}_organization_id'), ['organization_id'], unique=False)
+
+    with op.batch_alter_table('utility_bills', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('utility_bills', schema=None) as batch_op:
+        batch_op.drop_column('claimed_at')
+
+    for table in reversed(TENANT_TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_organization_id'))
+            batch_op.drop_column('organization_id')
@@ -0,0 +1,48 @@
+"""add organizations and organization_id tenant keys
+
+Revision ID: b47e2d9f1c60
+Revises: 8c51e0b7a2d4
+Create Date: 2026-10-19 14:05:51.907342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b47e2d9f1c60'
+down_revision = '8c51e0b7a2d4'
+branch_labels = None
+depends_on = None
+
+TENANT_TABLES = ['properties', 'audits', 'audit_steps', 'audit_media']
+
+
+def upgrade():
+    organizations = op.create_table('organizations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('shard', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Existing rows belong to the default organization (sharding.DEFAULT_ORGANIZATION_ID)
+    op.bulk_insert(organizations, [{'id': 1, 'name': 'Default', 'shard': None}])
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("SELECT setval(pg_get_serial_sequence('organizations', 'id'), 1)")
+
+    for table in TENANT_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('organization_id', sa.Integer(), nullable=False, server_default='1'))
+            batch_op.create_index(batch_op.f(f'ix_{table}_organization_id'), ['organization_id'], unique=False)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('organization_id', server_default=None)
+
+
+def downgrade():
+    for table in reversed(TENANT_TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_organization_id'))
+            batch_op.drop_column('organization_id')
+
+    op.drop_table('organizations')
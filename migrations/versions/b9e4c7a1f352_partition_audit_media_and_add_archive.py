@@ -0,0 +1,188 @@
+"""partition audit_media by month and add audit archive tables
+
+Revision ID: b9e4c7a1f352
+Revises: b47e2d9f1c60
+Create Date: 2026-10-19 16:22:37.418605
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e4c7a1f352'
+down_revision = 'b47e2d9f1c60'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3  # archive.PARTITION_MONTHS_AHEAD
+
+# (hot table, archive table, columns); parents first
+ARCHIVED = [
+    ('audit_steps', 'audit_steps_archive',
+     'id, organization_id, audit_id, step_type, label, is_completed, not_accessible, notes, updated_at'),
+    ('audit_findings', 'audit_findings_archive',
+     'id, step_id, title, description, recommendation, severity, source, rule_id'),
+    ('audit_media', 'audit_media_archive',
+     'id, organization_id, audit_id, step_id, step_type, side, media_url, file_name, media_type, created_at'),
+]
+
+MEDIA_INDEXES = ['audit_id', 'step_id', 'created_at']
+
+
+def _add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_audit_media(bind):
+    op.execute("ALTER TABLE audit_media RENAME TO audit_media_unpartitioned")
+    op.execute("ALTER TABLE audit_media_unpartitioned RENAME CONSTRAINT audit_media_pkey TO audit_media_unpartitioned_pkey")
+    op.execute("DROP INDEX ix_audit_media_organization_id")
+    op.execute("CREATE TABLE audit_media (LIKE audit_media_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    # The partition key has to be part of every unique constraint
+    op.execute("ALTER TABLE audit_media ADD CONSTRAINT audit_media_pkey PRIMARY KEY (id, created_at)")
+    op.execute("ALTER TABLE audit_media ADD CONSTRAINT audit_media_audit_id_fkey "
+               "FOREIGN KEY (audit_id) REFERENCES audits (id)")
+    op.execute("ALTER TABLE audit_media ADD CONSTRAINT audit_media_step_id_fkey "
+               "FOREIGN KEY (step_id) REFERENCES audit_steps (id)")
+
+    first = bind.execute(sa.text("SELECT MIN(created_at) FROM audit_media_unpartitioned")).scalar()
+    this_month = date.today().replace(day=1)
+    month = first.date().replace(day=1) if first else this_month
+    while month <= _add_months(this_month, MONTHS_AHEAD):
+        op.execute(f"CREATE TABLE audit_media_{month:%Y_%m} PARTITION OF audit_media "
+                   f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')")
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE audit_media_default PARTITION OF audit_media DEFAULT")
+
+    op.execute("INSERT INTO audit_media SELECT * FROM audit_media_unpartitioned")
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('audit_media_unpartitioned', 'id')")).scalar()
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY audit_media.id")
+    op.execute("DROP TABLE audit_media_unpartitioned")
+
+
+def _unpartition_audit_media(bind):
+    op.execute("ALTER TABLE audit_media RENAME TO audit_media_partitioned")
+    op.execute("ALTER TABLE audit_media_partitioned RENAME CONSTRAINT audit_media_pkey TO audit_media_partitioned_pkey")
+    op.execute("CREATE TABLE audit_media (LIKE audit_media_partitioned INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO audit_media SELECT * FROM audit_media_partitioned")
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('audit_media_partitioned', 'id')")).scalar()
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY audit_media.id")
+    op.execute("DROP TABLE audit_media_partitioned")  # drops its partitions too
+    op.execute("ALTER TABLE audit_media ADD CONSTRAINT audit_media_pkey PRIMARY KEY (id)")
+    op.execute("ALTER TABLE audit_media ADD CONSTRAINT audit_media_audit_id_fkey "
+               "FOREIGN KEY (audit_id) REFERENCES audits (id)")
+    op.execute("ALTER TABLE audit_media ADD CONSTRAINT audit_media_step_id_fkey "
+               "FOREIGN KEY (step_id) REFERENCES audit_steps (id)")
+    op.create_index('ix_audit_media_organization_id', 'audit_media', ['organization_id'], unique=False)
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    with op.batch_alter_table('audits', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('completed_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('archived_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_audits_completed_at'), ['completed_at'], unique=False)
+
+    # Audits whose steps are all done (the predicate of archive.refresh_completion) count as
+    # completed when their last step changed. Steps written before audit_steps.updated_at
+    # existed have none, so those audits fall back to their creation time.
+    op.execute("""
+        UPDATE audits SET completed_at = COALESCE(
+            (SELECT MAX(s.updated_at) FROM audit_steps s WHERE s.audit_id = audits.id),
+            audits.created_at, CURRENT_TIMESTAMP)
+        WHERE EXISTS (SELECT 1 FROM audit_steps s WHERE s.audit_id = audits.id)
+          AND NOT EXISTS (
+            SELECT 1 FROM audit_steps s WHERE s.audit_id = audits.id
+              AND NOT (COALESCE(s.is_completed, FALSE) OR COALESCE(s.not_accessible, FALSE)))
+    """)
+
+    op.execute("UPDATE audit_media SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+    if bind.dialect.name == 'postgresql':
+        _partition_audit_media(bind)
+        op.create_index('ix_audit_media_organization_id', 'audit_media', ['organization_id'], unique=False)
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        for column in MEDIA_INDEXES:
+            batch_op.create_index(batch_op.f(f'ix_audit_media_{column}'), [column], unique=False)
+
+    op.create_table('audit_steps_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('audit_id', sa.Integer(), nullable=False),
+    sa.Column('step_type', sa.String(), nullable=False),
+    sa.Column('label', sa.String(), nullable=True),
+    sa.Column('is_completed', sa.Boolean(), nullable=True),
+    sa.Column('not_accessible', sa.Boolean(), nullable=True),
+    sa.Column('notes', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['audit_id'], ['audits.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_steps_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_steps_archive_audit_id'), ['audit_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_steps_archive_organization_id'), ['organization_id'], unique=False)
+
+    op.create_table('audit_findings_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('step_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('recommendation', sa.Text(), nullable=True),
+    sa.Column('severity', sa.String(), nullable=True),
+    sa.Column('source', sa.String(), nullable=True),
+    sa.Column('rule_id', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['step_id'], ['audit_steps_archive.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_findings_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_findings_archive_step_id'), ['step_id'], unique=False)
+
+    op.create_table('audit_media_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('audit_id', sa.Integer(), nullable=False),
+    sa.Column('step_id', sa.Integer(), nullable=True),
+    sa.Column('step_type', sa.String(), nullable=False),
+    sa.Column('side', sa.String(), nullable=True),
+    sa.Column('media_url', sa.String(), nullable=True),
+    sa.Column('file_name', sa.String(), nullable=True),
+    sa.Column('media_type', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['audit_id'], ['audits.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_media_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_media_archive_audit_id'), ['audit_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_media_archive_organization_id'), ['organization_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_media_archive_step_id'), ['step_id'], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+
+    # Bring archived rows back before the archive tables go away
+    for hot, archive, columns in ARCHIVED:
+        op.execute(f"INSERT INTO {hot} ({columns}) SELECT {columns} FROM {archive}")
+    for _, archive, _ in reversed(ARCHIVED):
+        op.drop_table(archive)
+
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        for column in reversed(MEDIA_INDEXES):
+            batch_op.drop_index(batch_op.f(f'ix_audit_media_{column}'))
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('ix_audit_media_organization_id', table_name='audit_media')
+        _unpartition_audit_media(bind)
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
+
+    with op.batch_alter_table('audits', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_audits_completed_at'))
+        batch_op.drop_column('archived_at')
+        batch_op.drop_column('completed_at')
@@ -0,0 +1,29 @@
+"""add media metadata claim timestamps
+
+Revision ID: c7e5a1d9b246
+Revises: a4d9e2b7c813
+Create Date: 2026-10-20 10:04:51.236190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e5a1d9b246'
+down_revision = 'a4d9e2b7c813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows left 'processing' by a crashed extractor have no claim time and are retaken
+    for table in ('audit_media', 'audit_media_archive'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('metadata_claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    for table in ('audit_media_archive', 'audit_media'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('metadata_claimed_at')
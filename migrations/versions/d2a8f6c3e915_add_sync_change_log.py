@@ -0,0 +1,85 @@
+"""add sync change log, sync operations and media blobs
+
+Revision ID: d2a8f6c3e915
+Revises: b9e4c7a1f352
+Create Date: 2026-10-19 18:47:12.630914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8f6c3e915'
+down_revision = 'b9e4c7a1f352'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('audits', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_version', sa.Integer(), nullable=False, server_default='0'))
+    with op.batch_alter_table('audits', schema=None) as batch_op:
+        batch_op.alter_column('sync_version', server_default=None)
+
+    op.create_table('audit_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('audit_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('changed_at', sa.DateTime(), nullable=True),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['audit_id'], ['audits.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_changes', schema=None) as batch_op:
+        batch_op.create_index('ix_audit_changes_audit_version', ['audit_id', 'version'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_changes_organization_id'), ['organization_id'], unique=False)
+
+    op.create_table('sync_operations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('op_id', sa.String(length=64), nullable=False),
+    sa.Column('audit_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('applied_at', sa.DateTime(), nullable=True),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['audit_id'], ['audits.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('organization_id', 'op_id', name='uq_sync_operations_op_id')
+    )
+    with op.batch_alter_table('sync_operations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_sync_operations_organization_id'), ['organization_id'], unique=False)
+
+    op.create_table('media_blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('storage_path', sa.String(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('content_type', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('organization_id', 'content_hash', name='uq_media_blobs_content_hash')
+    )
+    with op.batch_alter_table('media_blobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_media_blobs_organization_id'), ['organization_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('media_blobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_media_blobs_organization_id'))
+    op.drop_table('media_blobs')
+
+    with op.batch_alter_table('sync_operations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_sync_operations_organization_id'))
+    op.drop_table('sync_operations')
+
+    with op.batch_alter_table('audit_changes', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_audit_changes_organization_id'))
+        batch_op.drop_index('ix_audit_changes_audit_version')
+    op.drop_table('audit_changes')
+
+    with op.batch_alter_table('audits', schema=None) as batch_op:
+        batch_op.drop_column('sync_version')
@@ -0,0 +1,39 @@
+"""add status and storage_path to audit_media for direct uploads
+
+Revision ID: e61b4d09a7c2
+Revises: d2a8f6c3e915
+Create Date: 2026-10-19 20:11:45.208377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61b4d09a7c2'
+down_revision = 'd2a8f6c3e915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing media were uploaded through the API and are complete
+    for table in ('audit_media', 'audit_media_archive'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('status', sa.String(), nullable=False, server_default='ready'))
+            batch_op.add_column(sa.Column('storage_path', sa.String(), nullable=True))
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('status', server_default=None)
+
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_media_storage_path'), ['storage_path'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_audit_media_storage_path'))
+
+    for table in ('audit_media_archive', 'audit_media'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('storage_path')
+            batch_op.drop_column('status')
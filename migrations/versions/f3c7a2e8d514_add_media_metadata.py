@@ -0,0 +1,63 @@
+"""add extracted media metadata and property coordinates
+
+Revision ID: f3c7a2e8d514
+Revises: e61b4d09a7c2
+Create Date: 2026-10-19 21:36:02.417853
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c7a2e8d514'
+down_revision = 'e61b4d09a7c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('properties', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('latitude', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('longitude', sa.Float(), nullable=True))
+
+    # Existing media start out 'pending' and are picked up by `flask extract-media`
+    for table in ('audit_media', 'audit_media_archive'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('metadata_status', sa.String(), nullable=False, server_default='pending'))
+            batch_op.add_column(sa.Column('captured_at', sa.DateTime(), nullable=True))
+            batch_op.add_column(sa.Column('latitude', sa.Float(), nullable=True))
+            batch_op.add_column(sa.Column('longitude', sa.Float(), nullable=True))
+            batch_op.add_column(sa.Column('orientation', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('width', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('height', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('duration_seconds', sa.Float(), nullable=True))
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('metadata_status', server_default=None)
+            batch_op.create_index(batch_op.f(f'ix_{table}_captured_at'), ['captured_at'], unique=False)
+            batch_op.create_index(f'ix_{table}_location', ['latitude', 'longitude'], unique=False)
+
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_media_metadata_status'), ['metadata_status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_media', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_audit_media_metadata_status'))
+
+    for table in ('audit_media_archive', 'audit_media'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_location')
+            batch_op.drop_index(batch_op.f(f'ix_{table}_captured_at'))
+            batch_op.drop_column('duration_seconds')
+            batch_op.drop_column('height')
+            batch_op.drop_column('width')
+            batch_op.drop_column('orientation')
+            batch_op.drop_column('longitude')
+            batch_op.drop_column('latitude')
+            batch_op.drop_column('captured_at')
+            batch_op.drop_column('metadata_status')
+
+    with op.batch_alter_table('properties', schema=None) as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
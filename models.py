@@ -2,10 +2,21 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import relationship
 from datetime import datetime
+from sharding import TenantScoped, TenantSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': TenantSession})
 
-class Property(db.Model):
+
+class Organization(db.Model):
+    __tablename__ = 'organizations'
+    __directory__ = True  # always read from the primary, see sharding.TenantSession
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    shard = db.Column(db.String, nullable=True)  # key in SHARDS; NULL = primary database
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Property(TenantScoped, db.Model):
     __tablename__ = 'properties'
     id = db.Column(db.Integer, primary_key=True)
     street = db.Column(db.String)
@@ -16,12 +27,15 @@ class Property(db.Model):
     sqft = db.Column(db.Integer, nullable=True)
     utility_bill_url = db.Column(db.String, nullable=True)
     utility_bill_name = db.Column(db.String, nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Relationships
     audits = relationship('Audit', back_populates='property', cascade="all, delete-orphan")
 
 
-class Audit(db.Model):
+class Audit(TenantScoped, db.Model):
     __tablename__ = 'audits'
     id = db.Column(db.Integer, primary_key=True)
     property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=False)
@@ -29,21 +43,25 @@ class Audit(db.Model):
     auditor_name = db.Column(db.String, nullable=True)
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True, index=True)  # set once every step is done
+    archived_at = db.Column(db.DateTime, nullable=True)  # steps/media/findings moved to *_archive
+    sync_version = db.Column(db.Integer, nullable=False, default=0)  # latest AuditChange.version
 
     # Relationships
     property = relationship('Property', back_populates='audits')
     steps = relationship('AuditStep', back_populates='audit', cascade="all, delete-orphan")
 
 
-class AuditStep(db.Model):
+class AuditStep(TenantScoped, db.Model):
     __tablename__ = 'audit_steps'
     id = db.Column(db.Integer, primary_key=True)
-    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id', ondelete='CASCADE'), nullable=False)
+    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id', ondelete='CASCADE'), nullable=False, index=True)
     step_type = db.Column(db.String, nullable=False)  # e.g., 'exterior', 'attic'
     label = db.Column(db.String, nullable=True)       # e.g., 'North Side', 'Attic Access Hatch'
     is_completed = db.Column(db.Boolean, default=False)
     not_accessible = db.Column(db.Boolean, default=False)
     notes = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Relationships
     audit = relationship('Audit', back_populates='steps')
@@ -51,17 +69,35 @@ class AuditStep(db.Model):
     findings = relationship('AuditFinding', back_populates='step', cascade="all, delete-orphan")
 
 
-class AuditMedia(db.Model):
+# On Postgres audit_media is range-partitioned by month on created_at, so the table's
+# primary key is (id, created_at); ids still come from a single sequence.
+class AuditMedia(TenantScoped, db.Model):
     __tablename__ = 'audit_media'
     id = db.Column(db.Integer, primary_key=True)
-    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id'), nullable=False)
-    step_id = db.Column(db.Integer, db.ForeignKey('audit_steps.id'), nullable=True)
+    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id'), nullable=False, index=True)
+    step_id = db.Column(db.Integer, db.ForeignKey('audit_steps.id'), nullable=True, index=True)
     step_type = db.Column(db.String, nullable=False)
     side = db.Column(db.String, nullable=True)
     media_url = db.Column(db.String, nullable=True)
     file_name = db.Column(db.String, nullable=True)  # ✅ ADD THIS LINE
     media_type = db.Column(db.String, nullable=True)  # e.g., 'photo', 'video'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    status = db.Column(db.String, nullable=False, default='ready')  # 'pending' until a direct upload completes
+    storage_path = db.Column(db.String, nullable=True, index=True)  # object key, for direct uploads
+    # Read from the file itself by media_metadata.py
+    metadata_status = db.Column(db.String, nullable=False, default='pending', index=True)  # 'pending', 'processing', 'extracted', 'failed'
+    metadata_claimed_at = db.Column(db.DateTime, nullable=True)  # when an extractor took it; stale claims are retaken
+    captured_at = db.Column(db.DateTime, nullable=True, index=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    orientation = db.Column(db.Integer, nullable=True)  # EXIF orientation, 1-8
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    duration_seconds = db.Column(db.Float, nullable=True)  # videos only
+
+    __table_args__ = (
+        db.Index('ix_audit_media_location', 'latitude', 'longitude'),
+    )
 
     # Relationships
     step = relationship('AuditStep', back_populates='media')
@@ -70,12 +106,161 @@ class AuditMedia(db.Model):
 class AuditFinding(db.Model):
     __tablename__ = 'audit_findings'
     id = db.Column(db.Integer, primary_key=True)
-    step_id = db.Column(db.Integer, db.ForeignKey('audit_steps.id', ondelete='CASCADE'), nullable=False)
+    step_id = db.Column(db.Integer, db.ForeignKey('audit_steps.id', ondelete='CASCADE'), nullable=False, index=True)
     title = db.Column(db.String, nullable=True)
     description = db.Column(db.Text, nullable=True)
     recommendation = db.Column(db.Text, nullable=True)
     severity = db.Column(db.String, nullable=True)  # e.g., 'low', 'medium', 'high'
-    source = db.Column(db.String, nullable=True)    # e.g., 'AI', 'Inspector'
+    source = db.Column(db.String, nullable=True)    # e.g., 'AI', 'Inspector', 'rules'
+    rule_id = db.Column(db.String, nullable=True)   # set when source='rules'
 
     # Relationships
-    step = relationship('AuditStep', back_populates='findings')
\ No newline at end of file
+    step = relationship('AuditStep', back_populates='findings')
+
+
+# ---------------------- ARCHIVE ----------------------
+# Cold copies of the steps, media and findings of long-completed audits (see archive.py).
+# Rows keep their ids so they can be moved back if an archived audit is edited again.
+class ArchivedAuditStep(TenantScoped, db.Model):
+    __tablename__ = 'audit_steps_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id', ondelete='CASCADE'), nullable=False, index=True)
+    step_type = db.Column(db.String, nullable=False)
+    label = db.Column(db.String, nullable=True)
+    is_completed = db.Column(db.Boolean, default=False)
+    not_accessible = db.Column(db.Boolean, default=False)
+    notes = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class ArchivedAuditMedia(TenantScoped, db.Model):
+    __tablename__ = 'audit_media_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id', ondelete='CASCADE'), nullable=False, index=True)
+    step_id = db.Column(db.Integer, nullable=True, index=True)
+    step_type = db.Column(db.String, nullable=False)
+    side = db.Column(db.String, nullable=True)
+    media_url = db.Column(db.String, nullable=True)
+    file_name = db.Column(db.String, nullable=True)
+    media_type = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String, nullable=False, default='ready')
+    storage_path = db.Column(db.String, nullable=True)
+    metadata_status = db.Column(db.String, nullable=False, default='pending')
+    metadata_claimed_at = db.Column(db.DateTime, nullable=True)
+    captured_at = db.Column(db.DateTime, nullable=True, index=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    orientation = db.Column(db.Integer, nullable=True)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    duration_seconds = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_audit_media_archive_location', 'latitude', 'longitude'),
+    )
+
+
+class ArchivedAuditFinding(db.Model):
+    __tablename__ = 'audit_findings_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    step_id = db.Column(db.Integer, db.ForeignKey('audit_steps_archive.id', ondelete='CASCADE'), nullable=False, index=True)
+    title = db.Column(db.String, nullable=True)
+    description = db.Column(db.Text, nullable=True)
+    recommendation = db.Column(db.Text, nullable=True)
+    severity = db.Column(db.String, nullable=True)
+    source = db.Column(db.String, nullable=True)
+    rule_id = db.Column(db.String, nullable=True)
+
+
+# ---------------------- SYNC ----------------------
+# Change log for the offline sync protocol (see sync.py). Every write to an audit's steps,
+# findings or media bumps audits.sync_version and records one row per changed entity at
+# that version; entity_id NULL means the whole collection changed (rules re-evaluation).
+class AuditChange(TenantScoped, db.Model):
+    __tablename__ = 'audit_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id', ondelete='CASCADE'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String, nullable=False)  # 'step', 'finding', 'media'
+    entity_id = db.Column(db.Integer, nullable=True)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_audit_changes_audit_version', 'audit_id', 'version'),
+    )
+
+
+class SyncOperation(TenantScoped, db.Model):
+    __tablename__ = 'sync_operations'
+    id = db.Column(db.Integer, primary_key=True)
+    op_id = db.Column(db.String(64), nullable=False)  # client-generated, unique per organization
+    audit_id = db.Column(db.Integer, db.ForeignKey('audits.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String, nullable=False)
+    entity_id = db.Column(db.Integer, nullable=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('organization_id', 'op_id', name='uq_sync_operations_op_id'),
+    )
+
+
+class MediaBlob(TenantScoped, db.Model):
+    __tablename__ = 'media_blobs'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)  # sha256 of the bytes
+    storage_path = db.Column(db.String, nullable=False)
+    size = db.Column(db.Integer, nullable=True)
+    content_type = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('organization_id', 'content_hash', name='uq_media_blobs_content_hash'),
+    )
+
+
+class RuleRun(db.Model):
+    __tablename__ = 'rule_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    full = db.Column(db.Boolean, default=False)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    audits_evaluated = db.Column(db.Integer, default=0)
+    findings_written = db.Column(db.Integer, default=0)
+
+
+class UtilityBill(TenantScoped, db.Model):
+    __tablename__ = 'utility_bills'
+    id = db.Column(db.Integer, primary_key=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=False, index=True)
+    file_name = db.Column(db.String, nullable=True)
+    storage_path = db.Column(db.String, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)  # sha256 of the uploaded bytes
+    status = db.Column(db.String, nullable=False, default='pending')  # 'pending', 'processing', 'parsed', 'failed'
+    claimed_at = db.Column(db.DateTime, nullable=True)  # when a parser took it; stale claims are retaken
+    error = db.Column(db.Text, nullable=True)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    parsed_at = db.Column(db.DateTime, nullable=True)
+
+    # Relationships
+    usage = relationship('UtilityUsage', back_populates='bill', cascade="all, delete-orphan")
+
+
+class UtilityUsage(TenantScoped, db.Model):
+    __tablename__ = 'utility_usage'
+    id = db.Column(db.Integer, primary_key=True)
+    bill_id = db.Column(db.Integer, db.ForeignKey('utility_bills.id', ondelete='CASCADE'), nullable=False, index=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=False)
+    fuel = db.Column(db.String, nullable=False)  # 'electric' or 'gas'
+    unit = db.Column(db.String, nullable=False)  # 'kWh' or 'therm'
+    period_start = db.Column(db.Date, nullable=False)
+    period_end = db.Column(db.Date, nullable=False)
+    usage = db.Column(db.Float, nullable=True)
+    cost = db.Column(db.Float, nullable=True)
+
+    # Relationships
+    bill = relationship('UtilityBill', back_populates='usage')
+
+    __table_args__ = (
+        db.Index('ix_utility_usage_property_period', 'property_id', 'period_start'),
+    )
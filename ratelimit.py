@@ -0,0 +1,238 @@
+# ratelimit.py
+# Token-bucket rate limits per client and per route, and an in-flight cap on uploads.
+#
+# Requests to a route in ROUTE_LIMITS spend a token from that client's bucket for the
+# route. RATE_LIMIT_CLIENT (off by default) adds a bucket per client shared by every route.
+# A request spends from its buckets only if all of them have a token, so a rejection never
+# costs the client anything. Upload routes additionally hold one of
+# RATE_LIMIT_UPLOAD_CONCURRENCY in-flight slots per client until the request ends, so one
+# tablet re-uploading in a loop cannot occupy every worker. Over any limit the response is
+# 429 with Retry-After. The check runs in before_request, ahead of idempotency (which
+# hashes the body), so a rejected upload's body is never read.
+#
+# A client is the X-Client-Id header (tablets send their device id), or the remote address
+# when the header is absent, within the request's organization. The remote address is the
+# client's own once app.py's ProxyFix has applied X-Forwarded-For. Limits are written as
+# "<requests per second>/<burst>"; RATE_LIMIT_ROUTES overrides ROUTE_LIMITS with a JSON
+# object {endpoint: "rate/burst" or "off"}. Buckets live in process memory, so each worker
+# enforces its own share. Set RATE_LIMIT_REDIS_URL (requires `redis`) to keep them in Redis,
+# shared by all workers.
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+from sharding import current_organization_id
+
+CLIENT_HEADER = 'X-Client-Id'
+MAX_CLIENT_ID_LENGTH = 128
+MAX_MEMORY_KEYS = 100000
+SLOT_TTL_SECONDS = 600  # frees Redis slots of workers that died mid-request
+
+# endpoint -> "rate/burst" per client, on top of the client-wide limit
+ROUTE_LIMITS = {
+    'upload_media_by_step_label': '2/20',
+    'upload_step_media': '2/20',
+    'upload_utility_bill': '0.2/5',
+    'upload_media_blob': '5/50',  # sync pushes the blobs of a whole offline session at once
+    'agent_chat': '0.5/10',
+    'download_audit_media_archive': '0.1/3',
+}
+UPLOAD_ENDPOINTS = {'upload_media_by_step_label', 'upload_step_media', 'upload_utility_bill', 'upload_media_blob'}
+EXEMPT_ENDPOINTS = {'metrics', 'storage_webhook'}
+
+
+def parse_limit(value):
+    """(rate, burst) for "rate/burst", or None for "off"/"0"."""
+    if value is None or str(value).strip().lower() in ('', '0', 'off', 'none'):
+        return None
+    rate, _, burst = str(value).partition('/')
+    rate = float(rate)
+    burst = float(burst) if burst else max(rate, 1.0)
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"Invalid rate limit: {value}")
+    return rate, burst
+
+
+class MemoryStore:
+    """Buckets and in-flight counters of this process."""
+
+    def __init__(self, max_keys=MAX_MEMORY_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at), least recently used first
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets):
+        """Spend a token from each of `buckets` ((key, rate, burst) triples) if every one has a token.
+
+        Returns 0 if allowed, else the seconds until all of them have one; nothing is spent then.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels, wait = [], 0.0
+            for key, rate, burst in buckets:
+                tokens, updated_at = self._buckets.pop(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated_at) * rate)
+                levels.append((key, tokens))
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            for key, tokens in levels:
+                self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            # Dropping an idle bucket only forgets tokens it has likely regained
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def acquire(self, key, limit):
+        with self._lock:
+            in_flight = self._slots.get(key, 0)
+            if in_flight >= limit:
+                return False
+            self._slots[key] = in_flight + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            in_flight = self._slots.get(key, 0) - 1
+            if in_flight > 0:
+                self._slots[key] = in_flight
+            else:
+                self._slots.pop(key, None)
+
+
+# Timestamps come from the Redis server, so workers with skewed clocks agree. ARGV holds
+# rate and burst for each key in turn.
+_TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels, wait = {}, 0
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(bucket[1]) or burst
+  local ts = tonumber(bucket[2]) or now
+  tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+  if tokens < 1 then wait = math.max(wait, (1 - tokens) / rate) end
+  levels[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  local tokens = levels[i]
+  if wait == 0 then tokens = tokens - 1 end
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(wait)
+"""
+_ACQUIRE_SCRIPT = """
+local n = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if n > tonumber(ARGV[1]) then
+  redis.call('DECR', KEYS[1])
+  return 0
+end
+return 1
+"""
+# Never below zero, even if the slot expired (SLOT_TTL_SECONDS) while the request ran
+_RELEASE_SCRIPT = """
+local n = tonumber(redis.call('GET', KEYS[1]) or '0')
+if n <= 1 then
+  redis.call('DEL', KEYS[1])
+else
+  redis.call('DECR', KEYS[1])
+end
+"""
+
+
+class RedisStore:
+    """Buckets and in-flight counters shared by every worker through Redis.
+
+    Limits fail open: if Redis is unreachable the request is let through.
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.25)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+        self._errors = (redis.RedisError, OSError)
+
+    def take(self, buckets):
+        try:
+            return float(self._take(keys=[self.prefix + key for key, _, _ in buckets],
+                                    args=[value for _, rate, burst in buckets for value in (rate, burst)]))
+        except self._errors as e:
+            print(f"⚠️ Rate limit store unavailable: {e}")
+            return 0.0
+
+    def acquire(self, key, limit):
+        try:
+            return bool(self._acquire(keys=[self.prefix + 'slots:' + key], args=[limit, SLOT_TTL_SECONDS]))
+        except self._errors as e:
+            print(f"⚠️ Rate limit store unavailable: {e}")
+            return True
+
+    def release(self, key):
+        try:
+            self._release(keys=[self.prefix + 'slots:' + key])
+        except self._errors as e:
+            print(f"⚠️ Rate limit store unavailable: {e}")
+
+
+def _client_key():
+    client = request.headers.get(CLIENT_HEADER, '')[:MAX_CLIENT_ID_LENGTH] or request.remote_addr or 'unknown'
+    return f"{current_organization_id()}:{client}"
+
+
+def _too_many(wait):
+    response = jsonify({"error": "Too many requests"})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def init_app(app):
+    """Register the limiter. Must run after sharding (for the organization) and before idempotency."""
+    client_limit = parse_limit(os.getenv('RATE_LIMIT_CLIENT', 'off'))
+    route_limits = {**ROUTE_LIMITS, **json.loads(os.getenv('RATE_LIMIT_ROUTES') or '{}')}
+    route_limits = {endpoint: parse_limit(value) for endpoint, value in route_limits.items()}
+    upload_concurrency = int(os.getenv('RATE_LIMIT_UPLOAD_CONCURRENCY', '2'))
+    redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+    store = RedisStore(redis_url) if redis_url else MemoryStore()
+    app.extensions['rate_limit_store'] = store
+
+    @app.before_request
+    def _check_rate_limits():
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in EXEMPT_ENDPOINTS or request.method == 'OPTIONS':
+            return None
+        client = _client_key()
+        buckets = []
+        if client_limit:
+            buckets.append((client, *client_limit))
+        if route_limits.get(endpoint):
+            buckets.append((f"{client}:{endpoint}", *route_limits[endpoint]))
+        if buckets:
+            wait = store.take(buckets)
+            if wait:
+                return _too_many(wait)
+        if endpoint in UPLOAD_ENDPOINTS and upload_concurrency > 0:
+            slot = f"{client}:uploads"
+            if not store.acquire(slot, upload_concurrency):
+                return _too_many(1)
+            g._upload_slot = slot
+        return None
+
+    @app.teardown_request
+    def _release_upload_slot(exc):
+        slot = g.pop('_upload_slot', None)
+        if slot is not None:
+            store.release(slot)
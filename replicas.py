@@ -0,0 +1,236 @@
+# replicas.py
+# Read-replica routing for GET requests.
+#
+# READ_REPLICAS lists replicas per shard (see sharding.py); a bare list means the
+# primary database:
+#
+#   READ_REPLICAS='{"default": ["postgresql://replica-1/audits", "postgresql://replica-2/audits"],
+#                   "east": [{"url": "postgresql://east-replica/audits", "schema": "tenant_east"}]}'
+#
+# A GET is served from a replica only if the replica is healthy, lags the primary by no
+# more than REPLICA_MAX_LAG_SECONDS, and has replayed past the client's last write. Every
+# successful write returns its position in an X-Last-Write header and a cookie. Clients
+# send it back on later reads, so they always see their own writes and fall back to the
+# primary until a replica catches up.
+#
+# On Postgres the position is the primary's WAL position, "<shard>@<lsn>", compared with
+# the replica's pg_last_wal_replay_lsn(), so app hosts' clocks never meet. Elsewhere it is
+# the write time, and a replica must have replayed REPLICA_CLOCK_SKEW_SECONDS past it to
+# cover clock differences between the host that wrote and the host that reads. Health
+# and lag are re-checked lazily every REPLICA_CHECK_INTERVAL seconds. A replica that
+# errors mid-request is marked down and the request is retried once on the primary.
+import json
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import g, request
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+
+LAST_WRITE_HEADER = 'X-Last-Write'
+LAST_WRITE_COOKIE = 'last_write'
+READ_METHODS = ('GET', 'HEAD')
+
+# Postgres reports replay lag as growing while the primary is idle; a fully replayed
+# replica is treated as current
+PG_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END, pg_last_wal_replay_lsn()::text
+"""
+PG_WRITE_LSN_SQL = "SELECT pg_current_wal_lsn()::text"
+
+# Write positions a replica must have replayed past for the current request; None = use the primary
+_read_after = ContextVar('read_after', default=None)
+_used_replica = ContextVar('used_replica', default=None)
+
+
+class Replica:
+    def __init__(self, spec):
+        self.url = spec['url']
+        engine = create_engine(spec['url'], pool_pre_ping=True)
+        if spec.get('schema'):
+            engine = engine.execution_options(schema_translate_map={None: spec['schema']})
+        self.engine = engine
+        self.healthy = True
+        self.lag = 0.0
+        self.replayed_lsn = None
+        self.checked_at = 0.0
+        self._checking = threading.Lock()
+
+    @property
+    def replayed_until(self):
+        return self.checked_at - self.lag
+
+    def refresh(self):
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == 'postgresql':
+                    lag, lsn = conn.execute(text(PG_LAG_SQL)).one()
+                    self.lag = float(lag or 0.0)
+                    self.replayed_lsn = parse_lsn(lsn) if lsn else None
+                else:
+                    conn.execute(text("SELECT 1"))
+                    self.lag = 0.0
+            self.healthy = True
+        except DBAPIError as e:
+            print(f"❌ Replica {self.engine.url.render_as_string()} unavailable: {e}")
+            self.healthy = False
+        self.checked_at = time.time()
+
+    def maybe_refresh(self, interval):
+        if time.time() - self.checked_at < interval:
+            return
+        # One request refreshes; concurrent ones keep using the last reading
+        if self._checking.acquire(blocking=False):
+            try:
+                self.refresh()
+            finally:
+                self._checking.release()
+
+    def caught_up(self, shard, positions, clock_skew):
+        for position in positions:
+            if isinstance(position, tuple):
+                # LSNs only compare within the shard's own database
+                written_on, lsn = position
+                if written_on == shard and (self.replayed_lsn is None or self.replayed_lsn < lsn):
+                    return False
+            elif self.replayed_until < position + clock_skew:
+                return False
+        return True
+
+    def mark_down(self):
+        self.healthy = False
+        self.checked_at = time.time()
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self._replicas = None
+        self._lock = threading.Lock()
+        self.max_lag = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+        self.check_interval = float(os.getenv('REPLICA_CHECK_INTERVAL', '2'))
+        self.clock_skew = float(os.getenv('REPLICA_CLOCK_SKEW_SECONDS', '1'))
+
+    def replicas(self, shard):
+        if self._replicas is None:
+            with self._lock:
+                if self._replicas is None:
+                    raw = json.loads(os.getenv('READ_REPLICAS') or '{}')
+                    if isinstance(raw, list):
+                        raw = {'default': raw}
+                    self._replicas = {
+                        name: [Replica(s if isinstance(s, dict) else {'url': s}) for s in specs]
+                        for name, specs in raw.items()
+                    }
+        return self._replicas.get(shard, ())
+
+    def route(self, shard, primary):
+        """Engine for the current statement: a caught-up replica for reads, else `primary`."""
+        positions = _read_after.get()
+        if positions is None:
+            return primary
+        replicas = self.replicas(shard)
+        if not replicas:
+            return primary
+
+        used = _used_replica.get()
+        if used is not None and used in replicas and used.healthy:
+            return used.engine  # keep one request on one replica
+
+        eligible = []
+        for replica in replicas:
+            replica.maybe_refresh(self.check_interval)
+            if (replica.healthy and replica.lag <= self.max_lag
+                    and replica.caught_up(shard, positions, self.clock_skew)):
+                eligible.append(replica)
+        if not eligible:
+            return primary
+        replica = random.choice(eligible)
+        _used_replica.set(replica)
+        return replica.engine
+
+    def dispose(self):
+        with self._lock:
+            for replicas in (self._replicas or {}).values():
+                for replica in replicas:
+                    replica.engine.dispose()
+            self._replicas = None
+
+
+replica_router = ReplicaRouter()
+
+
+def parse_lsn(value):
+    """'16/B374D848' -> 0x16B374D848"""
+    high, low = value.split('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def parse_position(value):
+    """A write position from X-Last-Write: (shard, lsn) or a timestamp; None if malformed."""
+    try:
+        if '@' in value:
+            shard, lsn = value.rsplit('@', 1)
+            return shard, parse_lsn(lsn)
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def write_position(shard, engine):
+    """Where a write the primary just committed ends up in its replicas' replay."""
+    if engine.dialect.name == 'postgresql':
+        try:
+            with engine.connect() as conn:
+                return f"{shard}@{conn.execute(text(PG_WRITE_LSN_SQL)).scalar()}"
+        except DBAPIError as e:
+            print(f"⚠️ Could not read WAL position of shard {shard}: {e}")
+    return f"{time.time():.3f}"
+
+
+def _client_last_writes():
+    values = [request.headers.get(LAST_WRITE_HEADER), request.cookies.get(LAST_WRITE_COOKIE)]
+    return tuple(p for p in (parse_position(v) for v in values if v) if p is not None)
+
+
+def init_app(app, db):
+    @app.before_request
+    def _route_reads():
+        if request.method in READ_METHODS:
+            g._read_after_token = _read_after.set(_client_last_writes())
+            g._used_replica_token = _used_replica.set(None)
+
+    @app.after_request
+    def _stamp_writes(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            from sharding import current_shard, router  # sharding imports this module
+
+            shard = current_shard()
+            position = write_position(shard, router.engine(shard))
+            response.headers[LAST_WRITE_HEADER] = position
+            response.set_cookie(LAST_WRITE_COOKIE, position, httponly=True, samesite='Lax')
+        return response
+
+    @app.teardown_request
+    def _reset_reads(exc):
+        for name, var in (('_read_after_token', _read_after), ('_used_replica_token', _used_replica)):
+            token = g.pop(name, None)
+            if token is not None:
+                var.reset(token)
+
+    @app.errorhandler(DBAPIError)
+    def _retry_on_primary(error):
+        replica = _used_replica.get()
+        if replica is None or g.get('_replica_retried'):
+            raise error
+        replica.mark_down()
+        db.session.rollback()
+        g._replica_retried = True
+        _read_after.set(None)
+        _used_replica.set(None)
+        return app.ensure_sync(app.view_functions[request.endpoint])(**request.view_args)
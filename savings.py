@@ -0,0 +1,273 @@
+# savings.py
+# Projected energy and dollar savings per finding. Every finding in scope is loaded in
+# one query and priced with NumPy array arithmetic, so scoring a single audit and
+# scoring the whole portfolio share the same code path.
+import threading
+from functools import lru_cache
+
+import numpy as np
+from sqlalchemy import text
+
+from findings_engine import RULES
+from sharding import current_organization_id, tenant_engine
+
+# Fraction of annual use saved per measure, for a home at the reference age.
+MEASURES = {
+    'attic_insulation': {'electric': 0.03, 'gas': 0.12, 'keywords': ('attic', 'insulation')},
+    'crawlspace': {'electric': 0.015, 'gas': 0.06, 'keywords': ('crawlspace', 'crawl space', 'floor insulation')},
+    'air_sealing': {'electric': 0.02, 'gas': 0.08, 'keywords': ('air seal', 'air leak', 'draft')},
+    'duct_sealing': {'electric': 0.04, 'gas': 0.05, 'keywords': ('duct',)},
+    'windows': {'electric': 0.02, 'gas': 0.05, 'keywords': ('window',)},
+    'lighting': {'electric': 0.05, 'gas': 0.0, 'keywords': ('led', 'lighting', 'bulb')},
+    'water_heater': {'electric': 0.03, 'gas': 0.06, 'keywords': ('water heater',)},
+}
+MEASURE_NAMES = list(MEASURES)
+ELECTRIC_FRACTION = np.array([MEASURES[m]['electric'] for m in MEASURE_NAMES] + [0.0])
+GAS_FRACTION = np.array([MEASURES[m]['gas'] for m in MEASURE_NAMES] + [0.0])
+NO_MEASURE = len(MEASURE_NAMES)
+
+RULE_MEASURES = {rule['id']: rule['measure'] for rule in RULES if rule.get('measure')}
+
+# Fallbacks when a property has no parsed utility usage
+KWH_PER_SQFT = 12.0
+THERMS_PER_SQFT = 0.35
+PRICE_PER_KWH = 0.16
+PRICE_PER_THERM = 1.40
+
+# Older homes leak more; savings scale linearly with age around REFERENCE_YEAR
+REFERENCE_YEAR = 1980
+AGE_FACTOR_RANGE = (0.5, 1.5)
+
+
+@lru_cache(maxsize=4096)
+def classify(rule_id, title, recommendation):
+    if rule_id in RULE_MEASURES:
+        return MEASURE_NAMES.index(RULE_MEASURES[rule_id])
+    haystack = f"{title or ''} {recommendation or ''}".lower()
+    for i, name in enumerate(MEASURE_NAMES):
+        if any(word in haystack for word in MEASURES[name]['keywords']):
+            return i
+    return NO_MEASURE
+
+
+# ---------------------- LOADING ----------------------
+# Findings of archived audits (see archive.py) still count toward savings
+FINDINGS_FROM = """
+    (SELECT id, step_id, rule_id, title, recommendation FROM audit_findings
+     UNION ALL SELECT id, step_id, rule_id, title, recommendation FROM audit_findings_archive) f
+    JOIN (SELECT id, audit_id, organization_id FROM audit_steps
+          UNION ALL SELECT id, audit_id, organization_id FROM audit_steps_archive) s ON s.id = f.step_id
+"""
+
+FINDINGS_SQL = """
+    SELECT f.id, s.audit_id, a.property_id, p.sqft, p.year_built, f.rule_id, f.title, f.recommendation
+    FROM """ + FINDINGS_FROM + """
+    JOIN audits a ON a.id = s.audit_id
+    JOIN properties p ON p.id = a.property_id
+"""
+
+USAGE_SQL = """
+    SELECT u.property_id, u.fuel, SUM(u.usage) AS usage, SUM(u.cost) AS cost,
+           MIN(u.period_start) AS first_day, MAX(u.period_end) AS last_day
+    FROM utility_usage u
+"""
+
+# Every write to an audit's findings (ORM edits, sync and rule runs alike) bumps
+# audits.sync_version, so the versions of the audits in scope stand in for their findings
+# without reading them. Properties and parsed bills carry their own timestamps.
+AUDIT_FINGERPRINT_SQL = """
+    SELECT a.sync_version, p.updated_at,
+           (SELECT MAX(b.parsed_at) FROM utility_bills b WHERE b.property_id = a.property_id),
+           (SELECT MAX(r.id) FROM rule_runs r)
+    FROM audits a JOIN properties p ON p.id = a.property_id
+    WHERE a.id = :audit_id AND a.organization_id = :org
+"""
+
+PORTFOLIO_FINGERPRINT_SQL = """
+    SELECT COUNT(*), COALESCE(SUM(a.sync_version), 0),
+           (SELECT MAX(p.updated_at) FROM properties p WHERE p.organization_id = :org),
+           (SELECT MAX(b.parsed_at) FROM utility_bills b WHERE b.organization_id = :org),
+           (SELECT MAX(r.id) FROM rule_runs r)
+    FROM audits a WHERE a.organization_id = :org
+"""
+
+
+def _scope(organization_id, audit_id):
+    params = {'org': organization_id}
+    if audit_id is None:
+        props = "(SELECT id FROM properties WHERE organization_id = :org)"
+        where = {
+            'findings_where': 'WHERE s.organization_id = :org',
+            'usage_where': f'WHERE u.property_id IN {props}',
+        }
+    else:
+        params['audit_id'] = audit_id
+        props = "(SELECT property_id FROM audits WHERE id = :audit_id AND organization_id = :org)"
+        where = {
+            'findings_where': 'WHERE s.audit_id = :audit_id AND s.organization_id = :org',
+            'usage_where': f'WHERE u.property_id IN {props}',
+        }
+    return where, params
+
+
+def _fingerprint(conn, organization_id, audit_id):
+    sql = PORTFOLIO_FINGERPRINT_SQL if audit_id is None else AUDIT_FINGERPRINT_SQL
+    _, params = _scope(organization_id, audit_id)
+    row = conn.execute(text(sql), params).first()
+    return tuple(row) if row is not None else None
+
+
+def _load(conn, organization_id, audit_id):
+    where, params = _scope(organization_id, audit_id)
+    findings_sql = FINDINGS_SQL + " " + where['findings_where']
+    usage_sql = USAGE_SQL + " " + where['usage_where'] + " GROUP BY u.property_id, u.fuel"
+    findings = conn.execute(text(findings_sql), params).all()
+    usage = conn.execute(text(usage_sql), params).all()
+    return findings, usage
+
+
+# ---------------------- ESTIMATION ----------------------
+def _as_float(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _days(first, last):
+    first = np.array(first, dtype='datetime64[D]')
+    last = np.array(last, dtype='datetime64[D]')
+    return (last - first).astype(float) + 1.0
+
+
+def estimate(findings, usage):
+    """Vectorized savings for `findings` rows given aggregated `usage` rows. Returns a dict of arrays."""
+    n = len(findings)
+    if n == 0:
+        empty = np.zeros(0)
+        return {'finding_id': empty.astype(int), 'audit_id': empty.astype(int), 'property_id': empty.astype(int),
+                'measure': empty.astype(int), 'kwh': empty, 'therms': empty, 'dollars': empty}
+
+    columns = list(zip(*findings))
+    finding_id = np.array(columns[0], dtype=np.int64)
+    audit_id = np.array(columns[1], dtype=np.int64)
+    property_id = np.array(columns[2], dtype=np.int64)
+    sqft = _as_float(columns[3])
+    year_built = _as_float(columns[4])
+    measure = np.fromiter((classify(r, t, rec) for r, t, rec in zip(*columns[5:8])), dtype=np.int64, count=n)
+
+    # Annualized baseline use and unit price per property, keyed by position in `props`
+    props, prop_index = np.unique(property_id, return_inverse=True)
+    baseline = {}
+    for fuel, per_sqft, default_price in (('electric', KWH_PER_SQFT, PRICE_PER_KWH),
+                                          ('gas', THERMS_PER_SQFT, PRICE_PER_THERM)):
+        annual = np.full(len(props), np.nan)
+        price = np.full(len(props), default_price)
+        rows = [u for u in usage if u.fuel == fuel]
+        if rows:
+            ucols = list(zip(*rows))
+            pos = np.searchsorted(props, np.array(ucols[0], dtype=np.int64))
+            pos = np.clip(pos, 0, len(props) - 1)
+            known = props[pos] == np.array(ucols[0], dtype=np.int64)
+            total = _as_float(ucols[2])
+            cost = _as_float(ucols[3])
+            days = _days(ucols[4], ucols[5])
+            annual[pos[known]] = (total * 365.0 / days)[known]
+            unit_price = np.where(total > 0, cost / np.where(total > 0, total, 1.0), np.nan)
+            has_price = known & np.isfinite(unit_price)
+            price[pos[has_price]] = unit_price[has_price]
+        annual = annual[prop_index]
+        annual = np.where(np.isnan(annual), sqft * per_sqft, annual)
+        baseline[fuel] = (np.nan_to_num(annual), price[prop_index])
+
+    age_factor = np.clip(1.0 + (REFERENCE_YEAR - year_built) / 80.0, *AGE_FACTOR_RANGE)
+    age_factor = np.where(np.isnan(age_factor), 1.0, age_factor)
+
+    # A measure is only counted once per audit, however many findings point at it
+    _, first = np.unique(np.stack([audit_id, measure]), axis=1, return_index=True)
+    counted = np.zeros(n, dtype=bool)
+    counted[first] = True
+    counted &= measure != NO_MEASURE
+
+    kwh = np.where(counted, baseline['electric'][0] * ELECTRIC_FRACTION[measure] * age_factor, 0.0)
+    therms = np.where(counted, baseline['gas'][0] * GAS_FRACTION[measure] * age_factor, 0.0)
+    dollars = kwh * baseline['electric'][1] + therms * baseline['gas'][1]
+
+    return {'finding_id': finding_id, 'audit_id': audit_id, 'property_id': property_id,
+            'measure': measure, 'kwh': kwh, 'therms': therms, 'dollars': dollars}
+
+
+def _totals(result):
+    return {
+        'kwh': round(float(result['kwh'].sum()), 1),
+        'therms': round(float(result['therms'].sum()), 1),
+        'dollars': round(float(result['dollars'].sum()), 2),
+    }
+
+
+def _audit_summary(result):
+    findings = [
+        {
+            'finding_id': int(result['finding_id'][i]),
+            'measure': MEASURE_NAMES[m] if m != NO_MEASURE else None,
+            'kwh': round(float(result['kwh'][i]), 1),
+            'therms': round(float(result['therms'][i]), 1),
+            'dollars': round(float(result['dollars'][i]), 2),
+        }
+        for i, m in enumerate(result['measure'].tolist())
+    ]
+    return {'findings': findings, 'total': _totals(result)}
+
+
+def _portfolio_summary(result):
+    by_measure = {}
+    measures = result['measure']
+    for i, name in enumerate(MEASURE_NAMES):
+        mask = measures == i
+        if mask.any():
+            by_measure[name] = _totals({k: result[k][mask] for k in ('kwh', 'therms', 'dollars')})
+    return {
+        'properties': int(np.unique(result['property_id']).size),
+        'audits': int(np.unique(result['audit_id']).size),
+        'findings': int(result['finding_id'].size),
+        'by_measure': by_measure,
+        'total': _totals(result),
+    }
+
+
+# ---------------------- CACHE ----------------------
+# Results are keyed by (organization, audit) and validated against a fingerprint of their inputs (audit
+# sync versions, the latest rule run, property and parsed-bill timestamps), so any write to
+# those inputs invalidates the cached estimate on the next read. The fingerprint reads one
+# row per audit in scope, never the findings or usage themselves.
+_cache = {}
+_cache_lock = threading.Lock()
+MAX_CACHED_AUDITS = 10000
+
+
+def _cached(audit_id, summarize):
+    organization_id = current_organization_id()
+    key = (organization_id, audit_id)
+    with tenant_engine().connect() as conn:
+        fingerprint = _fingerprint(conn, organization_id, audit_id)
+        with _cache_lock:
+            hit = _cache.get(key)
+        if hit and hit[0] == fingerprint:
+            return hit[1]
+        summary = summarize(estimate(*_load(conn, organization_id, audit_id)))
+
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHED_AUDITS:
+            _cache.clear()
+        _cache[key] = (fingerprint, summary)
+    return summary
+
+
+def audit_savings(audit_id):
+    return _cached(audit_id, _audit_summary)
+
+
+def portfolio_savings():
+    return _cached(None, _portfolio_summary)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,221 @@
+# sharding.py
+# Tenant (organization) scoping and shard routing.
+#
+# Every request runs as one organization, taken from the X-Organization-Id header and
+# falling back to the default organization. Models that mix in TenantScoped get an
+# organization_id column that is filled in on insert and added as a filter to every
+# ORM query in that request. Raw SQL goes through tenant_engine() and filters on
+# current_organization_id() itself.
+#
+# Organizations live in the primary (directory) database with a `shard` name. SHARDS
+# maps shard names to databases, or to Postgres schemas inside one database:
+#
+#   SHARDS='{"east": "postgresql://db-east/audits",
+#            "west": {"url": "postgresql://db-main/audits", "schema": "tenant_west"}}'
+#
+# Organizations without a shard, or when SHARDS is unset, use the primary database.
+# `flask db upgrade` migrates the primary only. `flask db-upgrade-shards` runs the same
+# migrations against every entry of SHARDS, creating a schema shard's schema and
+# alembic_version table inside it. Run it after adding a shard and after every
+# `flask db upgrade`, before routing organizations to the shard.
+# Each shard keeps its own id sequences, so ids are only unique inside a shard. Reads
+# may be served by a shard's replicas, see replicas.py.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, jsonify, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Column, Integer, create_engine, event, text
+from sqlalchemy.orm import with_loader_criteria
+
+from replicas import replica_router
+
+DEFAULT_ORGANIZATION_ID = 1
+DEFAULT_SHARD = 'default'
+ORGANIZATION_HEADER = 'X-Organization-Id'
+ROUTES_TTL = 60  # seconds an organization -> shard mapping is cached
+MISS_TTL = 10  # seconds an unknown organization id is remembered as unknown
+MIN_RELOAD_INTERVAL = 1  # seconds between reloads caused by unknown organization ids
+MAX_CACHED_MISSES = 10000
+
+_organization = ContextVar('organization_id', default=None)
+_shard = ContextVar('shard', default=None)
+
+
+def current_organization_id():
+    organization_id = _organization.get()
+    return DEFAULT_ORGANIZATION_ID if organization_id is None else organization_id
+
+
+class TenantScoped:
+    organization_id = Column(Integer, nullable=False, default=current_organization_id, index=True)
+
+
+class ShardRouter:
+    def __init__(self):
+        self._specs = None
+        self._engines = {}
+        self._routes = {}
+        self._routes_loaded_at = float('-inf')
+        self._misses = {}  # organization id -> when a reload last failed to find it
+        self._lock = threading.Lock()
+
+    def specs(self):
+        if self._specs is None:
+            raw = json.loads(os.getenv('SHARDS') or '{}')
+            self._specs = {name: spec if isinstance(spec, dict) else {'url': spec} for name, spec in raw.items()}
+        return self._specs
+
+    @property
+    def sharded(self):
+        return bool(self.specs())
+
+    def names(self):
+        return [DEFAULT_SHARD] + [name for name in self.specs() if name != DEFAULT_SHARD]
+
+    def engine(self, name):
+        if name == DEFAULT_SHARD and DEFAULT_SHARD not in self.specs():
+            from models import db
+            return db.engine
+        engine = self._engines.get(name)
+        if engine is None:
+            spec = self.specs().get(name)
+            if spec is None:
+                raise KeyError(f"Unknown shard '{name}'")
+            with self._lock:
+                engine = self._engines.get(name)
+                if engine is None:
+                    engine = create_engine(spec['url'], pool_pre_ping=True)
+                    if spec.get('schema'):
+                        engine = engine.execution_options(schema_translate_map={None: spec['schema']})
+                    self._engines[name] = engine
+        return engine
+
+    def _load_routes(self):
+        from models import db
+        with db.engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, shard FROM organizations")).all()
+        self._routes = {row.id: row.shard or DEFAULT_SHARD for row in rows}
+        self._routes_loaded_at = time.monotonic()
+
+    def _stale(self, organization_id, now):
+        if now - self._routes_loaded_at > ROUTES_TTL:
+            return True
+        if organization_id in self._routes:
+            return False
+        # Unknown ids (new organizations, or clients sending garbage) reload the directory
+        # at most once per MIN_RELOAD_INTERVAL overall and once per MISS_TTL per id
+        return (now - self._routes_loaded_at > MIN_RELOAD_INTERVAL
+                and now - self._misses.get(organization_id, float('-inf')) > MISS_TTL)
+
+    def shard_for(self, organization_id):
+        """Shard name for an organization, or None if the organization does not exist."""
+        if self._stale(organization_id, time.monotonic()):
+            with self._lock:
+                now = time.monotonic()
+                if self._stale(organization_id, now):  # unless another thread just reloaded
+                    self._load_routes()
+                    if organization_id not in self._routes:
+                        if len(self._misses) >= MAX_CACHED_MISSES:
+                            self._misses.clear()
+                        self._misses[organization_id] = now
+        return self._routes.get(organization_id)
+
+    def invalidate(self):
+        self._routes_loaded_at = float('-inf')
+        self._misses = {}
+
+    def dispose(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+            self._specs = None
+
+
+router = ShardRouter()
+
+
+def current_shard():
+    shard = _shard.get()
+    if shard is not None:
+        return shard
+    if not router.sharded:
+        return DEFAULT_SHARD
+    return router.shard_for(current_organization_id()) or DEFAULT_SHARD
+
+
+def tenant_engine():
+    shard = current_shard()
+    return replica_router.route(shard, router.engine(shard))
+
+
+def shard_names():
+    return router.names()
+
+
+@contextmanager
+def use_organization(organization_id):
+    token = _organization.set(organization_id)
+    try:
+        yield
+    finally:
+        _organization.reset(token)
+
+
+@contextmanager
+def use_shard(name):
+    """Run against one shard across all of its organizations (batch jobs)."""
+    token = _shard.set(name)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+# ---------------------- SESSION ----------------------
+class TenantSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        # Directory models (organizations) always live on the primary
+        if getattr(getattr(mapper, 'class_', mapper), '__directory__', False):
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        return tenant_engine()
+
+
+@event.listens_for(TenantSession, 'do_orm_execute')
+def _scope_to_organization(state):
+    organization_id = _organization.get()
+    if organization_id is None or state.execution_options.get('all_tenants'):
+        return
+    if state.is_select or state.is_update or state.is_delete:
+        state.statement = state.statement.options(with_loader_criteria(
+            TenantScoped, lambda cls: cls.organization_id == organization_id, include_aliases=True))
+
+
+# ---------------------- FLASK ----------------------
+def init_app(app):
+    @app.before_request
+    def _resolve_organization():
+        raw = request.headers.get(ORGANIZATION_HEADER)
+        if raw is None:
+            organization_id = DEFAULT_ORGANIZATION_ID
+        else:
+            try:
+                organization_id = int(raw)
+            except ValueError:
+                return jsonify({"error": f"Invalid {ORGANIZATION_HEADER}"}), 400
+            if router.shard_for(organization_id) is None:
+                return jsonify({"error": "Organization not found"}), 404
+        g._organization_token = _organization.set(organization_id)
+
+    @app.teardown_request
+    def _reset_organization(exc):
+        token = g.pop('_organization_token', None)
+        if token is not None:
+            _organization.reset(token)
@@ -0,0 +1,363 @@
+# sync.py
+# Offline-first sync for field tablets: one round trip per sync instead of one request
+# per step, photo and finding.
+#
+# Change log: every flush that creates, updates or deletes an audit's steps, findings or
+# media bumps audits.sync_version and writes an AuditChange row per entity at the new
+# version. Bumping the audit row takes its row lock, so versions of one audit commit in
+# order and "everything after version N" is a safe sync token.
+#
+# POST /api/audits/<id>/sync takes
+#
+#   {"sync_token": 41,
+#    "operations": [
+#      {"op_id": "c1f0…", "entity": "step", "ref": "s1", "base_version": 0,
+#       "data": {"step_type": "attic", "label": "Attic", "is_completed": true}},
+#      {"op_id": "9ab2…", "entity": "finding", "data": {"step_ref": "s1", "title": "Thin insulation"}},
+#      {"op_id": "77de…", "entity": "media", "data": {"step_ref": "s1", "content_hash": "<sha256>",
+#                                                     "file_name": "attic.jpg", "media_type": "photo"}},
+#      {"op_id": "04aa…", "entity": "finding", "action": "delete", "id": 812, "base_version": 39}]}
+#
+# applies the operations in one transaction and answers with one result per operation,
+# the new sync_token, and every step, finding and media row changed after the client's
+# token (each with its `version`).
+#
+# Conflicts: an operation on a row changed since its base_version is a conflict. Steps
+# merge. Completion and not-accessible flags stay set once either side sets them. The
+# server's notes win. For findings, the server wins and the operation reports
+# "conflict". Operations are deduplicated by op_id, so a retried sync is harmless.
+#
+# The change log keeps only the latest change of each entity once `flask archive-audits`
+# or `flask compact-sync-changes` has run (archive.compact_changes). Every token stays
+# valid: an entity changed after a token exactly when its latest change is.
+#
+# Media go by content hash. A blob the server has not seen yet comes back in
+# missing_blobs and that operation is not applied. The client uploads the blob with
+# PUT /api/media/<sha256> and sends the operation again on its next sync.
+from itertools import chain
+
+from sqlalchemy import event, insert, select, update
+
+from archive import refresh_completion, restore_audit
+from models import (db, Audit, AuditStep, AuditFinding, AuditMedia, AuditChange, SyncOperation, MediaBlob,
+                    ArchivedAuditStep, ArchivedAuditFinding, ArchivedAuditMedia)
+from sharding import TenantSession
+
+MAX_OPERATIONS = 500
+ENTITIES = {AuditStep: 'step', AuditFinding: 'finding', AuditMedia: 'media'}
+STEP_FIELDS = ('is_completed', 'not_accessible', 'notes')
+FINDING_FIELDS = ('title', 'description', 'recommendation', 'severity', 'source')
+
+
+# ---------------------- CHANGE LOG ----------------------
+def _bump_versions(conn, audit_ids):
+    """Advance sync_version of `audit_ids` (a list or a select). Returns {audit_id: (version, organization_id)}."""
+    audits = Audit.__table__
+    conn.execute(update(audits).where(audits.c.id.in_(audit_ids))
+                 .values(sync_version=audits.c.sync_version + 1))
+    rows = conn.execute(select(audits.c.id, audits.c.sync_version, audits.c.organization_id)
+                        .where(audits.c.id.in_(audit_ids)))
+    return {row.id: (row.sync_version, row.organization_id) for row in rows}
+
+
+def record_collection_change(conn, audit_ids, entity):
+    """Log that every `entity` of `audit_ids` may have changed (bulk writes outside the ORM)."""
+    versions = _bump_versions(conn, audit_ids)
+    if versions:
+        conn.execute(insert(AuditChange.__table__), [
+            {'audit_id': audit_id, 'version': version, 'organization_id': organization_id,
+             'entity': entity, 'entity_id': None}
+            for audit_id, (version, organization_id) in versions.items()
+        ])
+
+
+def _audit_id_of(conn, obj):
+    if not isinstance(obj, AuditFinding):
+        return obj.audit_id
+    step = obj.__dict__.get('step')
+    if step is not None:
+        return step.audit_id
+    return conn.execute(select(AuditStep.audit_id).where(AuditStep.id == obj.step_id)).scalar()
+
+
+@event.listens_for(TenantSession, 'after_flush')
+def _record_changes(session, flush_context):
+    changed = {}
+    conn = None
+    for obj in chain(session.new, session.dirty, session.deleted):
+        entity = ENTITIES.get(type(obj))
+        if entity is None or (obj in session.dirty and not session.is_modified(obj)):
+            continue
+        conn = conn or session.connection()
+        audit_id = _audit_id_of(conn, obj)
+        if audit_id is not None:
+            changed.setdefault(audit_id, set()).add((entity, obj.id))
+    if not changed:
+        return
+
+    versions = _bump_versions(conn, list(changed))
+    conn.execute(insert(AuditChange.__table__), [
+        {'audit_id': audit_id, 'version': versions[audit_id][0], 'organization_id': versions[audit_id][1],
+         'entity': entity, 'entity_id': entity_id}
+        for audit_id, entities in changed.items() if audit_id in versions
+        for entity, entity_id in entities
+    ])
+
+
+def _version(versions, entity, row):
+    current = versions.get((entity, row.id), 0)
+    if entity == 'finding' and row.rule_id is not None:
+        # Rule re-evaluation replaces rule findings as a whole (entity_id NULL)
+        current = max(current, versions.get(('finding', None), 0))
+    return current
+
+
+def _entity_versions(audit_id):
+    rows = db.session.execute(
+        select(AuditChange.entity, AuditChange.entity_id, db.func.max(AuditChange.version))
+        .where(AuditChange.audit_id == audit_id)
+        .group_by(AuditChange.entity, AuditChange.entity_id)
+    )
+    return {(entity, entity_id): version for entity, entity_id, version in rows}
+
+
+# ---------------------- SERIALIZATION ----------------------
+def _models(archived):
+    if archived:
+        return ArchivedAuditStep, ArchivedAuditFinding, ArchivedAuditMedia
+    return AuditStep, AuditFinding, AuditMedia
+
+
+def _step_json(step, version):
+    return {"id": step.id, "step_type": step.step_type, "label": step.label, "is_completed": step.is_completed,
+            "not_accessible": step.not_accessible, "notes": step.notes, "version": version}
+
+
+def _finding_json(finding, version):
+    return {"id": finding.id, "step_id": finding.step_id, "title": finding.title,
+            "description": finding.description, "recommendation": finding.recommendation,
+            "severity": finding.severity, "source": finding.source, "rule_id": finding.rule_id,
+            "version": version}
+
+
+def _media_json(media, version):
+    return {"id": media.id, "step_id": media.step_id, "step_type": media.step_type, "side": media.side,
+            "media_url": media.media_url, "file_name": media.file_name, "media_type": media.media_type,
+            "created_at": media.created_at.isoformat(), "version": version}
+
+
+# ---------------------- OPERATIONS ----------------------
+class _Batch:
+    def __init__(self, audit, versions, public_url):
+        self.audit = audit
+        self.versions = versions
+        self.public_url = public_url
+        self.refs = {}
+        self.missing = set()
+        self.steps_changed = False
+
+    def version(self, entity, row):
+        return _version(self.versions, entity, row)
+
+    def step(self, data):
+        step_id = self.refs.get(data['step_ref']) if data.get('step_ref') else data.get('step_id')
+        step = AuditStep.query.filter_by(id=step_id, audit_id=self.audit.id).first() if step_id else None
+        if step is None:
+            raise ValueError(f"Unknown step {data.get('step_ref') or data.get('step_id')!r}")
+        return step
+
+
+def _apply_step(batch, op, data):
+    if op['action'] != 'upsert':
+        raise ValueError("Steps can only be upserted")
+    if op.get('id'):
+        step = AuditStep.query.filter_by(id=op['id'], audit_id=batch.audit.id).first()
+    else:
+        step = AuditStep.query.filter_by(audit_id=batch.audit.id, step_type=data.get('step_type'),
+                                         label=data.get('label')).first()
+
+    if step is None:
+        if not data.get('step_type') or not data.get('label'):
+            raise ValueError("Missing step_type or label")
+        step = AuditStep(audit_id=batch.audit.id, step_type=data['step_type'], label=data['label'],
+                         is_completed=bool(data.get('is_completed')),
+                         not_accessible=bool(data.get('not_accessible')), notes=data.get('notes'))
+        db.session.add(step)
+        status = 'applied'
+    elif batch.version('step', step) > op.get('base_version', 0):
+        # Done stays done on either side; the server's notes win
+        if data.get('is_completed'):
+            step.is_completed = True
+        if data.get('not_accessible'):
+            step.not_accessible = True
+        status = 'merged'
+    else:
+        for field in STEP_FIELDS:
+            if field in data:
+                setattr(step, field, data[field])
+        status = 'applied'
+    db.session.flush()
+    if op.get('ref'):
+        batch.refs[op['ref']] = step.id
+    batch.steps_changed = True
+    return status, step.id
+
+
+def _apply_finding(batch, op, data):
+    if not op.get('id'):
+        if op['action'] != 'upsert':
+            raise ValueError("Finding delete needs an id")
+        finding = AuditFinding(step_id=batch.step(data).id, **{f: data.get(f) for f in FINDING_FIELDS})
+        db.session.add(finding)
+        db.session.flush()
+        return 'applied', finding.id
+
+    finding = (AuditFinding.query.join(AuditStep)
+               .filter(AuditFinding.id == op['id'], AuditStep.audit_id == batch.audit.id).first())
+    if finding is None:
+        return ('applied' if op['action'] == 'delete' else 'not_found'), op['id']
+    if batch.version('finding', finding) > op.get('base_version', 0):
+        return 'conflict', finding.id
+    if op['action'] == 'delete':
+        db.session.delete(finding)
+    else:
+        for field in FINDING_FIELDS:
+            if field in data:
+                setattr(finding, field, data[field])
+    db.session.flush()
+    return 'applied', finding.id
+
+
+def _apply_media(batch, op, data):
+    if op['action'] == 'delete':
+        media = AuditMedia.query.filter_by(id=op.get('id'), audit_id=batch.audit.id).first()
+        if media is not None:
+            db.session.delete(media)
+            db.session.flush()
+        return 'applied', op.get('id')
+    if op.get('id'):
+        raise ValueError("Media cannot be changed once created")
+
+    blob = MediaBlob.query.filter_by(content_hash=(data.get('content_hash') or '').lower()).first()
+    if blob is None:
+        batch.missing.add(data.get('content_hash'))
+        return 'missing_blob', None
+    step = batch.step(data)
+    media = AuditMedia(audit_id=batch.audit.id, step_id=step.id, step_type=step.step_type,
+                       side=step.label.replace(" Side", ""), media_url=batch.public_url(blob.storage_path),
+                       file_name=data.get('file_name'), media_type=data.get('media_type', 'photo'))
+    db.session.add(media)
+    db.session.flush()
+    return 'applied', media.id
+
+
+APPLY = {'step': _apply_step, 'finding': _apply_finding, 'media': _apply_media}
+
+
+def _validate(operations):
+    if not isinstance(operations, list):
+        raise ValueError("operations must be a list")
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError(f"At most {MAX_OPERATIONS} operations per sync")
+    for op in operations:
+        if not isinstance(op, dict) or not isinstance(op.get('op_id'), str) or not 0 < len(op['op_id']) <= 64:
+            raise ValueError("Every operation needs an op_id of at most 64 characters")
+        if op.get('entity') not in APPLY:
+            raise ValueError(f"Unknown entity {op.get('entity')!r}")
+        op.setdefault('action', 'upsert')
+        if op['action'] not in ('upsert', 'delete'):
+            raise ValueError(f"Unknown action {op['action']!r}")
+        if op.get('data') is not None and not isinstance(op['data'], dict):
+            raise ValueError(f"Operation {op['op_id']}: data must be an object")
+        for field in ('id', 'base_version'):
+            if op.get(field) is not None and (not isinstance(op[field], int) or isinstance(op[field], bool)):
+                raise ValueError(f"Operation {op['op_id']}: {field} must be an integer")
+
+
+# ---------------------- DELTA ----------------------
+def _delta(audit, since):
+    step_model, finding_model, media_model = _models(audit.archived_at is not None)
+    versions = _entity_versions(audit.id)
+    findings = finding_model.query.join(step_model, step_model.id == finding_model.step_id) \
+        .filter(step_model.audit_id == audit.id)
+    steps = step_model.query.filter_by(audit_id=audit.id)
+    media = media_model.query.filter_by(audit_id=audit.id, status='ready')
+
+    reset, deleted = [], []
+    if since:
+        changes = db.session.execute(
+            select(AuditChange.entity, AuditChange.entity_id).distinct()
+            .where(AuditChange.audit_id == audit.id, AuditChange.version > since)
+        ).all()
+        changed = {entity: set() for entity in ENTITIES.values()}
+        for entity, entity_id in changes:
+            changed[entity].add(entity_id)
+        if None in changed['finding']:
+            reset.append('finding')
+        else:
+            findings = findings.filter(finding_model.id.in_(changed['finding']))
+        steps = steps.filter(step_model.id.in_(changed['step']))
+        media = media.filter(media_model.id.in_(changed['media']))
+
+    body = {
+        "steps": [_step_json(s, _version(versions, 'step', s)) for s in steps],
+        "findings": [_finding_json(f, _version(versions, 'finding', f)) for f in findings],
+        "media": [_media_json(m, _version(versions, 'media', m)) for m in media],
+    }
+    if since:
+        for entity, key in (('step', 'steps'), ('finding', 'findings'), ('media', 'media')):
+            present = {row['id'] for row in body[key]}
+            deleted.extend({"entity": entity, "id": entity_id}
+                           for entity_id in sorted(i for i in changed[entity] if i is not None)
+                           if entity_id not in present and not (entity == 'finding' and reset))
+    body["deleted"] = deleted
+    body["reset"] = reset
+    return body
+
+
+def sync_audit(audit, payload, public_url):
+    """Apply a sync request to `audit` (locked by the caller) and build the response. Does not commit.
+
+    `public_url(storage_path)` turns a blob's storage path into the URL stored on AuditMedia.
+    Raises ValueError for a malformed request; nothing should be committed then.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Sync request must be an object")
+    operations = payload.get('operations') or []
+    _validate(operations)
+    try:
+        since = int(payload.get('sync_token') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("sync_token must be an integer")
+
+    results = []
+    if operations:
+        restore_audit(audit)
+        batch = _Batch(audit, _entity_versions(audit.id), public_url)
+        seen = {
+            op.op_id: op for op in
+            SyncOperation.query.filter(SyncOperation.op_id.in_([op['op_id'] for op in operations]))
+        }
+        for op in operations:
+            previous = seen.get(op['op_id'])
+            if previous is not None:
+                if op['entity'] == 'step' and op.get('ref') and previous.entity_id:
+                    batch.refs[op['ref']] = previous.entity_id
+                results.append({"op_id": op['op_id'], "status": "duplicate", "id": previous.entity_id})
+                continue
+            status, entity_id = APPLY[op['entity']](batch, op, op.get('data') or {})
+            results.append({"op_id": op['op_id'], "status": status, "id": entity_id})
+            if status != 'missing_blob':
+                seen[op['op_id']] = SyncOperation(op_id=op['op_id'], audit_id=audit.id,
+                                                  status=status, entity_id=entity_id)
+                db.session.add(seen[op['op_id']])
+        if batch.steps_changed:
+            refresh_completion(audit)
+        db.session.flush()
+        missing = sorted(h for h in batch.missing if h)
+    else:
+        missing = []
+
+    token = db.session.execute(select(Audit.sync_version).where(Audit.id == audit.id)).scalar()
+    return {"audit_id": audit.id, "sync_token": token, "results": results,
+            "missing_blobs": missing, **_delta(audit, since)}
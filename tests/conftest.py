@@ -0,0 +1,38 @@
+# tests/conftest.py
+# app.py reads its configuration at import time, so the environment is pointed at a
+# throwaway SQLite database and local storage directory before anything imports it.
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix='audit-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ['LOCAL_STORAGE_DIR'] = os.path.join(_workdir, 'storage')
+os.environ['SUPABASE_URL'] = 'http://storage.test'
+os.environ['SUPABASE_BUCKET_NAME'] = 'test'
+os.environ.setdefault('RATE_LIMIT_CLIENT', 'off')
+
+
+@pytest.fixture()
+def app():
+    """The Flask app over an empty database with the default organization."""
+    from app import app as flask_app
+    from models import db, Organization
+
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(Organization(id=1, name='Default'))
+        db.session.commit()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from archive import archive_completed_audits, compact_changes, refresh_completion
+from models import db, ArchivedAuditFinding, ArchivedAuditStep, Audit, AuditChange, AuditFinding, AuditStep, Property
+
+
+@pytest.fixture()
+def audit(app):
+    prop = Property(street='1 Main St')
+    audit = Audit(property=prop)
+    db.session.add_all([prop, audit])
+    db.session.commit()
+    return audit
+
+
+def _save_step(client, audit, label, **data):
+    response = client.post(f'/api/audits/{audit.id}/steps', json={'step_type': 'room', 'label': label, **data})
+    assert response.status_code in (200, 201), response.get_json()
+    return response.get_json()['id']
+
+
+def test_completion_is_stamped_and_cleared(client, audit):
+    step_id = _save_step(client, audit, 'Attic')
+    assert db.session.get(Audit, audit.id).completed_at is None
+
+    _save_step(client, audit, 'Attic', is_completed=True)
+    _save_step(client, audit, 'Crawlspace', not_accessible=True)
+    completed_at = db.session.get(Audit, audit.id).completed_at
+    assert completed_at is not None
+
+    _save_step(client, audit, 'Attic', notes='still done')
+    assert db.session.get(Audit, audit.id).completed_at == completed_at  # not re-stamped
+
+    db.session.get(AuditStep, step_id).is_completed = False
+    refresh_completion(audit)
+    assert audit.completed_at is None
+
+
+def test_archived_audits_are_read_from_archive_and_restored_on_write(client, audit):
+    step_id = _save_step(client, audit, 'Attic', is_completed=True)
+    db.session.add(AuditFinding(step_id=step_id, title='Leak'))
+    db.session.get(Audit, audit.id).completed_at = datetime.utcnow() - timedelta(days=400)
+    db.session.commit()
+
+    assert archive_completed_audits() == 1
+    assert AuditStep.query.count() == 0 and AuditFinding.query.count() == 0
+    assert [s.id for s in ArchivedAuditStep.query] == [step_id]
+    assert [f.title for f in ArchivedAuditFinding.query] == ['Leak']
+    assert [s['id'] for s in client.get(f'/api/audits/{audit.id}/steps').get_json()] == [step_id]
+    assert archive_completed_audits() == 0
+
+    _save_step(client, audit, 'Attic', is_completed=False)
+    db.session.expire_all()
+    assert db.session.get(Audit, audit.id).archived_at is None
+    assert db.session.get(Audit, audit.id).completed_at is None
+    assert ArchivedAuditStep.query.count() == 0 and ArchivedAuditFinding.query.count() == 0
+    assert [f.title for f in AuditFinding.query.filter_by(step_id=step_id)] == ['Leak']
+
+
+def test_recently_completed_audits_stay_hot(client, audit):
+    _save_step(client, audit, 'Attic', is_completed=True)
+    assert archive_completed_audits() == 0
+    assert AuditStep.query.count() == 1
+
+
+def test_compaction_keeps_the_latest_change_of_each_entity(client, audit):
+    first = _save_step(client, audit, 'Attic')
+    second = _save_step(client, audit, 'Basement')
+    for notes in ('a', 'b'):
+        _save_step(client, audit, 'Attic', notes=notes)
+    changes = AuditChange.query.filter_by(audit_id=audit.id).order_by(AuditChange.id).all()
+    latest = {(c.entity, c.entity_id): c.version for c in changes}
+
+    assert compact_changes([audit.id]) == len(changes) - len(latest) > 0
+    db.session.commit()
+
+    kept = [(c.entity, c.entity_id, c.version) for c in AuditChange.query.filter_by(audit_id=audit.id)]
+    assert sorted(kept) == sorted((entity, entity_id, version) for (entity, entity_id), version in latest.items())
+    assert {entity_id for _, entity_id, _ in kept} >= {first, second}
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from direct_uploads import expire_pending_uploads
+from models import db, Audit, AuditMedia, Property
+
+
+@pytest.fixture()
+def audit(app):
+    prop = Property(street='1 Main St')
+    audit = Audit(property=prop)
+    db.session.add_all([prop, audit])
+    db.session.commit()
+    return audit
+
+
+@pytest.fixture()
+def bucket(app):
+    from app import SUPABASE_BUCKET_NAME, supabase
+
+    return supabase.storage.from_(SUPABASE_BUCKET_NAME)
+
+
+def _slot(client, audit, file_name='roof.jpg'):
+    response = client.post(f'/api/audits/{audit.id}/steps/Roof/upload-url', json={'file_name': file_name})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+
+def _listed_media(client, audit):
+    return [m['id'] for step in client.get(f'/api/audits/{audit.id}/steps').get_json() for m in step['media']]
+
+
+def test_media_is_listed_once_its_upload_completes(client, audit):
+    slot = _slot(client, audit)
+    assert _listed_media(client, audit) == []
+    assert client.post(f"/api/media/{slot['media_id']}/complete").status_code == 409  # nothing uploaded yet
+
+    assert client.put(slot['upload_url'], data=b'jpeg bytes').status_code == 200
+    assert _listed_media(client, audit) == []  # uploaded but not completed
+
+    completed = client.post(f"/api/media/{slot['media_id']}/complete")
+    assert completed.status_code == 200 and completed.get_json()['status'] == 'ready'
+    assert _listed_media(client, audit) == [slot['media_id']]
+
+
+def test_signed_upload_urls_are_checked(client, audit):
+    slot = _slot(client, audit)
+    assert client.put(slot['upload_url'] + 'x', data=b'forged').status_code == 403
+    assert client.put(slot['upload_url'].replace('roof', 'other'), data=b'forged').status_code == 403
+    assert client.put(slot['upload_url'], data=b'jpeg bytes').status_code == 200
+    assert client.put(slot['upload_url'], data=b'again').status_code == 409  # no overwriting
+
+
+def test_storage_webhook_completes_uploads(client, audit, monkeypatch):
+    monkeypatch.setenv('STORAGE_WEBHOOK_SECRET', 'hook-secret')
+    slot = _slot(client, audit)
+    client.put(slot['upload_url'], data=b'jpeg bytes')
+    record = {'record': {'bucket_id': 'test', 'name': slot['storage_path']}}
+
+    assert client.post('/api/storage/webhook', json=record, headers={'X-Webhook-Secret': 'wrong'}).status_code == 403
+    other = {'record': {'bucket_id': 'test', 'name': 'media/1/photo.jpg'}}
+    assert client.post('/api/storage/webhook', json=other,
+                       headers={'X-Webhook-Secret': 'hook-secret'}).get_json() == {'completed': False}
+
+    hook = client.post('/api/storage/webhook', json=record, headers={'X-Webhook-Secret': 'hook-secret'})
+    assert hook.get_json() == {'completed': True}
+    assert _listed_media(client, audit) == [slot['media_id']]
+
+
+def test_abandoned_uploads_expire(client, audit, bucket):
+    abandoned, fresh = _slot(client, audit), _slot(client, audit, 'fresh.jpg')
+    client.put(abandoned['upload_url'], data=b'jpeg bytes')
+    db.session.get(AuditMedia, abandoned['media_id']).created_at = datetime.utcnow() - timedelta(days=2)
+    db.session.commit()
+
+    assert expire_pending_uploads(bucket) == 1
+    assert db.session.get(AuditMedia, abandoned['media_id']) is None
+    assert db.session.get(AuditMedia, fresh['media_id']).status == 'pending'
+    folder, _, name = abandoned['storage_path'].rpartition('/')
+    assert name not in [entry['name'] for entry in bucket.list(folder)]
@@ -0,0 +1,71 @@
+import datetime
+import gzip
+import json
+
+import brotli
+import msgpack
+import pytest
+import zstandard
+
+import encoding
+from encoding import MIN_COMPRESS_BYTES
+from models import db, Property
+
+
+@pytest.fixture()
+def properties(app):
+    db.session.add_all([Property(street=f'{i} Main St', city='Portland', state='OR') for i in range(30)])
+    db.session.commit()
+
+
+def test_json_is_the_default_and_msgpack_is_negotiated(client, properties):
+    default = client.get('/api/properties')
+    assert default.mimetype == 'application/json'
+    assert 'Accept' in default.vary
+    assert client.get('/api/properties', headers={'Accept': '*/*'}).mimetype == 'application/json'
+
+    for accept in ('application/msgpack', 'application/x-msgpack', 'application/msgpack, application/json;q=0.5'):
+        packed = client.get('/api/properties', headers={'Accept': accept})
+        assert packed.mimetype == 'application/msgpack'
+        assert msgpack.unpackb(packed.data) == default.get_json()
+
+
+@pytest.mark.parametrize('accept_encoding, coding, decompress', [
+    ('gzip, br, zstd', 'zstd', zstandard.ZstdDecompressor().decompress),
+    ('gzip, br', 'br', brotli.decompress),
+    ('gzip', 'gzip', gzip.decompress),
+])
+def test_compression_follows_server_preference(client, properties, accept_encoding, coding, decompress):
+    plain = client.get('/api/properties')
+    assert len(plain.data) >= MIN_COMPRESS_BYTES and 'Content-Encoding' not in plain.headers
+
+    compressed = client.get('/api/properties', headers={'Accept-Encoding': accept_encoding})
+    assert compressed.headers['Content-Encoding'] == coding
+    assert {'Accept', 'Accept-Encoding'} <= set(compressed.vary)
+    assert json.loads(decompress(compressed.data)) == plain.get_json()
+
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get('/api/properties', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) < MIN_COMPRESS_BYTES
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.vary  # a larger body would be compressed
+
+
+@pytest.mark.parametrize('orjson', [encoding.orjson, None], ids=['orjson', 'fallback'])
+def test_dates_are_iso_8601(app, monkeypatch, orjson):
+    monkeypatch.setattr(encoding, 'orjson', orjson)
+    value = {
+        'date': datetime.date(2024, 5, 6),
+        'naive': datetime.datetime(2024, 5, 6, 7, 8, 9),
+        'precise': datetime.datetime(2024, 5, 6, 7, 8, 9, 123456),
+        'aware': datetime.datetime(2024, 5, 6, 7, 8, 9, tzinfo=datetime.timezone.utc),
+    }
+    assert json.loads(app.json.dumps(value)) == {
+        'date': '2024-05-06',
+        'naive': '2024-05-06T07:08:09',
+        'precise': '2024-05-06T07:08:09.123456',
+        'aware': '2024-05-06T07:08:09+00:00',
+    }
+    with app.test_request_context(headers={'Accept': 'application/msgpack'}):
+        assert msgpack.unpackb(app.json.response(value).data)['naive'] == '2024-05-06T07:08:09'
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import findings_engine
+from findings_engine import compile_rule, evaluate_audit, run_rules
+from models import db, Audit, AuditFinding, AuditStep, Property
+
+
+def _matches(when, **values):
+    """Whether a step with `values` satisfies a rule's `when`, evaluated by the database."""
+    prop = Property(street='1 Main St', year_built=values.pop('year_built', None), sqft=values.pop('sqft', None))
+    audit = Audit(property=prop)
+    step = AuditStep(audit=audit, step_type=values.pop('step_type', 'attic'), **values)
+    db.session.add_all([prop, audit, step])
+    db.session.flush()
+    query = (db.session.query(AuditStep.id).join(Audit).join(Property)
+             .filter(AuditStep.id == step.id, *compile_rule({'id': 'r', 'when': when})))
+    matched = query.first() is not None
+    db.session.rollback()
+    return matched
+
+
+@pytest.mark.parametrize('when, values, expected', [
+    ({'step_type': 'attic'}, {}, True),
+    ({'step_type__ne': 'attic'}, {}, False),
+    ({'year_built__lt': 1980}, {'year_built': 1979}, True),
+    ({'year_built__lt': 1980}, {'year_built': 1980}, False),
+    ({'year_built__lte': 1980, 'year_built__gte': 1980}, {'year_built': 1980}, True),
+    ({'sqft__gt': 1000}, {'sqft': 1000}, False),
+    ({'step_type__in': ['attic', 'crawlspace']}, {'step_type': 'crawlspace'}, True),
+    ({'year_built__is_null': True}, {}, True),
+    ({'year_built__is_null': False}, {}, False),
+    ({'not_accessible': True, 'year_built__lt': 1980}, {'not_accessible': True, 'year_built': 2000}, False),
+])
+def test_compile_rule_operators(app, when, values, expected):
+    assert _matches(when, **values) is expected
+
+
+@pytest.mark.parametrize('when, message', [({'color': 'red'}, "unknown field 'color'"),
+                                           ({'sqft__between': 1}, "unknown operator 'between'")])
+def test_compile_rule_rejects_unknown_keys(when, message):
+    with pytest.raises(ValueError, match=message):
+        compile_rule({'id': 'r', 'when': when})
+
+
+def _audit(year_built=1970, not_accessible=True):
+    prop = Property(street='1 Main St', year_built=year_built)
+    audit = Audit(property=prop)
+    step = AuditStep(audit=audit, step_type='attic', label='Attic', not_accessible=not_accessible)
+    db.session.add_all([prop, audit, step])
+    db.session.commit()
+    return audit, step
+
+
+def _rule_ids(step):
+    return sorted(f.rule_id for f in AuditFinding.query.filter_by(step_id=step.id, source='rules'))
+
+
+def test_unchanged_audit_is_not_rewritten(app):
+    audit, step = _audit()
+    assert evaluate_audit(audit.id) == 1
+    assert _rule_ids(step) == ['attic_inaccessible_pre_1980']
+    db.session.expire_all()
+    version = db.session.get(Audit, audit.id).sync_version
+
+    assert evaluate_audit(audit.id) == 0
+    db.session.expire_all()
+    assert db.session.get(Audit, audit.id).sync_version == version
+    assert _rule_ids(step) == ['attic_inaccessible_pre_1980']  # not duplicated
+
+    db.session.get(Property, audit.property_id).year_built = 1990
+    db.session.commit()
+    assert evaluate_audit(audit.id) == 1
+    assert _rule_ids(step) == ['attic_inaccessible']
+    db.session.expire_all()
+    assert db.session.get(Audit, audit.id).sync_version > version
+
+
+def test_findings_are_removed_when_no_rule_matches(app):
+    audit, step = _audit()
+    evaluate_audit(audit.id)
+    step.not_accessible = False
+    db.session.commit()
+    evaluate_audit(audit.id)
+    assert _rule_ids(step) == []
+
+
+def test_incremental_run_only_evaluates_touched_audits(app, monkeypatch):
+    old, old_step = _audit()
+    run_rules(full=True)
+    touched, _ = _audit(year_built=1990)
+
+    evaluated = []
+    original = findings_engine.evaluate_batch
+    monkeypatch.setattr(findings_engine, 'evaluate_batch',
+                        lambda conn, audit_filter, rules=None: evaluated.append(audit_filter) or
+                        original(conn, audit_filter, rules))
+    run = run_rules()
+    assert run.audits_evaluated == 1 and run.findings_written == 1
+    assert findings_engine._touched_audit_ids(datetime.utcnow() - timedelta(hours=1)) == [old.id, touched.id]
+    assert len(evaluated) == 1
+    assert _rule_ids(old_step) == ['attic_inaccessible_pre_1980']
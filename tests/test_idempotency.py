@@ -0,0 +1,48 @@
+import msgpack
+
+from idempotency import ENTRY_OVERHEAD_BYTES, IdempotencyStore, store
+
+
+def _completed(store, key, body):
+    entry, owner = store.begin(key, 'fp')
+    assert owner
+    store.complete(key, entry, 200, {}, body)
+    return entry
+
+
+def test_store_is_capped_by_body_bytes():
+    capped = IdempotencyStore(ttl=60, max_bytes=3 * (100 + ENTRY_OVERHEAD_BYTES))
+    for key in 'abcd':
+        _completed(capped, key, b'x' * 100)
+    assert capped.size == 3 * (100 + ENTRY_OVERHEAD_BYTES)
+    assert capped.begin('a', 'fp')[1] is True  # oldest evicted
+    assert capped.begin('d', 'fp')[1] is False
+
+
+def test_in_flight_entries_are_never_evicted():
+    capped = IdempotencyStore(ttl=-1, max_bytes=0)  # everything expired and over budget
+    running, owner = capped.begin('running', 'fp')
+    assert owner
+    _completed(capped, 'done', b'body')
+    again, owner = capped.begin('running', 'fp')
+    assert again is running and not owner
+    assert capped.begin('done', 'fp')[1] is True
+
+
+def test_replay_is_encoded_for_each_request(client):
+    store.clear()
+    headers = {'Idempotency-Key': 'k1'}
+    first = client.post('/api/properties', json={'street': '1 Main St'}, headers=headers)
+    assert first.status_code == 201 and first.mimetype == 'application/json'
+
+    replay = client.post('/api/properties', json={'street': '1 Main St'},
+                         headers={**headers, 'Accept': 'application/msgpack'})
+    assert replay.status_code == 201
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(replay.data) == first.get_json()
+
+    gzipped = client.post('/api/properties', json={'street': '1 Main St'},
+                          headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert gzipped.get_json() == first.get_json()
+    assert len(client.get('/api/properties').get_json()) == 1
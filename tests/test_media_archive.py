@@ -0,0 +1,167 @@
+import io
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import media_archive
+from media_archive import MISSING_NAME, _Sink, archive_entries, stream_archive
+
+
+class _Object(io.BytesIO):
+    """Stands in for a urlopen() response."""
+
+    def __init__(self, data, length=True, fail_after=None):
+        super().__init__(data)
+        self.headers = {'Content-Length': str(len(data))} if length else {}
+        self.fail_after = fail_after
+
+    def read(self, size=-1):
+        if self.fail_after is not None and self.tell() >= self.fail_after:
+            raise ConnectionResetError('connection reset')
+        return super().read(size)
+
+
+def _media(id, step_type='attic', side='North', file_name='a.jpg'):
+    return SimpleNamespace(id=id, step_type=step_type, side=side, file_name=file_name,
+                           created_at=datetime(2024, 5, 6, 7, 8, 10))
+
+
+def _unzip(chunks):
+    return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+
+def test_sink_buffers_until_drained():
+    sink = _Sink()
+    sink.write(b'ab')
+    sink.write(memoryview(b'cd'))
+    assert sink.size == 4
+    assert sink.drain() == b'abcd'
+    assert sink.size == 0 and sink.drain() == b''
+
+
+def test_entry_names_are_unique_and_safe():
+    entries = archive_entries([_media(1), _media(2), _media(3, side=None, file_name='../x')], lambda m: f'p/{m.id}')
+    assert [name for name, _, _ in entries] == ['attic/North/a.jpg', 'attic/North/a_2.jpg', 'attic/general/.._x']
+
+
+def test_objects_are_copied_in_chunks(monkeypatch):
+    monkeypatch.setattr(media_archive, 'CHUNK_SIZE', 1024)
+    objects = {'p/1': b'x' * 5000, 'p/2': b'y' * 10}
+    reads = []
+
+    def open_object(path):
+        source = _Object(objects[path], length=path == 'p/1')
+        original = source.read
+        source.read = lambda size=-1: reads.append(size) or original(size)
+        return source
+
+    entries = archive_entries([_media(1), _media(2, file_name='b.jpg')], lambda m: f'p/{m.id}')
+    chunks = list(stream_archive(entries, open_object))
+    assert max(len(c) for c in chunks) < 2 * 1024 + 200
+    assert set(reads) == {1024}
+
+    archive = _unzip(chunks)
+    assert archive.read('attic/North/a.jpg') == objects['p/1']
+    assert archive.read('attic/North/b.jpg') == objects['p/2']
+    assert archive.getinfo('attic/North/a.jpg').date_time == (2024, 5, 6, 7, 8, 10)
+
+
+def test_objects_are_prefetched_within_the_window(monkeypatch):
+    monkeypatch.setattr(media_archive, 'CHUNK_SIZE', 100)
+    monkeypatch.setattr(media_archive, 'PREFETCH_WINDOW', 2)
+    lock = threading.Lock()
+    opened, closed, most_open, reads, observed = [], [], [0], [], [0]
+    window_opened = threading.Event()
+
+    def open_object(path):
+        source = _Object(b'x' * 1000)
+        original_read, original_close = source.read, source.close
+
+        def read(size=-1):
+            if path == 'p/0' and source.tell():
+                assert window_opened.wait(5)  # the next two opened while this one streams
+            reads.append(path)
+            return original_read(size)
+
+        source.read = read
+        source.close = lambda: closed.append(path) or original_close()
+        with lock:
+            opened.append(path)
+            most_open[0] = max(most_open[0], len(opened) - len(closed))
+            if len(opened) == 3:
+                window_opened.set()
+        return source
+
+    @contextmanager
+    def observe_read():
+        observed[0] += 1
+        yield
+
+    entries = archive_entries([_media(i, file_name=f'{i}.jpg') for i in range(8)], lambda m: f'p/{m.id}')
+    archive = _unzip(stream_archive(entries, open_object, observe_read))
+    assert len(archive.namelist()) == 8
+    assert most_open[0] == 3  # the entry being written and the two after it
+    assert sorted(closed) == sorted(opened) and len(opened) == 8
+    assert observed[0] == len(reads)
+
+
+def test_prefetched_objects_are_closed_when_the_client_leaves(monkeypatch):
+    monkeypatch.setattr(media_archive, 'CHUNK_SIZE', 100)
+    opened, closed = [], []
+
+    def open_object(path):
+        source = _Object(b'x' * 1000)
+        original_close = source.close
+        source.close = lambda: closed.append(path) or original_close()
+        opened.append(path)
+        return source
+
+    entries = archive_entries([_media(i, file_name=f'{i}.jpg') for i in range(20)], lambda m: f'p/{m.id}')
+    chunks = stream_archive(entries, open_object)
+    next(chunks)
+    chunks.close()
+    deadline = time.monotonic() + 5
+    while len(closed) < len(opened) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(closed) == sorted(opened) and len(opened) <= 1 + media_archive.PREFETCH_WINDOW
+
+
+def test_failed_objects_are_listed_as_missing():
+    def open_object(path):
+        if path == 'p/1':
+            raise OSError('404')
+        return _Object(b'z' * 100, fail_after=50 if path == 'p/2' else None)
+
+    entries = archive_entries([_media(1), _media(2, file_name='b.jpg'), _media(3, file_name='c.jpg')],
+                              lambda m: f'p/{m.id}')
+    archive = _unzip(stream_archive(entries, open_object))
+    assert archive.read('attic/North/c.jpg') == b'z' * 100
+    assert 'attic/North/a.jpg' not in archive.namelist()
+    missing = archive.read(MISSING_NAME).decode()
+    assert 'attic/North/a.jpg\tp/1' in missing
+    assert 'attic/North/b.jpg\tp/2\t(incomplete)' in missing
+
+
+def test_archive_route_streams_from_signed_urls(client):
+    from app import SUPABASE_BUCKET_NAME, supabase
+    from models import db, Audit, AuditMedia, Property
+
+    prop = Property(street='1 Main St')
+    audit = Audit(property=prop)
+    db.session.add_all([prop, audit])
+    db.session.flush()
+    db.session.add_all([
+        AuditMedia(audit_id=audit.id, step_type='attic', side='North', file_name='a.jpg', storage_path='t/a.jpg'),
+        AuditMedia(audit_id=audit.id, step_type='attic', side='North', file_name='gone.jpg', storage_path='t/gone'),
+    ])
+    db.session.commit()
+    supabase.storage.from_(SUPABASE_BUCKET_NAME).update('t/a.jpg', b'photo bytes')
+
+    response = client.get(f'/api/audits/{audit.id}/media/archive')
+    assert response.status_code == 200 and response.mimetype == 'application/zip'
+    archive = _unzip([response.data])
+    assert archive.read('attic/North/a.jpg') == b'photo bytes'
+    assert 'attic/North/gone.jpg\tt/gone' in archive.read(MISSING_NAME).decode()
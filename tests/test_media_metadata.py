@@ -0,0 +1,192 @@
+import io
+import struct
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import media_metadata
+from media_metadata import (CLAIM_TIMEOUT_MINUTES, HEADER_BYTES, MAX_QUEUED_EXTRACTS, _claim_pending,
+                            enqueue_extract, extract_metadata, media_headers, read_media_headers, search_media)
+from models import db, Audit, AuditMedia, Property
+
+ASCII, SHORT, LONG, RATIONAL = 2, 3, 4, 5
+
+
+def _ifd(entries, start):
+    """Little-endian IFD at offset `start`; values over 4 bytes follow the IFD."""
+    data_at = start + 2 + 12 * len(entries) + 4
+    table, extra = b'', b''
+    for tag, kind, count, payload in entries:
+        if len(payload) <= 4:
+            value = payload.ljust(4, b'\0')
+        else:
+            value = struct.pack('<I', data_at + len(extra))
+            extra += payload
+        table += struct.pack('<HHI', tag, kind, count) + value
+    return struct.pack('<H', len(entries)) + table + b'\0\0\0\0' + extra
+
+
+def _rationals(*values):
+    return b''.join(struct.pack('<II', int(v * 1000), 1000) for v in values)
+
+
+def _tiff(exif_width=4000):
+    exif = [(0x9003, ASCII, 20, b'2024:05:06 07:08:09\0'),
+            (0xA002, LONG, 1, struct.pack('<I', exif_width)), (0xA003, LONG, 1, struct.pack('<I', 3000))]
+    gps = [(1, ASCII, 2, b'N\0'), (2, RATIONAL, 3, _rationals(45, 30, 36)),
+           (3, ASCII, 2, b'W\0'), (4, RATIONAL, 3, _rationals(122, 40, 48))]
+
+    def ifd0(exif_at, gps_at):
+        return _ifd([(0x0112, SHORT, 1, struct.pack('<H', 6)), (0x8769, LONG, 1, struct.pack('<I', exif_at)),
+                     (0x8825, LONG, 1, struct.pack('<I', gps_at))], 8)
+
+    exif_at = 8 + len(ifd0(0, 0))
+    exif_ifd = _ifd(exif, exif_at)
+    gps_at = exif_at + len(exif_ifd)
+    return b'II*\0' + struct.pack('<I', 8) + ifd0(exif_at, gps_at) + exif_ifd + _ifd(gps, gps_at)
+
+
+def _box(kind, body):
+    return struct.pack('>I', 8 + len(body)) + kind + body
+
+
+def test_jpeg_exif_and_frame_size():
+    tiff = _tiff()
+    app1 = b'\xff\xe1' + struct.pack('>H', 2 + 6 + len(tiff)) + b'Exif\0\0' + tiff
+    sof = b'\x08' + struct.pack('>HH', 1536, 2048) + b'\x03' + bytes(9)
+    jpeg = b'\xff\xd8' + app1 + b'\xff\xc0' + struct.pack('>H', 2 + len(sof)) + sof + b'\xff\xda'
+
+    fields, error = extract_metadata('photo.jpg', jpeg)
+    assert error is None
+    assert fields['captured_at'] == datetime(2024, 5, 6, 7, 8, 9)
+    assert fields['orientation'] == 6
+    assert (fields['width'], fields['height']) == (2048, 1536)  # the frame wins over EXIF
+    assert fields['latitude'] == pytest.approx(45.51)
+    assert fields['longitude'] == pytest.approx(-122.68)
+
+
+def test_png_dimensions():
+    png = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 640, 480) + bytes(5)
+    assert extract_metadata('plan.png', png) == ({'width': 640, 'height': 480}, None)
+
+
+def test_mp4_duration_and_size():
+    mvhd = _box(b'mvhd', bytes(4) + struct.pack('>IIII', 3_800_000_000, 0, 600, 9000) + bytes(80))
+    tkhd = _box(b'tkhd', bytes(76) + struct.pack('>II', 1920 << 16, 1080 << 16))
+    mp4 = _box(b'ftyp', b'isom' + bytes(4)) + _box(b'moov', mvhd + _box(b'trak', tkhd))
+
+    fields, error = extract_metadata('walkthrough.mp4', mp4)
+    assert error is None
+    assert fields['duration_seconds'] == 15.0
+    assert fields['captured_at'] == datetime(1904, 1, 1) + timedelta(seconds=3_800_000_000)
+    assert (fields['width'], fields['height']) == (1920, 1080)
+
+
+class _Partial(io.BytesIO):
+    status = 206
+
+
+def _mp4_with_trailing_moov():
+    mvhd = _box(b'mvhd', bytes(4) + struct.pack('>IIII', 0, 0, 600, 9000) + bytes(80))
+    return _box(b'ftyp', b'isom' + bytes(4)) + _box(b'mdat', bytes(2 * HEADER_BYTES)) + _box(b'moov', mvhd)
+
+
+def test_only_headers_are_read_from_storage():
+    mp4 = _mp4_with_trailing_moov()
+    requested = []
+
+    def open_range(byte_range):
+        requested.append(byte_range)
+        start, end = byte_range.removeprefix('bytes=').split('-')
+        return _Partial(mp4[-int(end):] if not start else mp4[int(start):int(end) + 1])
+
+    headers = read_media_headers(open_range)
+    assert len(headers) < 1024
+    assert requested == [f'bytes=0-{HEADER_BYTES - 1}', 'bytes=-1048576']
+    assert extract_metadata('walkthrough.mp4', headers)[0]['duration_seconds'] == 15.0
+    # A source that ignores Range yields the same bytes; in-memory uploads are trimmed alike
+    assert read_media_headers(lambda byte_range: io.BytesIO(mp4)) == headers == media_headers(mp4)
+
+    jpeg = b'\xff\xd8\xff\xe0' + bytes(2 * HEADER_BYTES)
+    assert read_media_headers(lambda byte_range: io.BytesIO(jpeg)) == jpeg[:HEADER_BYTES]
+
+
+def test_background_extraction_queue_is_bounded(app, monkeypatch):
+    # Hold submitted work instead of running it
+    monkeypatch.setattr(media_metadata, '_executor', type('Held', (), {'submit': lambda self, work: work})())
+    held = [enqueue_extract(app, i, 'photo.jpg', b'') for i in range(MAX_QUEUED_EXTRACTS)]
+    assert enqueue_extract(app, 0, 'photo.jpg', b'') is None  # left 'pending' for `flask extract-media`
+
+    held.pop()()
+    held.append(enqueue_extract(app, 0, 'photo.jpg', b''))
+    assert held[-1] is not None
+    for work in held:
+        work()
+
+
+def test_truncated_and_unknown_files_fail_cleanly():
+    assert extract_metadata('photo.jpg', b'\xff\xd8\xff\xe1\x00')[0] == {}
+    fields, error = extract_metadata('notes.txt', b'hello')
+    assert fields == {} and error.startswith('Unsupported')
+
+
+@pytest.fixture()
+def audit(app):
+    prop = Property(street='1 Main St', latitude=0.0, longitude=179.999)
+    audit = Audit(property=prop)
+    db.session.add_all([prop, audit])
+    db.session.commit()
+    return audit
+
+
+def _media(audit, **fields):
+    fields.setdefault('metadata_status', 'extracted')
+    media = AuditMedia(audit_id=audit.id, step_type='exterior', **fields)
+    db.session.add(media)
+    return media
+
+
+def test_stale_claims_are_retaken(audit):
+    stale = _media(audit, metadata_status='processing',
+                   metadata_claimed_at=datetime.utcnow() - timedelta(minutes=CLAIM_TIMEOUT_MINUTES + 1))
+    _media(audit, metadata_status='processing', metadata_claimed_at=datetime.utcnow())
+    pending = _media(audit, metadata_status='pending')
+    db.session.commit()
+
+    assert [m.id for m in _claim_pending(10)] == [stale.id, pending.id]
+    assert _claim_pending(10) == []
+
+
+def test_distance_search_crosses_the_antimeridian(audit):
+    near = _media(audit, latitude=0.0, longitude=-179.999)  # ~220 m east, across the date line
+    _media(audit, latitude=0.0, longitude=-179.9)  # ~11 km
+    db.session.commit()
+    result = search_media({'max_distance_m': '500'}, audit_id=audit.id)
+    assert [m['id'] for m in result['media']] == [near.id]
+
+
+def test_distance_search_scans_each_row_once(audit):
+    db.session.bulk_save_objects([AuditMedia(audit_id=audit.id, step_type='exterior', metadata_status='extracted',
+                                             latitude=0.0, longitude=170.0 if i % 700 == 0 else 179.999)
+                                  for i in range(2100)])
+    db.session.commit()
+    queries = []
+    listener = lambda conn, cursor, statement, parameters, *args: queries.append((statement, parameters))
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = search_media({'min_distance_m': '1000', 'limit': '3'}, audit_id=audit.id)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    # Every 700th row is far enough. The second chunk resumes after the last row of the
+    # first one, not after the last row kept.
+    first = AuditMedia.query.order_by(AuditMedia.id).first().id
+    assert [m['id'] for m in result['media']] == [first, first + 700, first + 1400]
+    chunks = [parameters for statement, parameters in queries if 'FROM audit_media' in statement]
+    assert len(chunks) == 2
+    assert first + 999 in chunks[1] and first + 700 not in chunks[1]
+    assert result['next_after_id'] == first + 1400
+
+    rest = search_media({'min_distance_m': '1000', 'after_id': str(first + 1400)}, audit_id=audit.id)
+    assert rest == {'media': [], 'next_after_id': None}
@@ -0,0 +1,52 @@
+import pytest
+
+import ratelimit
+from ratelimit import MemoryStore, parse_limit
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_bucket_refills_at_its_rate(clock):
+    store = MemoryStore()
+    bucket = [('tablet', 2.0, 3.0)]
+    assert [store.take(bucket) for _ in range(3)] == [0, 0, 0]
+    assert store.take(bucket) == pytest.approx(0.5)
+
+    clock[0] += 0.5
+    assert store.take(bucket) == 0
+    assert store.take(bucket) > 0
+
+    clock[0] += 60  # refills up to the burst, no further
+    assert [store.take(bucket) for _ in range(4)][-1] > 0
+
+
+def test_rejected_request_spends_no_token(clock):
+    store = MemoryStore()
+    client, route = ('tablet', 10.0, 5.0), ('tablet:upload', 1.0, 1.0)
+    assert store.take([client, route]) == 0
+    for _ in range(3):
+        assert store.take([client, route]) == pytest.approx(1.0)
+    # The client bucket kept the tokens the route rejections did not spend
+    assert [store.take([client]) for _ in range(4)] == [0, 0, 0, 0]
+
+
+def test_upload_slots_are_released():
+    store = MemoryStore()
+    assert store.acquire('tablet:uploads', 1)
+    assert not store.acquire('tablet:uploads', 1)
+    store.release('tablet:uploads')
+    store.release('tablet:uploads')  # never below zero
+    assert store.acquire('tablet:uploads', 1)
+    assert not store.acquire('tablet:uploads', 1)
+
+
+def test_parse_limit():
+    assert parse_limit('0.2/5') == (0.2, 5.0)
+    assert parse_limit('off') is None
+    with pytest.raises(ValueError):
+        parse_limit('-1/5')
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+
+import pytest
+
+from models import db
+from replicas import LAST_WRITE_HEADER, Replica, parse_position, replica_router
+
+
+@pytest.fixture()
+def replica(app, monkeypatch, tmp_path):
+    """One replica of the primary: a SQLite file with the schema but none of the primary's rows."""
+    url = f"sqlite:///{os.path.join(tmp_path, 'replica')}.db"
+    monkeypatch.setenv('READ_REPLICAS', json.dumps([url]))
+    monkeypatch.setattr(replica_router, 'check_interval', 3600)  # the tests set health and lag
+    replica_router.dispose()
+    replica, = replica_router.replicas('default')
+    db.metadata.create_all(replica.engine)
+    replica.checked_at = time.time()
+    yield replica
+    replica_router.dispose()
+
+
+def _streets(client, **headers):
+    return [p['street'] for p in client.get('/api/properties', headers=headers).get_json()]
+
+
+def test_lagging_replicas_are_skipped(replica, client):
+    client.post('/api/properties', json={'street': '1 Main St'})
+    client.delete_cookie('last_write')  # a client that has not written
+
+    replica.lag = replica_router.max_lag + 1
+    assert _streets(client) == ['1 Main St']  # primary
+
+    replica.lag = 0.0
+    assert _streets(client) == []  # replica, which has not seen the write
+
+
+def test_clients_read_their_own_writes(replica, client):
+    written = client.post('/api/properties', json={'street': '1 Main St'}).headers[LAST_WRITE_HEADER]
+    client.delete_cookie('last_write')
+
+    replica.checked_at = time.time()  # replayed up to now: too close to the write to trust clocks
+    assert _streets(client, **{LAST_WRITE_HEADER: written}) == ['1 Main St']
+
+    replica.checked_at = time.time() + replica_router.clock_skew + 1
+    assert _streets(client, **{LAST_WRITE_HEADER: written}) == []
+
+
+def test_write_positions_compare_wal_positions_on_the_same_shard():
+    replica = Replica({'url': 'sqlite://'})
+    replica.replayed_lsn = parse_position('default@16/B374D848')[1]
+
+    assert parse_position('default@16/B374D848') == ('default', 0x16B374D848)
+    assert replica.caught_up('default', (parse_position('default@16/B374D848'),), 0)
+    assert not replica.caught_up('default', (parse_position('default@16/B374D849'),), 0)
+    assert replica.caught_up('default', (parse_position('east@FF/0'),), 0)  # another shard's WAL
+    assert parse_position('not a position') is None
+
+
+def test_failing_replica_falls_back_to_primary(replica, client):
+    client.post('/api/properties', json={'street': '1 Main St'})
+    client.delete_cookie('last_write')
+    db.metadata.drop_all(replica.engine)
+
+    assert _streets(client) == ['1 Main St']
+    assert not replica.healthy
+    assert _streets(client) == ['1 Main St']  # skipped until the next health check
@@ -0,0 +1,56 @@
+from collections import namedtuple
+from datetime import date
+
+import pytest
+
+import savings
+from models import db, Audit, AuditFinding, AuditStep, Property
+from savings import ELECTRIC_FRACTION, KWH_PER_SQFT, MEASURE_NAMES, NO_MEASURE, THERMS_PER_SQFT, estimate
+
+Usage = namedtuple('Usage', 'property_id fuel usage cost first_day last_day')
+
+
+def _finding(finding_id, audit_id=1, property_id=1, sqft=1000, year_built=1980, title='Attic insulation thin'):
+    return (finding_id, audit_id, property_id, sqft, year_built, None, title, None)
+
+
+def test_estimate_falls_back_to_square_footage():
+    result = estimate([_finding(1)], [])
+    attic = MEASURE_NAMES.index('attic_insulation')
+    assert result['measure'].tolist() == [attic]
+    assert result['kwh'][0] == pytest.approx(1000 * KWH_PER_SQFT * 0.03)
+    assert result['therms'][0] == pytest.approx(1000 * THERMS_PER_SQFT * 0.12)
+
+
+def test_estimate_counts_a_measure_once_per_audit():
+    result = estimate([_finding(1), _finding(2), _finding(3, audit_id=2), _finding(4, title='Cracked tile')], [])
+    assert (result['kwh'] > 0).tolist() == [True, False, True, False]
+    assert result['measure'][3] == NO_MEASURE
+
+
+def test_estimate_uses_annualized_usage_and_price():
+    usage = [Usage(1, 'electric', 1000.0, 200.0, date(2024, 1, 1), date(2024, 3, 31))]
+    result = estimate([_finding(1, title='Replace bulbs with LED lighting')], usage)
+    annual = 1000.0 * 365 / 91
+    lighting = MEASURE_NAMES.index('lighting')
+    assert result['kwh'][0] == pytest.approx(annual * ELECTRIC_FRACTION[lighting])
+    assert result['dollars'][0] == pytest.approx(result['kwh'][0] * 0.2)
+
+
+def test_estimate_scales_with_age():
+    old, new = estimate([_finding(1, year_built=1900), _finding(2, audit_id=2, year_built=2020)], [])['kwh']
+    assert old / new == pytest.approx(1.5 / 0.5)
+
+
+def test_audit_savings_cache_follows_finding_writes(app):
+    savings.clear_cache()
+    prop = Property(street='1 Main St', sqft=1000, year_built=1980)
+    audit = Audit(property=prop)
+    step = AuditStep(audit=audit, step_type='attic')
+    db.session.add_all([prop, audit, step])
+    db.session.commit()
+    assert savings.audit_savings(audit.id)['findings'] == []
+
+    db.session.add(AuditFinding(step=step, title='Attic insulation thin'))
+    db.session.commit()
+    assert len(savings.audit_savings(audit.id)['findings']) == 1
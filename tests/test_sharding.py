@@ -0,0 +1,82 @@
+import json
+import os
+
+import pytest
+from sqlalchemy import text
+
+import sharding
+from models import db, Organization, Property
+from sharding import router, use_organization
+
+
+@pytest.fixture()
+def shards(app, monkeypatch, tmp_path):
+    """Organization 2 on shard 'east', organization 3 on shard 'west', each its own SQLite file."""
+    urls = {name: f"sqlite:///{os.path.join(tmp_path, name)}.db" for name in ('east', 'west')}
+    monkeypatch.setenv('SHARDS', json.dumps(urls))
+    router.dispose()
+    for name in urls:
+        db.metadata.create_all(router.engine(name))
+    db.session.add_all([Organization(id=2, name='East', shard='east'), Organization(id=3, name='West', shard='west')])
+    db.session.commit()
+    router.invalidate()
+    yield urls
+    db.session.remove()
+    monkeypatch.delenv('SHARDS')
+    router.dispose()
+    router.invalidate()
+
+
+def test_organizations_are_routed_to_their_own_shard(shards):
+    for organization_id, street in ((2, '1 East St'), (3, '1 West St')):
+        with use_organization(organization_id):
+            db.session.add(Property(street=street))
+            db.session.commit()
+
+    for name, street in (('east', '1 East St'), ('west', '1 West St')):
+        with router.engine(name).connect() as conn:
+            assert conn.execute(text("SELECT street FROM properties")).scalars().all() == [street]
+
+    with use_organization(3):
+        rows = db.session.execute(db.select(Property).execution_options(all_tenants=True)).scalars().all()
+        assert [p.street for p in rows] == ['1 West St']
+
+
+def test_requests_only_see_their_organizations_shard(shards, client):
+    created = client.post('/api/properties', json={'street': '1 East St'}, headers={'X-Organization-Id': '2'})
+    assert created.status_code == 201
+    assert client.get('/api/properties', headers={'X-Organization-Id': '3'}).get_json() == []
+    assert [p['street'] for p in client.get('/api/properties', headers={'X-Organization-Id': '2'}).get_json()] == [
+        '1 East St']
+
+
+def test_unknown_organizations_are_negatively_cached(app, monkeypatch):
+    router.invalidate()
+    loads = []
+    original = router._load_routes
+    monkeypatch.setattr(router, '_load_routes', lambda: loads.append(1) or original())
+
+    assert router.shard_for(1) == 'default'
+    for _ in range(5):
+        assert router.shard_for(999) is None
+    assert len(loads) == 1  # the first load was too recent to reload for 999
+
+    monkeypatch.setattr(sharding, 'MIN_RELOAD_INTERVAL', -1)
+    assert router.shard_for(999) is None
+    assert router.shard_for(999) is None
+    assert len(loads) == 2  # 999 reloaded once, then remembered as unknown
+
+
+def test_shards_are_migrated_separately(app, monkeypatch, tmp_path):
+    urls = {name: f"sqlite:///{os.path.join(tmp_path, name)}.db" for name in ('east', 'west')}
+    monkeypatch.setenv('SHARDS', json.dumps(urls))
+    router.dispose()
+    try:
+        # An early revision: the later ones need Postgres
+        result = app.test_cli_runner().invoke(args=['db-upgrade-shards', '--revision', '7e6d4c1317b4'])
+        assert result.exit_code == 0, result.output
+        for name in urls:
+            with router.engine(name).connect() as conn:
+                assert conn.execute(text("SELECT version_num FROM alembic_version")).scalar() == '7e6d4c1317b4'
+    finally:
+        router.dispose()
@@ -0,0 +1,86 @@
+import pytest
+
+from archive import compact_changes
+from models import db, Audit, AuditChange, AuditFinding, AuditStep, Property
+
+
+@pytest.fixture()
+def audit(app):
+    prop = Property(street='1 Main St')
+    audit = Audit(property=prop)
+    db.session.add_all([prop, audit])
+    db.session.commit()
+    return audit
+
+
+def _sync(client, audit, *operations, token=0):
+    response = client.post(f'/api/audits/{audit.id}/sync', json={'sync_token': token, 'operations': list(operations)})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _step(client, audit):
+    body = _sync(client, audit, {'op_id': 'create', 'entity': 'step', 'ref': 's1',
+                                 'data': {'step_type': 'attic', 'label': 'Attic', 'notes': 'tablet'}})
+    return body['results'][0]['id'], body['sync_token']
+
+
+def test_concurrently_changed_step_merges(client, audit):
+    step_id, token = _step(client, audit)
+    step = db.session.get(AuditStep, step_id)
+    step.notes = 'office'
+    db.session.commit()
+
+    body = _sync(client, audit, {'op_id': 'edit', 'entity': 'step', 'id': step_id, 'base_version': token,
+                                 'data': {'is_completed': True, 'notes': 'tablet again'}})
+    assert body['results'][0]['status'] == 'merged'
+    step = db.session.get(AuditStep, step_id)
+    assert step.is_completed is True
+    assert step.notes == 'office'
+
+
+def test_concurrently_changed_finding_keeps_server_version(client, audit):
+    step_id, _ = _step(client, audit)
+    body = _sync(client, audit, {'op_id': 'finding', 'entity': 'finding', 'data': {'step_id': step_id, 'title': 'a'}})
+    finding_id, token = body['results'][0]['id'], body['sync_token']
+    db.session.get(AuditFinding, finding_id).title = 'server'
+    db.session.commit()
+
+    body = _sync(client, audit, {'op_id': 'stale', 'entity': 'finding', 'id': finding_id, 'base_version': token,
+                                 'data': {'title': 'tablet'}})
+    assert body['results'][0]['status'] == 'conflict'
+    assert db.session.get(AuditFinding, finding_id).title == 'server'
+
+
+def test_duplicate_op_id_is_not_applied_twice(client, audit):
+    step_id, _ = _step(client, audit)
+    op = {'op_id': 'f1', 'entity': 'finding', 'data': {'step_ref': 's1', 'title': 'once'}}
+    first = _sync(client, audit, {'op_id': 'create', 'entity': 'step', 'ref': 's1', 'data': {}}, op)
+    assert [r['status'] for r in first['results']] == ['duplicate', 'applied']
+    again = _sync(client, audit, op)
+    assert again['results'][0] == {'op_id': 'f1', 'status': 'duplicate', 'id': first['results'][1]['id']}
+    assert AuditFinding.query.filter_by(step_id=step_id).count() == 1
+
+
+@pytest.mark.parametrize('payload', [
+    {'operations': [{'op_id': 'v', 'entity': 'step', 'data': 'x'}]},
+    {'operations': [{'op_id': 'v', 'entity': 'finding', 'id': 'seven'}]},
+    ['not', 'an', 'object'],
+])
+def test_malformed_operations_are_rejected(client, audit, payload):
+    response = client.post(f'/api/audits/{audit.id}/sync', json=payload)
+    assert response.status_code == 400
+
+
+def test_compacted_changes_keep_deltas(client, audit):
+    step_id, token = _step(client, audit)
+    for i in range(3):
+        token = _sync(client, audit, {'op_id': f'n{i}', 'entity': 'step', 'id': step_id, 'base_version': token,
+                                      'data': {'notes': str(i)}})['sync_token']
+    before = _sync(client, audit, token=1)
+
+    assert compact_changes([audit.id]) == 3
+    db.session.commit()
+    assert AuditChange.query.filter_by(audit_id=audit.id).count() == 1
+    assert _sync(client, audit, token=1) == before
+    assert _sync(client, audit, token=token)['steps'] == []
@@ -0,0 +1,113 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from models import db, Organization, Property, UtilityBill, UtilityUsage
+from sharding import use_organization
+from utility_bills import (CLAIM_TIMEOUT_MINUTES, _claim, _claim_pending, cached_bill, parse_bill,
+                           parse_bill_text, parse_green_button_csv, register_bill)
+
+CSV = (
+    "Name,Jane Doe\n"
+    "TYPE,DATE,START TIME,END TIME,USAGE,UNITS,COST,NOTES\n"
+    "Electric usage,2024-01-01,00:00,23:59,30.5,kWh,$4.50,\n"
+    "Electric usage,2024-01-02,00:00,23:59,20.0,kWh,$3.00,\n"
+    "Electric usage,2024-02-01,00:00,23:59,10.0,kWh,,\n"
+    "Gas usage,01/15/2024,00:00,23:59,4,therms,$6.00,\n"
+)
+
+STATEMENT = """
+Service period 01/05/2024 - 02/04/2024
+Line item: 120 kWh at tier 1
+Total electric use 845.5 kWh
+Gas use 32 therms
+Total current charges $ 187.42
+"""
+
+
+def test_green_button_csv_aggregates_monthly():
+    rows = parse_green_button_csv(CSV)
+    assert [(r['fuel'], r['period_start']) for r in rows] == [
+        ('electric', date(2024, 1, 1)), ('gas', date(2024, 1, 1)), ('electric', date(2024, 2, 1))]
+    january = rows[0]
+    assert january['usage'] == 50.5
+    assert january['cost'] == 7.5
+    assert january['period_end'] == date(2024, 1, 31)
+    assert rows[2]['cost'] is None
+
+
+def test_green_button_csv_without_header_fails():
+    rows, error = parse_bill('bill.csv', b'a,b,c\n1,2,3\n')
+    assert rows == []
+    assert error.startswith('ValueError')
+
+
+def test_bill_text_takes_largest_usage_and_one_cost():
+    rows = {r['fuel']: r for r in parse_bill_text(STATEMENT)}
+    assert rows['electric']['usage'] == 845.5
+    assert rows['gas']['usage'] == 32
+    assert rows['electric']['period_start'] == date(2024, 1, 5)
+    assert [r['cost'] for r in parse_bill_text(STATEMENT)] == [187.42, None]
+
+
+def test_bill_text_without_period_fails():
+    with pytest.raises(ValueError, match='No billing period'):
+        parse_bill_text('Total 845 kWh')
+
+
+def _bill(property_id, content_hash='abc', status='pending', **fields):
+    bill = UtilityBill(property_id=property_id, file_name='bill.csv', content_hash=content_hash, status=status,
+                       **fields)
+    db.session.add(bill)
+    db.session.commit()
+    return bill
+
+
+def test_claim_is_taken_once(app):
+    prop = Property(street='1 Main St')
+    db.session.add(prop)
+    db.session.commit()
+    bill = _bill(prop.id)
+
+    assert _claim(bill.id) is True
+    assert _claim(bill.id) is False
+    assert _claim_pending(10) == []
+
+
+def test_stale_claims_are_retaken(app):
+    prop = Property(street='1 Main St')
+    db.session.add(prop)
+    db.session.commit()
+    stale = _bill(prop.id, status='processing',
+                  claimed_at=datetime.utcnow() - timedelta(minutes=CLAIM_TIMEOUT_MINUTES + 1))
+    fresh = _bill(prop.id, content_hash='def', status='processing', claimed_at=datetime.utcnow())
+    db.session.add(UtilityUsage(bill_id=stale.id, property_id=prop.id, fuel='electric', unit='kWh',
+                                period_start=date(2024, 1, 1), period_end=date(2024, 1, 31), usage=1.0))
+    db.session.commit()
+
+    assert [b.id for b in _claim_pending(10)] == [stale.id]
+    assert UtilityUsage.query.filter_by(bill_id=stale.id).count() == 0  # partial rows cleared
+    assert fresh.id not in [b.id for b in _claim_pending(10)]
+
+
+def test_parsed_bills_are_not_shared_between_organizations(app):
+    db.session.add(Organization(id=2, name='Other'))
+    db.session.commit()
+    with use_organization(1):
+        prop = Property(street='1 Main St')
+        db.session.add(prop)
+        db.session.commit()
+        parsed = _bill(prop.id, status='parsed')
+        db.session.add(UtilityUsage(bill_id=parsed.id, property_id=prop.id, fuel='electric', unit='kWh',
+                                    period_start=date(2024, 1, 1), period_end=date(2024, 1, 31), usage=9.0))
+        db.session.commit()
+        assert cached_bill(1, 'abc').id == parsed.id
+
+    with use_organization(2):
+        other = Property(street='2 Main St')
+        db.session.add(other)
+        db.session.commit()
+        assert cached_bill(2, 'abc') is None
+        bill, needs_parse = register_bill(other.id, 'bill.csv', 'path', b'same bytes')
+        assert needs_parse
+        assert UtilityUsage.query.filter_by(property_id=other.id).count() == 0
@@ -0,0 +1,332 @@
+# utility_bills.py
+# Turns uploaded utility bills (PDF statements or Green Button CSV exports) into
+# normalized rows in utility_usage. Parsing is a pure function of the file bytes, so
+# results are cached by sha256 within an organization: a re-upload of the same file is
+# never parsed twice.
+#
+# A bill is parsed by whoever claims it first, the upload's background thread or `flask
+# parse-bills`. Claiming flips 'pending' to 'processing' with a conditional UPDATE and stamps
+# claimed_at. Bills still 'processing' after CLAIM_TIMEOUT_MINUTES belong to a parser that
+# died, and the next `flask parse-bills` takes them over. At most MAX_QUEUED_PARSES
+# uploads wait for a background thread; bills past that stay 'pending' for the CLI.
+import csv
+import hashlib
+import io
+import re
+import threading
+from calendar import monthrange
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+
+from models import db, UtilityBill, UtilityUsage
+from sharding import current_organization_id, use_organization
+
+CLAIM_BATCH_SIZE = 200
+CLAIM_TIMEOUT_MINUTES = 30
+DOWNLOAD_THREADS = 16
+MAX_QUEUED_PARSES = 8
+
+UNITS = {
+    'kwh': ('electric', 'kWh'),
+    'therm': ('gas', 'therm'),
+    'therms': ('gas', 'therm'),
+}
+
+# Single bills parsed right after upload; the backlog goes through parse_pending_bills
+_executor = ThreadPoolExecutor(max_workers=2)
+_queued = threading.BoundedSemaphore(MAX_QUEUED_PARSES)  # bills held in memory until parsed
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+# ---------------------- PARSERS ----------------------
+def _to_float(value):
+    if value is None:
+        return None
+    cleaned = re.sub(r'[^0-9.\-]', '', str(value))
+    try:
+        return float(cleaned) if cleaned else None
+    except ValueError:
+        return None
+
+
+def _to_date(value):
+    value = value.strip()
+    for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%Y/%m/%d'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_green_button_csv(text):
+    """Aggregate a Green Button CSV export (interval or billing rows) into monthly usage."""
+    lines = text.splitlines()
+    header_at = next(
+        (i for i, line in enumerate(lines) if 'USAGE' in line.upper() and 'UNITS' in line.upper()),
+        None,
+    )
+    if header_at is None:
+        raise ValueError('No USAGE/UNITS header found in CSV')
+
+    reader = csv.DictReader(lines[header_at:])
+    months = defaultdict(lambda: [0.0, None])
+    for row in reader:
+        row = {(k or '').strip().upper(): (v or '').strip() for k, v in row.items()}
+        unit_info = UNITS.get(row.get('UNITS', '').lower())
+        day = _to_date(row.get('DATE') or row.get('START DATE') or '')
+        usage = _to_float(row.get('USAGE'))
+        if not unit_info or not day or usage is None:
+            continue
+        bucket = months[(unit_info, day.year, day.month)]
+        bucket[0] += usage
+        cost = _to_float(row.get('COST'))
+        if cost is not None:
+            bucket[1] = (bucket[1] or 0.0) + cost
+
+    return [
+        {
+            'fuel': fuel,
+            'unit': unit,
+            'period_start': date(year, month, 1),
+            'period_end': date(year, month, monthrange(year, month)[1]),
+            'usage': round(usage, 3),
+            'cost': round(cost, 2) if cost is not None else None,
+        }
+        for ((fuel, unit), year, month), (usage, cost) in sorted(months.items(), key=lambda kv: kv[0][1:])
+    ]
+
+
+_PERIOD_RE = re.compile(
+    r'(\d{1,2}/\d{1,2}/\d{2,4})\s*(?:-|–|to|through)\s*(\d{1,2}/\d{1,2}/\d{2,4})', re.IGNORECASE)
+_USAGE_RE = re.compile(r'([\d,]+(?:\.\d+)?)\s*(kwh|therms?)\b', re.IGNORECASE)
+_COST_RE = re.compile(
+    r'(?:amount due|total (?:current )?charges|total due)[^\d$]*\$?\s*([\d,]+\.\d{2})', re.IGNORECASE)
+
+
+def parse_bill_text(text):
+    """Pull the billing period, total kWh/therms and amount due out of a statement's text."""
+    period = _PERIOD_RE.search(text)
+    if not period:
+        raise ValueError('No billing period found')
+    start, end = _to_date(period.group(1)), _to_date(period.group(2))
+    if not start or not end:
+        raise ValueError('Unreadable billing period')
+
+    # Statements repeat usage in line items; the total is the largest figure per unit
+    totals = {}
+    for amount, unit in _USAGE_RE.findall(text):
+        fuel, norm_unit = UNITS[unit.lower()]
+        value = _to_float(amount)
+        if value is not None and value > totals.get((fuel, norm_unit), -1):
+            totals[(fuel, norm_unit)] = value
+    if not totals:
+        raise ValueError('No kWh or therm usage found')
+
+    cost_match = _COST_RE.search(text)
+    cost = _to_float(cost_match.group(1)) if cost_match else None
+    rows = []
+    for (fuel, unit), usage in totals.items():
+        rows.append({
+            'fuel': fuel,
+            'unit': unit,
+            'period_start': start,
+            'period_end': end,
+            'usage': usage,
+            # A combined bill has one amount due; attach it to a single fuel so totals add up
+            'cost': cost if not rows else None,
+        })
+    return rows
+
+
+def _pdf_text(content):
+    from pypdf import PdfReader  # only the parsing workers need it
+    reader = PdfReader(io.BytesIO(content))
+    return '\n'.join(page.extract_text() or '' for page in reader.pages)
+
+
+def parse_bill(file_name, content):
+    """Parse raw bill bytes. Returns (rows, error); safe to run in a worker process."""
+    try:
+        if content[:5] == b'%PDF-' or (file_name or '').lower().endswith('.pdf'):
+            return parse_bill_text(_pdf_text(content)), None
+        return parse_green_button_csv(content.decode('utf-8-sig', errors='replace')), None
+    except Exception as e:
+        return [], f'{type(e).__name__}: {e}'
+
+
+# ---------------------- STORE ----------------------
+def _store_result(bill, rows, error):
+    bill.parsed_at = datetime.utcnow()
+    if error:
+        bill.status = 'failed'
+        bill.error = error
+        return
+    bill.status = 'parsed'
+    bill.error = None
+    db.session.bulk_insert_mappings(UtilityUsage, [
+        {**row, 'bill_id': bill.id, 'property_id': bill.property_id, 'organization_id': bill.organization_id}
+        for row in rows
+    ])
+
+
+def _copy_from_cache(bill, cached):
+    rows = [
+        {
+            'fuel': u.fuel, 'unit': u.unit, 'period_start': u.period_start,
+            'period_end': u.period_end, 'usage': u.usage, 'cost': u.cost,
+        }
+        for u in cached.usage
+    ]
+    _store_result(bill, rows, None)
+
+
+def cached_bill(organization_id, hash_value):
+    # Explicit organization: `flask parse-bills` runs without a tenant filter
+    return UtilityBill.query.filter_by(organization_id=organization_id, content_hash=hash_value,
+                                       status='parsed').first()
+
+
+def register_bill(property_id, file_name, storage_path, content):
+    """Record an uploaded bill. Returns (bill, needs_parse)."""
+    hash_value = content_hash(content)
+    existing = UtilityBill.query.filter_by(property_id=property_id, content_hash=hash_value).first()
+    if existing:
+        if existing.status != 'failed':
+            return existing, False
+        existing.status = 'pending'  # parse it again
+        db.session.commit()
+        return existing, True
+
+    bill = UtilityBill(
+        property_id=property_id,
+        file_name=file_name,
+        storage_path=storage_path,
+        content_hash=hash_value,
+        status='pending',
+    )
+    db.session.add(bill)
+    db.session.flush()
+
+    cached = cached_bill(bill.organization_id, hash_value)
+    if cached:
+        _copy_from_cache(bill, cached)
+    db.session.commit()
+    return bill, bill.status == 'pending'
+
+
+def enqueue_parse(app, bill_id, file_name, content):
+    """Parse in the background. Returns None, leaving the bill to `flask parse-bills`, if the queue is full."""
+    if not _queued.acquire(blocking=False):
+        return None
+    organization_id = current_organization_id()
+
+    def work():
+        try:
+            with app.app_context(), use_organization(organization_id):
+                if not _claim(bill_id):
+                    return  # already taken by `flask parse-bills`
+                rows, error = parse_bill(file_name, content)
+                bill = UtilityBill.query.get(bill_id)
+                _store_result(bill, rows, error)
+                db.session.commit()
+        finally:
+            _queued.release()
+
+    return _executor.submit(work)
+
+
+def _claim(bill_id):
+    """Take one pending bill. False if someone else already has it."""
+    result = db.session.execute(
+        update(UtilityBill)
+        .where(UtilityBill.id == bill_id, UtilityBill.status == 'pending')
+        .values(status='processing', claimed_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _claim_pending(limit):
+    stale = datetime.utcnow() - timedelta(minutes=CLAIM_TIMEOUT_MINUTES)
+    # SKIP LOCKED lets several `flask parse-bills` processes drain the backlog side by side
+    bills = (
+        UtilityBill.query.filter(or_(
+            UtilityBill.status == 'pending',
+            and_(UtilityBill.status == 'processing',
+                 or_(UtilityBill.claimed_at.is_(None), UtilityBill.claimed_at < stale)),
+        ))
+        .order_by(UtilityBill.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    now = datetime.utcnow()
+    for bill in bills:
+        bill.status = 'processing'
+        bill.claimed_at = now
+    if bills:
+        # Rows a dead parser may have written before it stopped
+        UtilityUsage.query.filter(UtilityUsage.bill_id.in_([b.id for b in bills])).delete(synchronize_session=False)
+    db.session.commit()
+    return bills
+
+
+def parse_pending_bills(fetch, workers=None, batch_size=CLAIM_BATCH_SIZE):
+    """Drain pending bills. `fetch(storage_path)` returns the stored bytes."""
+    parsed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as downloads:
+        while True:
+            bills = _claim_pending(batch_size)
+            if not bills:
+                break
+
+            to_parse = []
+            for bill in bills:
+                cached = cached_bill(bill.organization_id, bill.content_hash)
+                if cached:
+                    _copy_from_cache(bill, cached)
+                else:
+                    to_parse.append(bill)
+
+            def download(bill):
+                try:
+                    return fetch(bill.storage_path)
+                except Exception as e:
+                    print(f"❌ Could not download bill {bill.id}: {e}")
+                    return None
+
+            contents = list(downloads.map(download, to_parse))
+            fetched = [(b, c) for b, c in zip(to_parse, contents) if c is not None]
+            for bill, content in zip(to_parse, contents):
+                if content is None:
+                    _store_result(bill, [], 'Download failed')
+
+            # Identical files in the same batch are parsed once
+            unique = {}
+            for bill, content in fetched:
+                unique.setdefault(bill.content_hash, (bill.file_name, content))
+            hashes = list(unique)
+            results = dict(zip(hashes, pool.map(
+                parse_bill,
+                [unique[h][0] for h in hashes],
+                [unique[h][1] for h in hashes],
+                chunksize=8,
+            )))
+
+            for bill, _ in fetched:
+                rows, error = results[bill.content_hash]
+                _store_result(bill, rows, error)
+            db.session.commit()
+
+            parsed += sum(1 for b in bills if b.status == 'parsed')
+            failed += sum(1 for b in bills if b.status == 'failed')
+    return parsed, failed